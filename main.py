@@ -13,6 +13,8 @@ def arg_parser():
     parser.add_argument("--project", type=str, default="ccus_project")
     parser.add_argument("--resume", type=str, default=None, help="resume from a checkpoint")# 作用是从一个checkpoint恢复
     parser.add_argument("--gpu", type=str, default="1", help="gpu id")  # 修改 GPU 在这里
+    parser.add_argument("--uie_workers", type=int, default=None, help="number of UIE extraction processes")
+    parser.add_argument("--ingest", type=str, nargs="+", default=None, help="incrementally ingest new text files or directories")
     args = parser.parse_args()
     return args
 
@@ -29,6 +31,10 @@ if __name__ == "__main__":
         # startup
         kg_builder.get_base_kg_from_txt()  # 预计用时：
 
+    if args.ingest is not None:
+        # 增量导入新文档，只处理新增的句子
+        kg_builder.ingest(args.ingest)
+
     # iteration
     max_iteration = 10
 
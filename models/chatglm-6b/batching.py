@@ -0,0 +1,272 @@
+""" Continuous batching for ChatGLM generation.
+
+`stream_generate` decodes one conversation at a time, so concurrent chats either queue behind each other or
+race on the same model. ContinuousBatchingScheduler owns the model in a single worker thread instead:
+
+- new requests wait in a queue and are admitted between decode steps, up to `max_batch_size` at a time
+- an admitted request is prefilled on its own (reusing the prefix KV cache when enabled) and then joins the batch
+- every step decodes one token for all running sequences with a single forward pass
+- finished or abandoned sequences leave the batch right after the step that finished them
+
+Sequences in the batch have different lengths, so their key/value caches are left padded to a common length
+([seq_len, batch, num_attention_heads, hidden_size_per_attention_head]) and the padding is masked out.
+Sampling, logits processors and stopping criteria are resolved per request exactly like `stream_generate` does.
+"""
+
+import time
+import queue
+import threading
+from collections import deque
+
+import torch
+from transformers.utils import logging
+
+logger = logging.get_logger(__name__)
+
+
+def left_pad_past(past_key_values, length):
+    return tuple(
+        (torch.cat([key.new_zeros((length,) + key.shape[1:]), key]),
+         torch.cat([value.new_zeros((length,) + value.shape[1:]), value]))
+        for key, value in past_key_values
+    )
+
+
+class GenerationRequest:
+    def __init__(self, input_ids, generation_config, eos_token_id, logits_processor, stopping_criteria,
+                 logits_warper):
+        self.input_ids = input_ids  # [1, seq_len], grows by one token per step
+        self.generation_config = generation_config
+        self.eos_token_id = eos_token_id
+        self.logits_processor = logits_processor
+        self.stopping_criteria = stopping_criteria
+        self.logits_warper = logits_warper
+        self.outputs = queue.Queue()  # input_ids after every token, None when finished, or an exception
+        self.cancelled = False
+        self.mask_position = None
+        self.context_length = None
+
+
+class ContinuousBatchingScheduler:
+    def __init__(self, model, max_batch_size=8, stats_window=10.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.stats_window = stats_window
+
+        self.condition = threading.Condition()
+        self.waiting = deque()
+        self.running = False
+        self.thread = None
+
+        # only touched by the scheduler thread
+        self.active = []
+        self.padding = []  # left padding of each active sequence in past_key_values
+        self.past_key_values = None
+
+        self.steps = 0
+        self.generated_tokens = 0
+        self.finished_requests = 0
+        self.token_times = deque()  # (time, tokens) of recent steps, for tokens/s
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, name="chatglm-scheduler", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, input_ids, **kwargs):
+        """Queue a single prompt ([1, seq_len]); kwargs are the same as for `stream_generate`.
+
+        All sequences share one key/value cache that grows by concatenation, so `static_kv_cache` and model kwargs
+        such as `past_key_values` or `attention_mask` do not apply here; they are ignored with a warning.
+        """
+        generation_config, model_kwargs, eos_token_id, logits_processor, stopping_criteria, logits_warper = \
+            self.model.prepare_stream_generation(input_ids, **kwargs)
+        if model_kwargs:
+            logger.warning_once(f"Continuous batching ignores unsupported arguments: {', '.join(sorted(model_kwargs))}")
+        request = GenerationRequest(input_ids, generation_config, eos_token_id, logits_processor,
+                                    stopping_criteria, logits_warper)
+        with self.condition:
+            self.waiting.append(request)
+            self.condition.notify()
+        return request
+
+    def stream(self, request):
+        """Yield the request's input_ids after every generated token, like `stream_generate`."""
+        try:
+            while True:
+                outputs = request.outputs.get()
+                if outputs is None:
+                    return
+                if isinstance(outputs, Exception):
+                    raise outputs
+                yield outputs
+        finally:
+            # the consumer went away (e.g. the client disconnected), drop the sequence at the next step
+            request.cancelled = True
+
+    def stream_generate(self, input_ids, **kwargs):
+        return self.stream(self.submit(input_ids, **kwargs))
+
+    def stats(self):
+        now = time.monotonic()
+        recent = [(t, n) for t, n in list(self.token_times) if now - t <= self.stats_window]
+        elapsed = now - recent[0][0] if len(recent) > 1 else 0.0
+        return {
+            "queue_depth": len(self.waiting),
+            "active": len(self.active),
+            "max_batch_size": self.max_batch_size,
+            "steps": self.steps,
+            "generated_tokens": self.generated_tokens,
+            "finished_requests": self.finished_requests,
+            "tokens_per_second": sum(n for _, n in recent[1:]) / elapsed if elapsed else 0.0,
+        }
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.waiting and not self.active:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                admitted = []
+                while self.waiting and len(self.active) + len(admitted) < self.max_batch_size:
+                    admitted.append(self.waiting.popleft())
+
+            for request in admitted:
+                if request.cancelled:
+                    continue
+                try:
+                    self._prefill(request)
+                except Exception as e:
+                    logger.warning(f"Prefill failed: {e}")
+                    request.outputs.put(e)
+
+            if self.active:
+                try:
+                    self._decode_step()
+                except Exception as e:
+                    logger.warning(f"Decode step failed, dropping {len(self.active)} sequences: {e}")
+                    for request in self.active:
+                        request.outputs.put(e)
+                    self.active, self.padding, self.past_key_values = [], [], None
+
+    @torch.no_grad()
+    def _prefill(self, request):
+        model = self.model
+        input_ids = request.input_ids
+        config = model.config
+
+        seq = input_ids[0].tolist()
+        mask_token = config.gmask_token_id if config.gmask_token_id in seq else config.mask_token_id
+        request.mask_position = seq.index(mask_token)
+        request.context_length = seq.index(config.bos_token_id)
+
+        past_key_values = attention_mask = position_ids = None
+        if getattr(model, "prefix_cache", None) is not None:
+            past_key_values, attention_mask, position_ids = model.prefill_prefix(input_ids)
+        model_inputs = model.prepare_inputs_for_generation(
+            input_ids, past_key_values=past_key_values, attention_mask=attention_mask, position_ids=position_ids
+        )
+        outputs = model(**model_inputs, return_dict=True)
+
+        if self._sample(request, outputs.logits[:, -1, :]):
+            self.finished_requests += 1
+        else:
+            self._join(request, outputs.past_key_values)
+        self._record(1)
+
+    def _join(self, request, past_key_values):
+        if self.past_key_values is None:
+            self.past_key_values, self.padding, self.active = past_key_values, [0], [request]
+            return
+
+        length, batch_length = past_key_values[0][0].size(0), self.past_key_values[0][0].size(0)
+        if length < batch_length:
+            past_key_values = left_pad_past(past_key_values, batch_length - length)
+        elif length > batch_length:
+            self.past_key_values = left_pad_past(self.past_key_values, length - batch_length)
+            self.padding = [padding + length - batch_length for padding in self.padding]
+
+        self.past_key_values = tuple(
+            (torch.cat([batch_key, key], dim=1), torch.cat([batch_value, value], dim=1))
+            for (batch_key, batch_value), (key, value) in zip(self.past_key_values, past_key_values)
+        )
+        self.padding.append(max(batch_length - length, 0))
+        self.active.append(request)
+
+    @torch.no_grad()
+    def _decode_step(self):
+        device = self.past_key_values[0][0].device
+        batch_length = self.past_key_values[0][0].size(0)
+
+        input_ids = torch.cat([request.input_ids[:, -1:] for request in self.active])
+        position_ids = torch.tensor(
+            [[[request.mask_position], [request.input_ids.size(1) - request.context_length]]
+             for request in self.active], dtype=torch.long, device=device)
+        attention_mask = torch.zeros((len(self.active), 1, 1, batch_length + 1), dtype=torch.bool, device=device)
+        for i, padding in enumerate(self.padding):
+            attention_mask[i, :, :, :padding] = True
+
+        outputs = self.model(
+            input_ids=input_ids,
+            past_key_values=self.past_key_values,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            return_dict=True,
+        )
+        self.past_key_values = outputs.past_key_values
+        logits = outputs.logits[:, -1, :]
+
+        finished = [i for i, request in enumerate(self.active)
+                    if request.cancelled or self._sample(request, logits[i:i + 1])]
+        self.steps += 1
+        self._record(len(self.active))
+        if finished:
+            self._evict(finished)
+
+    def _sample(self, request, next_token_logits):
+        """Append the next token of one request; returns True when the request is finished."""
+        next_tokens = self.model.sample_next_tokens(request.input_ids, next_token_logits, request.generation_config,
+                                                    request.logits_processor, request.logits_warper)
+        request.input_ids = torch.cat([request.input_ids, next_tokens[:, None]], dim=-1)
+        if next_tokens.item() in request.eos_token_id or request.stopping_criteria(request.input_ids, None):
+            request.outputs.put(None)
+            return True
+        request.outputs.put(request.input_ids)
+        return False
+
+    def _evict(self, finished):
+        finished = set(finished)
+        self.finished_requests += len(finished)
+        keep = [i for i in range(len(self.active)) if i not in finished]
+        if not keep:
+            self.active, self.padding, self.past_key_values = [], [], None
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=self.past_key_values[0][0].device)
+        padding = [self.padding[i] for i in keep]
+        trim = min(padding)  # padding every remaining sequence shares can be dropped
+        self.past_key_values = tuple(
+            (key.index_select(1, index)[trim:], value.index_select(1, index)[trim:])
+            for key, value in self.past_key_values
+        )
+        self.padding = [p - trim for p in padding]
+        self.active = [self.active[i] for i in keep]
+
+    def _record(self, tokens):
+        now = time.monotonic()
+        self.generated_tokens += tokens
+        self.token_times.append((now, tokens))
+        while self.token_times and now - self.token_times[0][0] > self.stats_window:
+            self.token_times.popleft()
+
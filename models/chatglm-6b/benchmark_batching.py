@@ -0,0 +1,59 @@
+""" Sequential `stream_generate` vs. the continuous batching scheduler on the same greedy requests.
+
+Runs on a small randomly initialized ChatGLM (see `prefix_cache.load_tiny_model`), so it works on CPU:
+
+    python models/chatglm-6b/benchmark_batching.py
+"""
+
+import time
+
+import torch
+
+from batching import ContinuousBatchingScheduler
+from prefix_cache import load_tiny_model
+
+
+def benchmark(model, num_requests=16, prompt_length=64, new_tokens=64, max_batch_size=8):
+    config = model.config
+    torch.manual_seed(0)
+    prompts = []
+    for _ in range(num_requests):
+        length = int(torch.randint(prompt_length // 2, prompt_length + 1, ()))
+        ids = torch.randint(20005, config.mask_token_id, (length,)).tolist()
+        prompts.append(torch.tensor([ids + [config.gmask_token_id, config.bos_token_id]], dtype=torch.long))
+
+    def gen_kwargs(input_ids):
+        return {"max_length": input_ids.size(1) + new_tokens, "do_sample": False}
+
+    start = time.perf_counter()
+    sequential = []
+    for input_ids in prompts:
+        outputs = input_ids
+        for outputs in model.stream_generate(input_ids, **gen_kwargs(input_ids)):
+            pass
+        sequential.append(outputs[0].tolist())
+    sequential_time = time.perf_counter() - start
+
+    scheduler = ContinuousBatchingScheduler(model, max_batch_size=max_batch_size).start()
+    start = time.perf_counter()
+    requests = [scheduler.submit(input_ids, **gen_kwargs(input_ids)) for input_ids in prompts]
+    batched = []
+    for request in requests:
+        outputs = request.input_ids
+        for outputs in scheduler.stream(request):
+            pass
+        batched.append(outputs[0].tolist())
+    batched_time = time.perf_counter() - start
+    stats = scheduler.stats()
+    scheduler.stop()
+
+    tokens = sum(len(ids) for ids in sequential) - sum(p.size(1) for p in prompts)
+    print(f"sequential: {sequential_time:.2f}s, {tokens / sequential_time:.1f} tokens/s")
+    print(f"batched:    {batched_time:.2f}s, {tokens / batched_time:.1f} tokens/s "
+          f"(max batch {max_batch_size})")
+    print(f"identical greedy outputs: {sum(a == b for a, b in zip(sequential, batched))}/{num_requests}")
+    print(stats)
+
+
+if __name__ == "__main__":
+    benchmark(load_tiny_model())
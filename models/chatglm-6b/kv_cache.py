@@ -0,0 +1,100 @@
+""" Preallocated (static) key/value cache for ChatGLM decoding.
+
+By default `attention_fn` builds each layer's cache with `torch.cat((past_key, key_layer), dim=0)`, which reallocates
+and copies the whole cache on every generated token. StaticLayerCache allocates the buffers of a layer once, sized to
+`max_length`, and `attention_fn` writes the new keys/values in place. It behaves like the usual (key, value) tuple
+of a layer: `layer_past[0]` / `layer_past[1]` are views over the filled positions.
+"""
+
+import torch
+
+
+class StaticLayerCache:
+    def __init__(self, key, value, length=0):
+        # [capacity, batch, num_attention_heads, hidden_size_per_attention_head]
+        self.key = key
+        self.value = value
+        self.length = length
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, idx):
+        return (self.key, self.value)[idx][:self.length]
+
+    def __iter__(self):
+        yield self.key[:self.length]
+        yield self.value[:self.length]
+
+    def update(self, key_layer, value_layer):
+        """Write [seq_len, batch, heads, head_dim] after the filled positions and return views over all of them."""
+        end = self.length + key_layer.size(0)
+        if end > self.key.size(0):
+            self._grow(end)
+        self.key[self.length:end] = key_layer
+        self.value[self.length:end] = value_layer
+        self.length = end
+        return self.key[:end], self.value[:end]
+
+    def _grow(self, min_capacity):
+        # only happens when generation runs past max_length, double to keep appends amortized O(1)
+        capacity = max(min_capacity, 2 * self.key.size(0))
+        key = self.key.new_empty((capacity,) + tuple(self.key.shape[1:]))
+        value = self.value.new_empty((capacity,) + tuple(self.value.shape[1:]))
+        key[:self.length] = self.key[:self.length]
+        value[:self.length] = self.value[:self.length]
+        self.key, self.value = key, value
+
+
+def allocate_static_cache(config, batch_size, max_length, dtype, device, past_key_values=None):
+    """One StaticLayerCache per layer; an existing past (e.g. from the prefix cache) is copied in, not shared."""
+    num_heads = config.num_attention_heads
+    head_dim = config.hidden_size // num_heads
+    if past_key_values is None:
+        past_key_values = [None] * config.num_layers
+
+    caches = []
+    for layer_past in past_key_values:
+        key = torch.empty((max_length, batch_size, num_heads, head_dim), dtype=dtype, device=device)
+        cache = StaticLayerCache(key, torch.empty_like(key))
+        if layer_past is not None:
+            cache.update(layer_past[0], layer_past[1])
+        caches.append(cache)
+    return tuple(caches)
+
+
+def benchmark(model, prompt_length=16, new_tokens=2048, checkpoints=(64, 128, 256, 512, 1024, 2048), window=32):
+    """Per-token decode latency at growing lengths, torch.cat cache vs. static cache."""
+    import time
+
+    config = model.config
+    torch.manual_seed(0)
+    ids = torch.randint(20005, config.mask_token_id, (prompt_length,)).tolist()
+    input_ids = torch.tensor([ids + [config.gmask_token_id, config.bos_token_id]], dtype=torch.long)
+    max_length = input_ids.size(1) + new_tokens
+
+    def token_latencies(static_kv_cache):
+        times = [time.perf_counter()]
+        # min_length keeps the random model from stopping at <eop>
+        for _ in model.stream_generate(input_ids, max_length=max_length, min_length=max_length, do_sample=False,
+                                       static_kv_cache=static_kv_cache):
+            times.append(time.perf_counter())
+        return [end - start for start, end in zip(times, times[1:])]
+
+    dynamic = token_latencies(False)
+    static = token_latencies(True)
+
+    print(f"{'tokens':>7} {'torch.cat (ms/token)':>21} {'static (ms/token)':>18}")
+    for n in checkpoints:
+        n = min(n, len(dynamic), len(static))
+        cat_ms = sum(dynamic[n - window:n]) / window * 1000
+        static_ms = sum(static[n - window:n]) / window * 1000
+        print(f"{n:>7} {cat_ms:>21.2f} {static_ms:>18.2f}")
+
+
+if __name__ == "__main__":
+    # python models/chatglm-6b/kv_cache.py
+    import importlib
+
+    # a plain import statement here would make transformers treat prefix_cache as a pip dependency of the remote code
+    benchmark(importlib.import_module("prefix_cache").load_tiny_model())
@@ -31,6 +31,9 @@ from transformers.generation.logits_process import LogitsProcessor
 from transformers.generation.utils import LogitsProcessorList, StoppingCriteriaList, GenerationConfig, ModelOutput
 
 from .configuration_chatglm import ChatGLMConfig
+from .prefix_cache import PrefixKVCache
+from .batching import ContinuousBatchingScheduler
+from .kv_cache import StaticLayerCache, allocate_static_cache
 
 # flags required to enable jit fusion kernels
 
@@ -198,8 +201,12 @@ class RotaryEmbedding(torch.nn.Module):
         if seq_len is None:
             seq_len = x.shape[seq_dim]
         if self.max_seq_len_cached is None or (seq_len > self.max_seq_len_cached):
-            self.max_seq_len_cached = None if self.learnable else seq_len
-            t = torch.arange(seq_len, device=x.device, dtype=self.inv_freq.dtype)
+            cache_len = seq_len
+            if not self.learnable and self.max_seq_len_cached is not None:
+                # block positions grow by one every decode step, grow geometrically instead of every step
+                cache_len = max(seq_len, 2 * self.max_seq_len_cached)
+            self.max_seq_len_cached = None if self.learnable else cache_len
+            t = torch.arange(cache_len, device=x.device, dtype=self.inv_freq.dtype)
             freqs = torch.einsum('i,j->ij', t, self.inv_freq)
             # Different from paper, but it uses a different permutation in order to obtain the same calculation
             emb = torch.cat((freqs, freqs), dim=-1).to(x.device)
@@ -251,7 +258,10 @@ def attention_fn(
         scaling_attention_score=True,
         use_cache=False,
 ):
-    if layer_past is not None:
+    if isinstance(layer_past, StaticLayerCache):
+        # preallocated buffers, written in place instead of reallocating the whole cache every step
+        key_layer, value_layer = layer_past.update(key_layer, value_layer)
+    elif layer_past is not None:
         past_key, past_value = layer_past[0], layer_past[1]
         key_layer = torch.cat((past_key, key_layer), dim=0)
         value_layer = torch.cat((past_value, value_layer), dim=0)
@@ -260,7 +270,7 @@ def attention_fn(
     seq_len, b, nh, hidden_size = key_layer.shape
 
     if use_cache:
-        present = (key_layer, value_layer)
+        present = layer_past if isinstance(layer_past, StaticLayerCache) else (key_layer, value_layer)
     else:
         present = None
 
@@ -1057,6 +1067,9 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
 
         self.quantized = False
 
+        self.prefix_cache = None
+        self.scheduler = None
+
         if self.config.quantization_bit:
             self.quantize(self.config.quantization_bit, empty_init=True)
 
@@ -1079,15 +1092,14 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
         )
 
         # update attention mask
+        # decode steps only read the last row of the mask and the last position id, so keep just those
+        # instead of growing [seq_len, seq_len] every step
         if "attention_mask" in model_kwargs:
             attention_mask = model_kwargs["attention_mask"]
             if attention_mask is not None and attention_mask.dtype == torch.bool:
-                attention_mask = torch.cat(
-                    [attention_mask, attention_mask.new_ones((*attention_mask.shape[:3], 1))], dim=3)
-                new_attention_mask = attention_mask[:, :, -1:].clone()
-                new_attention_mask[..., -1] = False
+                new_attention_mask = attention_mask[:, :, -1:]
                 model_kwargs["attention_mask"] = torch.cat(
-                    [attention_mask, new_attention_mask], dim=2
+                    [new_attention_mask, new_attention_mask.new_zeros((*new_attention_mask.shape[:3], 1))], dim=3
                 )
 
         # update position ids
@@ -1095,9 +1107,7 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
             position_ids = model_kwargs["position_ids"]
             new_position_id = position_ids[..., -1:].clone()
             new_position_id[:, 1, :] += 1
-            model_kwargs["position_ids"] = torch.cat(
-                [position_ids, new_position_id], dim=-1
-            )
+            model_kwargs["position_ids"] = new_position_id
 
         return model_kwargs
 
@@ -1122,6 +1132,30 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
 
         # only last token for input_ids if past is not None
         if past is not None or past_key_values is not None:
+            if past is None:
+                past = past_key_values
+            # a past restored from the prefix cache may stop before the last token
+            new_length = max(seq_length - past[0][0].size(0), 1)
+            if new_length > 1:
+                new_tokens = input_ids[:, -new_length:]
+                if attention_mask is None or attention_mask.dtype != torch.bool:
+                    attention_mask = self.get_masks(input_ids, device=input_ids.device)
+                attention_mask = attention_mask[:, :, -new_length:]
+                if position_ids is None:
+                    position_ids = self.get_position_ids(
+                        input_ids,
+                        device=input_ids.device,
+                        mask_positions=mask_positions,
+                        use_gmasks=use_gmasks
+                    )
+                position_ids = position_ids[..., -new_length:]
+                return {
+                    "input_ids": new_tokens,
+                    "past_key_values": past,
+                    "position_ids": position_ids,
+                    "attention_mask": attention_mask
+                }
+
             last_token = input_ids[:, -1].unsqueeze(-1)
             if attention_mask is not None and attention_mask.dtype == torch.bool:
                 attention_mask = attention_mask[:, :, -1:]
@@ -1139,8 +1173,6 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
                     position_ids = torch.tensor([mask_position for mask_position in mask_positions], dtype=torch.long,
                                                 device=input_ids.device).unsqueeze(-1)
 
-            if past is None:
-                past = past_key_values
             return {
                 "input_ids": last_token,
                 "past_key_values": past,
@@ -1263,6 +1295,92 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
             response = re.sub(r"%s([\u4e00-\u9fff])" % item[0], r"%s\1" % item[1], response)
         return response
 
+    def enable_prefix_cache(self, max_bytes: int = 2 * 1024 ** 3):
+        """Reuse the KV of already encoded conversation prefixes in `stream_chat`, see prefix_cache.py.
+
+        The cached path attends the context causally, so answers differ from a regular bidirectional prefill.
+        """
+        if self.transformer.pre_seq_len is not None:
+            logger.warning("Prefix KV cache does not support P-tuning v2 prefixes, not enabled.")
+            return None
+        self.prefix_cache = PrefixKVCache(max_bytes)
+        return self.prefix_cache
+
+    def enable_continuous_batching(self, max_batch_size: int = 8):
+        """Serve `stream_chat` from a ContinuousBatchingScheduler that batches concurrent conversations."""
+        if self.scheduler is None:
+            self.scheduler = ContinuousBatchingScheduler(self, max_batch_size=max_batch_size).start()
+        return self.scheduler
+
+    def get_causal_inputs(self, input_ids):
+        """Attention mask and position ids of the prefix-cached path, where the context is attended causally."""
+        batch_size, seq_length = input_ids.shape
+        MASK, gMASK = self.config.mask_token_id, self.config.gmask_token_id
+        mask_positions, use_gmasks = [], []
+        for seq in input_ids.tolist():
+            mask_token = gMASK if gMASK in seq else MASK
+            mask_positions.append(seq.index(mask_token))
+            use_gmasks.append(mask_token == gMASK)
+
+        attention_mask = torch.ones((batch_size, 1, seq_length, seq_length), device=input_ids.device).tril_()
+        attention_mask = (attention_mask < 0.5).bool()
+        position_ids = self.get_position_ids(
+            input_ids,
+            mask_positions=mask_positions,
+            device=input_ids.device,
+            use_gmasks=use_gmasks
+        )
+        return attention_mask, position_ids, mask_positions
+
+    @torch.no_grad()
+    def prefill_prefix(self, input_ids, pinned=False):
+        """Encode the context (tokens before [gMASK]) of a single prompt, reusing the longest cached prefix.
+
+        Returns (past_key_values, attention_mask, position_ids) to be passed on to `stream_generate`, which then
+        only has to prefill [gMASK] and <sop>.
+        """
+        attention_mask, position_ids, mask_positions = self.get_causal_inputs(input_ids)
+        context_length = mask_positions[0]
+        context_ids = input_ids[0, :context_length].tolist()
+
+        cached_length, past_key_values = self.prefix_cache.match(context_ids)
+        if cached_length < context_length:
+            outputs = self.transformer(
+                input_ids=input_ids[:, cached_length:context_length],
+                position_ids=position_ids[..., cached_length:context_length],
+                attention_mask=attention_mask[:, :, cached_length:context_length, :context_length],
+                past_key_values=past_key_values,
+                use_cache=True,
+                return_dict=True,
+            )
+            past_key_values = outputs.past_key_values
+            self.prefix_cache.record_prefill(context_length - cached_length)
+        if cached_length < context_length or pinned:
+            self.prefix_cache.put(context_ids, past_key_values, pinned=pinned)
+        return past_key_values, attention_mask, position_ids
+
+    @torch.no_grad()
+    def cache_history(self, tokenizer, history: List[Tuple[str, str]]):
+        """Encode and pin a history shared by every conversation, e.g. the system prompt round."""
+        if self.prefix_cache is None or not history:
+            return
+        prompt = ""
+        for i, (old_query, response) in enumerate(history):
+            prompt += "[Round {}]\n问：{}\n答：{}\n".format(i, old_query, response)
+        inputs = tokenizer([prompt], return_tensors="pt")
+        inputs = inputs.to(self.device)
+        self.prefill_prefix(inputs["input_ids"], pinned=True)
+
+    @staticmethod
+    def build_prompt(query: str, history: List[Tuple[str, str]] = None):
+        if not history:
+            return query
+        prompt = ""
+        for i, (old_query, response) in enumerate(history):
+            prompt += "[Round {}]\n问：{}\n答：{}\n".format(i, old_query, response)
+        prompt += "[Round {}]\n问：{}\n答：".format(len(history), query)
+        return prompt
+
     @torch.no_grad()
     def chat(self, tokenizer, query: str, history: List[Tuple[str, str]] = None, max_length: int = 2048, num_beams=1,
              do_sample=True, top_p=0.7, temperature=0.95, logits_processor=None, **kwargs):
@@ -1273,13 +1391,7 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
         logits_processor.append(InvalidScoreLogitsProcessor())
         gen_kwargs = {"max_length": max_length, "num_beams": num_beams, "do_sample": do_sample, "top_p": top_p,
                       "temperature": temperature, "logits_processor": logits_processor, **kwargs}
-        if not history:
-            prompt = query
-        else:
-            prompt = ""
-            for i, (old_query, response) in enumerate(history):
-                prompt += "[Round {}]\n问：{}\n答：{}\n".format(i, old_query, response)
-            prompt += "[Round {}]\n问：{}\n答：".format(len(history), query)
+        prompt = self.build_prompt(query, history)
         inputs = tokenizer([prompt], return_tensors="pt")
         inputs = inputs.to(self.device)
         outputs = self.generate(**inputs, **gen_kwargs)
@@ -1291,7 +1403,8 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
 
     @torch.no_grad()
     def stream_chat(self, tokenizer, query: str, history: List[Tuple[str, str]] = None, max_length: int = 2048,
-                    do_sample=True, top_p=0.7, temperature=0.95, logits_processor=None, **kwargs):
+                    do_sample=True, top_p=0.7, temperature=0.95, logits_processor=None, use_prefix_cache=True,
+                    **kwargs):
         if history is None:
             history = []
         if logits_processor is None:
@@ -1299,16 +1412,18 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
         logits_processor.append(InvalidScoreLogitsProcessor())
         gen_kwargs = {"max_length": max_length, "do_sample": do_sample, "top_p": top_p,
                       "temperature": temperature, "logits_processor": logits_processor, **kwargs}
-        if not history:
-            prompt = query
-        else:
-            prompt = ""
-            for i, (old_query, response) in enumerate(history):
-                prompt += "[Round {}]\n问：{}\n答：{}\n".format(i, old_query, response)
-            prompt += "[Round {}]\n问：{}\n答：".format(len(history), query)
+        prompt = self.build_prompt(query, history)
         inputs = tokenizer([prompt], return_tensors="pt")
         inputs = inputs.to(self.device)
-        for outputs in self.stream_generate(**inputs, **gen_kwargs):
+        if self.scheduler is not None:
+            stream = self.scheduler.stream_generate(inputs["input_ids"], **gen_kwargs)
+        elif use_prefix_cache and self.prefix_cache is not None:
+            past_key_values, attention_mask, position_ids = self.prefill_prefix(inputs["input_ids"])
+            stream = self.stream_generate(inputs["input_ids"], past_key_values=past_key_values,
+                                          attention_mask=attention_mask, position_ids=position_ids, **gen_kwargs)
+        else:
+            stream = self.stream_generate(**inputs, **gen_kwargs)
+        for outputs in stream:
             outputs = outputs.tolist()[0][len(inputs["input_ids"][0]):]
             response = tokenizer.decode(outputs)
             response = self.process_response(response)
@@ -1323,8 +1438,62 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
             logits_processor: Optional[LogitsProcessorList] = None,
             stopping_criteria: Optional[StoppingCriteriaList] = None,
             prefix_allowed_tokens_fn: Optional[Callable[[int, torch.Tensor], List[int]]] = None,
+            static_kv_cache: bool = False,
             **kwargs,
     ):
+        generation_config, model_kwargs, eos_token_id, logits_processor, stopping_criteria, logits_warper = \
+            self.prepare_stream_generation(input_ids, generation_config, logits_processor, stopping_criteria,
+                                           prefix_allowed_tokens_fn, **kwargs)
+
+        if static_kv_cache and self.transformer.pre_seq_len is None:
+            # key/value buffers for the whole generation are allocated once, see kv_cache.py
+            model_kwargs["past_key_values"] = allocate_static_cache(
+                self.config, input_ids.size(0), generation_config.max_length,
+                self.transformer.word_embeddings.weight.dtype, input_ids.device,
+                past_key_values=model_kwargs.get("past_key_values"),
+            )
+
+        unfinished_sequences = input_ids.new(input_ids.shape[0]).fill_(1)
+        scores = None
+        while True:
+            model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
+            # forward pass to get next token
+            outputs = self(
+                **model_inputs,
+                return_dict=True,
+                output_attentions=False,
+                output_hidden_states=False,
+            )
+
+            next_token_logits = outputs.logits[:, -1, :]
+            next_tokens = self.sample_next_tokens(input_ids, next_token_logits, generation_config,
+                                                  logits_processor, logits_warper)
+
+            # update generated ids, model inputs, and length for next step
+            input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
+            model_kwargs = self._update_model_kwargs_for_generation(
+                outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
+            )
+            unfinished_sequences = unfinished_sequences.mul((sum(next_tokens != i for i in eos_token_id)).long())
+
+            # stop when each sentence is finished, or if we exceed the maximum length
+            if unfinished_sequences.max() == 0 or stopping_criteria(input_ids, scores):
+                break
+            yield input_ids
+
+    def prepare_stream_generation(
+            self,
+            input_ids,
+            generation_config: Optional[GenerationConfig] = None,
+            logits_processor: Optional[LogitsProcessorList] = None,
+            stopping_criteria: Optional[StoppingCriteriaList] = None,
+            prefix_allowed_tokens_fn: Optional[Callable[[int, torch.Tensor], List[int]]] = None,
+            **kwargs,
+    ):
+        """Resolve the generation config, logits processors and stopping criteria used by `stream_generate`.
+
+        Returns (generation_config, model_kwargs, eos_token_id, logits_processor, stopping_criteria, logits_warper).
+        """
         batch_size, input_ids_seq_length = input_ids.shape[0], input_ids.shape[-1]
 
         if generation_config is None:
@@ -1380,42 +1549,20 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel):
         )
         logits_warper = self._get_logits_warper(generation_config)
 
-        unfinished_sequences = input_ids.new(input_ids.shape[0]).fill_(1)
-        scores = None
-        while True:
-            model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
-            # forward pass to get next token
-            outputs = self(
-                **model_inputs,
-                return_dict=True,
-                output_attentions=False,
-                output_hidden_states=False,
-            )
-
-            next_token_logits = outputs.logits[:, -1, :]
-
-            # pre-process distribution
-            next_token_scores = logits_processor(input_ids, next_token_logits)
-            next_token_scores = logits_warper(input_ids, next_token_scores)
+        return generation_config, model_kwargs, eos_token_id, logits_processor, stopping_criteria, logits_warper
 
-            # sample
-            probs = nn.functional.softmax(next_token_scores, dim=-1)
-            if generation_config.do_sample:
-                next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
-            else:
-                next_tokens = torch.argmax(probs, dim=-1)
+    def sample_next_tokens(self, input_ids, next_token_logits, generation_config, logits_processor, logits_warper):
+        # pre-process distribution
+        next_token_scores = logits_processor(input_ids, next_token_logits)
+        next_token_scores = logits_warper(input_ids, next_token_scores)
 
-            # update generated ids, model inputs, and length for next step
-            input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
-            model_kwargs = self._update_model_kwargs_for_generation(
-                outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
-            )
-            unfinished_sequences = unfinished_sequences.mul((sum(next_tokens != i for i in eos_token_id)).long())
-
-            # stop when each sentence is finished, or if we exceed the maximum length
-            if unfinished_sequences.max() == 0 or stopping_criteria(input_ids, scores):
-                break
-            yield input_ids
+        # sample
+        probs = nn.functional.softmax(next_token_scores, dim=-1)
+        if generation_config.do_sample:
+            next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
+        else:
+            next_tokens = torch.argmax(probs, dim=-1)
+        return next_tokens
 
     def quantize(self, bits: int, empty_init=False, **kwargs):
         if bits == 0:
@@ -0,0 +1,214 @@
+""" Prefix KV cache for multi-turn ChatGLM conversations.
+
+Every turn ChatGLM re-encodes "system prompt + whole history + new query" from scratch, so the prefill before
+the first generated token grows with the conversation. PrefixKVCache keeps the past_key_values of prompts that
+were already encoded, keyed by token ids, so the next turn only prefills the tokens that differ.
+
+GLM attends bidirectionally inside the context, which means the KV of a token depends on every later context
+token and cannot be reused once the prompt grows. With the prefix cache enabled the context is attended causally
+instead, so the KV of any prefix only depends on the prefix itself and can be sliced, extended and shared.
+Everything from [gMASK] on is computed exactly as before. Attending the context causally changes the model's outputs
+compared to a regular bidirectional prefill, so the cache is opt-in (`enable_prefix_cache`).
+"""
+
+import threading
+from collections import OrderedDict
+
+
+def common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+def past_nbytes(past_key_values):
+    return sum(t.numel() * t.element_size() for layer in past_key_values for t in layer)
+
+
+def slice_past(past_key_values, length):
+    # [seq_len, batch, num_attention_heads, hidden_size_per_attention_head]
+    return tuple((key[:length], value[:length]) for key, value in past_key_values)
+
+
+class PrefixKVCache:
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        """
+        Args:
+            max_bytes: upper bound of the bytes held by cached key/value tensors. Least recently used entries are
+                evicted first, pinned entries are never evicted.
+        """
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # tuple(token ids) -> (past_key_values, nbytes)
+        self.pinned = set()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def match(self, token_ids):
+        """Return (length, past_key_values) of the longest cached prefix of token_ids, or (0, None)."""
+        token_ids = tuple(token_ids)
+        best_key, best_length = None, 0
+        with self.lock:
+            for key in self.entries:
+                length = common_prefix_length(key, token_ids)
+                if length > best_length:
+                    best_key, best_length = key, length
+
+            if best_key is None:
+                self.misses += 1
+                return 0, None
+
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            self.reused_tokens += best_length
+            past_key_values = self.entries[best_key][0]
+
+        if best_length < len(best_key):
+            past_key_values = slice_past(past_key_values, best_length)
+        return best_length, past_key_values
+
+    def put(self, token_ids, past_key_values, pinned=False):
+        """Cache the KV of token_ids. Pinned entries, e.g. the system prompt shared by all sessions, stay resident."""
+        token_ids = tuple(token_ids)
+        nbytes = past_nbytes(past_key_values)
+        if not pinned and nbytes > self.max_bytes:
+            return False
+
+        with self.lock:
+            if token_ids in self.entries:
+                pinned = pinned or token_ids in self.pinned
+                self._remove(token_ids)
+
+            # the previous turn of the same session is fully covered by the new, longer prefix
+            for key in [key for key in self.entries if key not in self.pinned and token_ids[:len(key)] == key]:
+                self._remove(key)
+
+            self.entries[token_ids] = (past_key_values, nbytes)
+            self.total_bytes += nbytes
+            if pinned:
+                self.pinned.add(token_ids)
+
+            for key in [key for key in self.entries if key not in self.pinned]:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._remove(key)
+        return True
+
+    def record_prefill(self, num_tokens):
+        """Count context tokens that had to be encoded because no cached prefix covered them."""
+        with self.lock:
+            self.prefilled_tokens += num_tokens
+
+    def _remove(self, key):
+        _, nbytes = self.entries.pop(key)
+        self.total_bytes -= nbytes
+        self.pinned.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.pinned.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "pinned": len(self.pinned),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "reused_tokens": self.reused_tokens,
+            "prefilled_tokens": self.prefilled_tokens,
+        }
+
+
+def load_tiny_model(num_layers=4, hidden_size=256, num_attention_heads=8):
+    """A randomly initialized ChatGLM with the real vocabulary and special tokens, small enough for CPU."""
+    import os
+    from transformers import AutoConfig, AutoModel
+
+    model_dir = os.path.dirname(os.path.abspath(__file__))
+    config = AutoConfig.from_pretrained(
+        model_dir,
+        trust_remote_code=True,
+        num_layers=num_layers,
+        hidden_size=hidden_size,
+        inner_hidden_size=4 * hidden_size,
+        num_attention_heads=num_attention_heads,
+    )
+    model = AutoModel.from_config(config, trust_remote_code=True, empty_init=False)
+    return model.float().eval()
+
+
+def benchmark(prefix_length=512, turn_length=32, turns=8, model=None):
+    """Time-to-first-token of a growing conversation, full prefill vs. prefix KV cache."""
+    import time
+    import torch
+
+    torch.manual_seed(0)
+    if model is None:
+        model = load_tiny_model()
+    config = model.config
+    model.enable_prefix_cache()
+
+    def random_ids(n):
+        # ordinary text tokens, below the special tokens (130000+)
+        return torch.randint(20005, config.mask_token_id, (n,)).tolist()
+
+    def prompt_tensor(context):
+        return torch.tensor([context + [config.gmask_token_id, config.bos_token_id]], dtype=torch.long)
+
+    with torch.no_grad():
+        context = random_ids(prefix_length)
+        model.prefill_prefix(prompt_tensor(context), pinned=True)
+
+        print(f"{'turn':>4} {'tokens':>7} {'full (ms)':>10} {'cached (ms)':>12} {'speedup':>8} {'max |diff|':>11}")
+        for turn in range(turns):
+            context = context + random_ids(turn_length)
+            input_ids = prompt_tensor(context)
+
+            start = time.perf_counter()
+            model(input_ids=input_ids)
+            full = time.perf_counter() - start
+
+            start = time.perf_counter()
+            past_key_values, attention_mask, position_ids = model.prefill_prefix(input_ids)
+            cached_logits = model(
+                input_ids=input_ids[:, len(context):],
+                past_key_values=past_key_values,
+                attention_mask=attention_mask[:, :, len(context):],
+                position_ids=position_ids[..., len(context):],
+            ).logits[:, -1]
+            cached = time.perf_counter() - start
+
+            # the cache must reproduce a causal-context prefill of the whole prompt
+            reference_logits = model(
+                input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids
+            ).logits[:, -1]
+            diff = (cached_logits - reference_logits).abs().max().item()
+
+            print(f"{turn:>4} {input_ids.size(1):>7} {full * 1000:>10.1f} {cached * 1000:>12.1f} "
+                  f"{full / cached:>7.1f}x {diff:>11.2e}")
+
+            # the generated answer becomes part of the next turn's context
+            context = context + random_ids(turn_length)
+
+    print(model.prefix_cache.stats())
+
+
+if __name__ == "__main__":
+    # python models/chatglm-6b/prefix_cache.py
+    benchmark()
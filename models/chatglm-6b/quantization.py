@@ -117,6 +117,50 @@ def extract_weight_to_half(weight: torch.Tensor, scale_list: torch.Tensor, sourc
         return out
 
 
+# rows of the weight dequantized at a time on the CPU path, bounds the temporary float weight to ~16MB
+DEQUANT_CHUNK_ELEMENTS = 4 * 1024 * 1024
+
+
+def pack_int4_weight(weight: torch.Tensor):  # (n, m) int8 in [-8, 7] -> (n, m // 2)
+    """Pure torch version of `compress_int4_weight`, same layout: even column in the high nibble."""
+    assert weight.size(1) % 2 == 0
+    return ((weight[:, 0::2] << 4) | (weight[:, 1::2] & 0x0F)).to(torch.int8)
+
+
+def unpack_int4_weight(weight: torch.Tensor):  # (n, m) -> (n, m * 2) int8
+    high = weight >> 4
+    low = (weight << 4) >> 4
+    return torch.stack((high, low), dim=-1).view(weight.size(0), -1)
+
+
+def extract_weight_to_float(weight: torch.Tensor, scale_list: torch.Tensor, source_bit_width: int, dtype):
+    if source_bit_width == 8:
+        pass
+    elif source_bit_width == 4:
+        weight = unpack_int4_weight(weight)
+    else:
+        assert False, "Unsupported bit-width"
+    return weight.to(dtype) * scale_list.to(dtype)[:, None]
+
+
+def dequant_linear(inp: torch.Tensor, quant_w: torch.Tensor, scale_w: torch.Tensor, weight_bit_width: int):
+    """Weight-only quantized matmul without custom kernels: dequantize a block of rows, multiply, move on."""
+    out_features = quant_w.size(0)
+    inp_shape = inp.size()
+    inp = inp.reshape(-1, inp_shape[-1])
+    output = inp.new_empty(inp.size(0), out_features)
+    chunk = max(1, DEQUANT_CHUNK_ELEMENTS // inp_shape[-1])
+    for start in range(0, out_features, chunk):
+        end = min(start + chunk, out_features)
+        weight = extract_weight_to_float(quant_w[start:end], scale_w[start:end], weight_bit_width, inp.dtype)
+        output[:, start:end] = inp.mm(weight.t())
+    return output.view(*(inp_shape[:-1] + (out_features,)))
+
+
+def use_cuda_kernels(weight: torch.Tensor):
+    return kernels is not None and weight.is_cuda
+
+
 class QuantizedLinear(Linear):
     def __init__(self, weight_bit_width: int, weight_tensor=None, bias_tensor=None, empty_init=False, *args, **kwargs):
         super(QuantizedLinear, self).__init__(*args, **kwargs)
@@ -131,10 +175,16 @@ class QuantizedLinear(Linear):
             )
             self.weight_scale = torch.empty(shape[0], dtype=kwargs["dtype"], device=kwargs["device"])
         else:
+            if not weight_tensor.is_cuda:
+                # half precision reductions are slow (or missing) on the CPU
+                weight_tensor = weight_tensor.float()
             self.weight_scale = (weight_tensor.abs().max(dim=-1).values / ((2 ** (weight_bit_width - 1)) - 1)).half()
-            self.weight = torch.round(weight_tensor / self.weight_scale[:, None]).to(torch.int8)
+            self.weight = torch.round(weight_tensor / self.weight_scale[:, None].to(weight_tensor.dtype)).to(torch.int8)
             if weight_bit_width == 4:
-                self.weight = compress_int4_weight(self.weight)
+                if use_cuda_kernels(self.weight):
+                    self.weight = compress_int4_weight(self.weight)
+                else:
+                    self.weight = pack_int4_weight(self.weight)
 
         self.weight = Parameter(self.weight.to(kwargs["device"]), requires_grad=False)
         self.weight_scale = Parameter(self.weight_scale.to(kwargs["device"]), requires_grad=False)
@@ -144,58 +194,71 @@ class QuantizedLinear(Linear):
             self.bias = None
 
     def forward(self, input):
-        output = W8A16Linear.apply(input, self.weight, self.weight_scale, self.weight_bit_width)
+        if use_cuda_kernels(self.weight):
+            output = W8A16Linear.apply(input, self.weight, self.weight_scale, self.weight_bit_width)
+        else:
+            output = dequant_linear(input, self.weight, self.weight_scale, self.weight_bit_width)
         if self.bias is not None:
             output = output + self.bias
         return output
 
 
-def quantize(model, weight_bit_width, empty_init=False, **kwargs):
-    """Replace fp16 linear with quantized linear"""
+def quantize_linear(linear, weight_bit_width, empty_init=False, device=None):
+    return QuantizedLinear(
+        weight_bit_width=weight_bit_width,
+        weight_tensor=None if empty_init else linear.weight.to(device),
+        bias_tensor=linear.bias,
+        in_features=linear.in_features,
+        out_features=linear.out_features,
+        bias=True,
+        dtype=torch.half,
+        device=linear.weight.device,
+        empty_init=empty_init
+    )
+
+
+def quantize(model, weight_bit_width, empty_init=False, device=None, **kwargs):
+    """Replace fp16 linear with quantized linear
+
+    Weights are quantized on `device`, by default the current CUDA device when the CUDA kernels are usable and
+    the CPU otherwise; the quantized weights stay on the device of the original layer. Without CUDA kernels the
+    forward pass dequantizes on the fly in plain torch, so the same model runs on CPU-only hosts.
+    """
+    if device is None:
+        device = torch.cuda.current_device() if kernels is not None and torch.cuda.is_available() else "cpu"
 
     for layer in model.layers:
-        layer.attention.query_key_value = QuantizedLinear(
-            weight_bit_width=weight_bit_width,
-            weight_tensor=layer.attention.query_key_value.weight.to(torch.cuda.current_device()),
-            bias_tensor=layer.attention.query_key_value.bias,
-            in_features=layer.attention.query_key_value.in_features,
-            out_features=layer.attention.query_key_value.out_features,
-            bias=True,
-            dtype=torch.half,
-            device=layer.attention.query_key_value.weight.device,
-            empty_init=empty_init
-        )
-        layer.attention.dense = QuantizedLinear(
-            weight_bit_width=weight_bit_width,
-            weight_tensor=layer.attention.dense.weight.to(torch.cuda.current_device()),
-            bias_tensor=layer.attention.dense.bias,
-            in_features=layer.attention.dense.in_features,
-            out_features=layer.attention.dense.out_features,
-            bias=True,
-            dtype=torch.half,
-            device=layer.attention.dense.weight.device,
-            empty_init=empty_init
-        )
-        layer.mlp.dense_h_to_4h = QuantizedLinear(
-            weight_bit_width=weight_bit_width,
-            weight_tensor=layer.mlp.dense_h_to_4h.weight.to(torch.cuda.current_device()),
-            bias_tensor=layer.mlp.dense_h_to_4h.bias,
-            in_features=layer.mlp.dense_h_to_4h.in_features,
-            out_features=layer.mlp.dense_h_to_4h.out_features,
-            bias=True,
-            dtype=torch.half,
-            device=layer.mlp.dense_h_to_4h.weight.device,
-            empty_init=empty_init
-        )
-        layer.mlp.dense_4h_to_h = QuantizedLinear(
-            weight_bit_width=weight_bit_width,
-            weight_tensor=layer.mlp.dense_4h_to_h.weight.to(torch.cuda.current_device()),
-            bias_tensor=layer.mlp.dense_4h_to_h.bias,
-            in_features=layer.mlp.dense_4h_to_h.in_features,
-            out_features=layer.mlp.dense_4h_to_h.out_features,
-            bias=True,
-            dtype=torch.half,
-            device=layer.mlp.dense_4h_to_h.weight.device,
-            empty_init=empty_init
-        )
+        layer.attention.query_key_value = quantize_linear(
+            layer.attention.query_key_value, weight_bit_width, empty_init, device)
+        layer.attention.dense = quantize_linear(layer.attention.dense, weight_bit_width, empty_init, device)
+        layer.mlp.dense_h_to_4h = quantize_linear(layer.mlp.dense_h_to_4h, weight_bit_width, empty_init, device)
+        layer.mlp.dense_4h_to_h = quantize_linear(layer.mlp.dense_4h_to_h, weight_bit_width, empty_init, device)
     return model
+
+
+def save_quantized(model_path, output_path, weight_bit_width=4, max_shard_size="2GB"):
+    """Quantize a checkpoint once and save it, so CPU-only hosts load the int8/int4 weights directly.
+
+    The saved config carries `quantization_bit`, so `from_pretrained` builds QuantizedLinear layers with
+    `empty_init=True` and loads the int8 weights and fp16 scales into them without touching fp16 weights.
+    """
+    from transformers import AutoModel, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+    model = AutoModel.from_pretrained(model_path, trust_remote_code=True)
+    model = model.quantize(weight_bit_width)
+    model.save_pretrained(output_path, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(output_path)
+    return output_path
+
+
+if __name__ == "__main__":
+    # python models/chatglm-6b/quantization.py models/chatglm-6b models/chatglm-6b-int4 --bits 4
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path")
+    parser.add_argument("output_path")
+    parser.add_argument("--bits", type=int, default=4, choices=[4, 8])
+    args = parser.parse_args()
+    print(save_quantized(args.model_path, args.output_path, args.bits))
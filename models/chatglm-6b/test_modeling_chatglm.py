@@ -1,4 +1,5 @@
 import datetime
+import time
 import math
 import unittest
 import torch
@@ -163,3 +164,111 @@ class ChatGLMGenerationTest(unittest.TestCase):
             batch_out_sentence = tokenizer.batch_decode(outputs, skip_special_tokens=True)
             print(batch_out_sentence)
             self.assertListEqual(expected_output_sentence, batch_out_sentence)
+
+
+def random_prompt(config, length):
+    # ordinary text tokens, below the special tokens (130000+)
+    ids = torch.randint(20005, config.mask_token_id, (length,)).tolist()
+    return torch.tensor([ids + [config.gmask_token_id, config.bos_token_id]], dtype=torch.long)
+
+
+def last_output(stream, input_ids):
+    outputs = input_ids
+    for outputs in stream:
+        pass
+    return outputs[0].tolist()
+
+
+@require_torch
+class ChatGLMTinyModelTest(unittest.TestCase):
+    """Generation paths checked against each other on a small randomly initialized model, runs on CPU."""
+
+    @classmethod
+    def setUpClass(cls):
+        from prefix_cache import load_tiny_model
+
+        set_random_seed(42)
+        cls.model = load_tiny_model()
+        cls.config = cls.model.config
+
+    @staticmethod
+    def greedy_kwargs(input_ids, new_tokens):
+        # min_length keeps the random model from stopping at <eop>
+        max_length = input_ids.size(1) + new_tokens
+        return {"max_length": max_length, "min_length": max_length, "do_sample": False}
+
+    def test_continuous_batching(self):
+        from batching import ContinuousBatchingScheduler
+
+        set_random_seed(42)
+        prompts = [random_prompt(self.config, length) for length in (9, 31, 17, 4, 25, 12)]
+        new_tokens = [24, 12, 20, 16, 8, 24]
+        expected = [
+            list(self.model.stream_generate(input_ids, **self.greedy_kwargs(input_ids, n)))
+            for input_ids, n in zip(prompts, new_tokens)
+        ]
+
+        # fewer slots than requests, so later requests wait in the queue and join a batch that is mid-stream
+        scheduler = ContinuousBatchingScheduler(self.model, max_batch_size=3).start()
+        try:
+            def submit(i):
+                return scheduler.stream_generate(prompts[i], **self.greedy_kwargs(prompts[i], new_tokens[i]))
+
+            streams = {0: submit(0)}
+            first = [next(streams[0]) for _ in range(3)]
+            streams[1], streams[2] = submit(1), submit(2)
+            second = [next(streams[1]) for _ in range(2)]
+            streams[3], streams[4] = submit(3), submit(4)
+
+            # the consumer of request 5 goes away after two tokens, the sequence is dropped from the batch
+            cancelled = submit(5)
+            partial = [next(cancelled) for _ in range(2)]
+            cancelled.close()
+
+            outputs = {i: list(stream) for i, stream in streams.items()}
+            outputs[0] = first + outputs[0]
+            outputs[1] = second + outputs[1]
+
+            for i, stream_outputs in outputs.items():
+                self.assertEqual([o.tolist() for o in expected[i]], [o.tolist() for o in stream_outputs])
+            self.assertEqual([o.tolist() for o in expected[5][:2]], [o.tolist() for o in partial])
+
+            deadline = time.monotonic() + 30
+            while scheduler.stats()["active"] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            stats = scheduler.stats()
+            self.assertEqual(stats["active"], 0)
+            self.assertEqual(stats["finished_requests"], len(prompts))
+        finally:
+            scheduler.stop()
+
+    def reset_rotary_cache(self, seq_len=None):
+        """Drop the cached cos/sin tables, optionally rebuilding them at their final size so they never grow."""
+        for layer in self.model.transformer.layers:
+            rotary_emb = layer.attention.rotary_emb
+            rotary_emb.max_seq_len_cached = rotary_emb.cos_cached = rotary_emb.sin_cached = None
+            if seq_len is not None:
+                rotary_emb(rotary_emb.inv_freq, seq_len=seq_len)
+
+    def test_static_kv_cache(self):
+        set_random_seed(42)
+        for length, new_tokens in ((7, 40), (30, 16)):
+            input_ids = random_prompt(self.config, length)
+            kwargs = self.greedy_kwargs(input_ids, new_tokens)
+
+            # the rotary tables grow geometrically while decoding; they must match tables built at full length
+            self.reset_rotary_cache(kwargs["max_length"])
+            presized = [o.tolist() for o in self.model.stream_generate(input_ids, **kwargs)]
+            self.reset_rotary_cache()
+            dynamic = [o.tolist() for o in self.model.stream_generate(input_ids, **kwargs)]
+            self.reset_rotary_cache()
+            static = [o.tolist() for o in self.model.stream_generate(input_ids, static_kv_cache=True, **kwargs)]
+            self.assertEqual(presized, dynamic)
+            self.assertEqual(dynamic, static)
+
+            # `generate` shares _update_model_kwargs_for_generation, which only keeps the last mask row and position
+            self.reset_rotary_cache()
+            generated = self.model.generate(input_ids, **kwargs)[0].tolist()
+            self.assertEqual(len(generated), kwargs["max_length"])
+            # stream_generate stops without yielding the token that reaches max_length
+            self.assertEqual(dynamic[-1], generated[:-1])
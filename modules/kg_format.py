@@ -0,0 +1,264 @@
+"""
+知识图谱的二进制列存格式（.kgb）
+
+把 SPN 风格的 JSONL 知识图谱（每行一个 {"id", "sentText", "relationMentions"}）编译成
+一个可以直接 mmap 的文件：
+
+    header | rec_ids | rec_rel_off | sent_off | str_off
+           | em1 | em2 | label | em1_start | em1_end | em2_start | em2_end
+           | sent_blob | str_blob
+
+- 实体和关系名放在同一个驻留字符串表里，em1/em2/label 都是 int32 的字符串 id
+- 第 i 条记录的关系为 [rec_rel_off[i], rec_rel_off[i+1])，句子为 sent_blob[sent_off[i]:sent_off[i+1]]
+- 缺失的字段（以及缺失的 em*Start/em*End）用 -1 表示
+
+所有数组都是 memoryview 直接指向 mmap 的页面，多个进程打开同一个文件时共享物理内存。
+"""
+
+import os
+import sys
+import mmap
+import json
+import struct
+import hashlib
+import tempfile
+from array import array
+
+
+MAGIC = b'KGB1'
+FORMAT_VERSION = 1
+SUFFIX = '.kgb'
+
+# magic, version, 源文件 sha1, 源文件 mtime_ns, 源文件大小, 记录数, 关系数, 字符串数
+HEADER = struct.Struct('<4sI20sqqqqq')
+
+SECTIONS = [
+    ('rec_ids', 'q'), ('rec_rel_off', 'q'), ('sent_off', 'q'), ('str_off', 'q'),
+    ('em1', 'i'), ('em2', 'i'), ('label', 'i'),
+    ('em1_start', 'i'), ('em1_end', 'i'), ('em2_start', 'i'), ('em2_end', 'i'),
+    ('sent_blob', 'B'), ('str_blob', 'B'),
+]
+SECTION_TABLE = struct.Struct('<' + 'q' * (2 * len(SECTIONS)))
+
+RELATION_TEXT_KEYS = ('em1Text', 'em2Text', 'label')
+RELATION_SPAN_KEYS = ('em1Start', 'em1End', 'em2Start', 'em2End')
+RECORD_KEYS = {'id', 'sentText', 'relationMentions'}
+
+
+def compiled_path(jsonl_path):
+    return os.path.splitext(jsonl_path)[0] + SUFFIX
+
+
+def fallback_path(jsonl_path):
+    """源文件所在目录不可写时，编译产物放到临时目录"""
+    digest = hashlib.sha1(os.path.abspath(jsonl_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"kg_{digest}{SUFFIX}")
+
+
+def compile_kg(jsonl_path, out_path=None):
+    """把 JSONL 知识图谱编译成 .kgb 文件，返回输出路径"""
+    if out_path is None:
+        out_path = compiled_path(jsonl_path)
+
+    stat = os.stat(jsonl_path)
+    with open(jsonl_path, 'rb') as f:
+        raw = f.read()
+
+    strings = {}
+    def intern(text):
+        sid = strings.get(text)
+        if sid is None:
+            sid = strings[text] = len(strings)
+        return sid
+
+    cols = {name: array(code) for name, code in SECTIONS if code != 'B'}
+    sent_blob = bytearray()
+    cols['rec_rel_off'].append(0)
+    cols['sent_off'].append(0)
+
+    for line in raw.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        unknown = set(record) - RECORD_KEYS
+        if unknown:
+            raise ValueError(f"不支持的记录字段: {sorted(unknown)}")
+
+        cols['rec_ids'].append(record.get('id', -1))
+        sent_blob += record.get('sentText', '').encode('utf-8')
+        cols['sent_off'].append(len(sent_blob))
+
+        for rel in record.get('relationMentions', []):
+            unknown = set(rel) - set(RELATION_TEXT_KEYS) - set(RELATION_SPAN_KEYS)
+            if unknown:
+                raise ValueError(f"不支持的关系字段: {sorted(unknown)}")
+            cols['em1'].append(intern(rel['em1Text']) if 'em1Text' in rel else -1)
+            cols['em2'].append(intern(rel['em2Text']) if 'em2Text' in rel else -1)
+            cols['label'].append(intern(rel['label']) if 'label' in rel else -1)
+            cols['em1_start'].append(rel.get('em1Start', -1))
+            cols['em1_end'].append(rel.get('em1End', -1))
+            cols['em2_start'].append(rel.get('em2Start', -1))
+            cols['em2_end'].append(rel.get('em2End', -1))
+        cols['rec_rel_off'].append(len(cols['em1']))
+
+    str_blob = bytearray()
+    cols['str_off'].append(0)
+    for text in strings:
+        str_blob += text.encode('utf-8')
+        cols['str_off'].append(len(str_blob))
+
+    payloads = []
+    for name, code in SECTIONS:
+        data = cols[name] if code != 'B' else (sent_blob if name == 'sent_blob' else str_blob)
+        if code != 'B' and sys.byteorder != 'little':
+            data = array(code, data)
+            data.byteswap()
+        payloads.append(bytes(data))
+
+    table = []
+    offset = HEADER.size + SECTION_TABLE.size
+    for payload in payloads:
+        offset += -offset % 8  # 每个数组按 8 字节对齐
+        table += [offset, len(payload)]
+        offset += len(payload)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, hashlib.sha1(raw).digest(), stat.st_mtime_ns,
+                         stat.st_size, len(cols['rec_ids']), len(cols['em1']), len(strings))
+
+    # 先写临时文件再替换，避免其他进程读到写了一半的文件
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(SECTION_TABLE.pack(*table))
+        for (start, _), payload in zip(zip(table[::2], table[1::2]), payloads):
+            f.write(b'\0' * (start - f.tell()))
+            f.write(payload)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class KnowledgeGraphFile:
+    """只读的 .kgb 知识图谱，数组都是 mmap 上的零拷贝视图"""
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise RuntimeError("kgb 文件只支持小端机器直接映射")
+
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, sha1, self.source_mtime_ns, self.source_size,
+         self.num_records, self.num_relations, self.num_strings) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"不是有效的 kgb 文件: {path}")
+        self.source_sha1 = sha1.hex()
+
+        table = SECTION_TABLE.unpack_from(self.mm, HEADER.size)
+        view = memoryview(self.mm)
+        for i, (name, code) in enumerate(SECTIONS):
+            start, length = table[2 * i], table[2 * i + 1]
+            section = view[start:start + length]
+            setattr(self, name, section if code == 'B' else section.cast(code))
+
+        self._string_ids = None
+        self._record_index = None
+
+    def __len__(self):
+        return self.num_records
+
+    def __getitem__(self, idx):
+        return self.record(idx)
+
+    def __iter__(self):
+        for idx in range(self.num_records):
+            yield self.record(idx)
+
+    def is_fresh(self, jsonl_path):
+        """编译产物是否仍然对应当前的源文件"""
+        stat = os.stat(jsonl_path)
+        return stat.st_mtime_ns == self.source_mtime_ns and stat.st_size == self.source_size
+
+    def string(self, sid):
+        if sid < 0:
+            return None
+        return str(self.str_blob[self.str_off[sid]:self.str_off[sid + 1]], 'utf-8')
+
+    def string_id(self, text):
+        """字符串到 id 的反查，第一次调用时构建字典"""
+        if self._string_ids is None:
+            self._string_ids = {self.string(sid): sid for sid in range(self.num_strings)}
+        return self._string_ids.get(text, -1)
+
+    def index_of(self, rec_id):
+        """记录 id 到下标的反查（id 不一定等于行号，比如增量导入的记录），第一次调用时构建字典"""
+        if self._record_index is None:
+            self._record_index = {rec_id: idx for idx, rec_id in enumerate(self.rec_ids)}
+        return self._record_index.get(rec_id, -1)
+
+    def sentence(self, idx):
+        return str(self.sent_blob[self.sent_off[idx]:self.sent_off[idx + 1]], 'utf-8')
+
+    def relation_range(self, idx):
+        return range(self.rec_rel_off[idx], self.rec_rel_off[idx + 1])
+
+    def relation_count(self, idx):
+        return self.rec_rel_off[idx + 1] - self.rec_rel_off[idx]
+
+    def relation(self, rid):
+        rel = {}
+        for key, column in zip(RELATION_TEXT_KEYS, (self.em1, self.em2, self.label)):
+            if column[rid] >= 0:
+                rel[key] = self.string(column[rid])
+        for key, column in zip(RELATION_SPAN_KEYS, (self.em1_start, self.em1_end, self.em2_start, self.em2_end)):
+            if column[rid] >= 0:
+                rel[key] = column[rid]
+        return rel
+
+    def record(self, idx):
+        """还原第 idx 条记录，与 JSONL 中对应行 json.loads 的结果相同"""
+        if idx < 0:
+            idx += self.num_records
+        if not 0 <= idx < self.num_records:
+            raise IndexError(idx)
+        return {
+            'id': self.rec_ids[idx],
+            'sentText': self.sentence(idx),
+            'relationMentions': [self.relation(rid) for rid in self.relation_range(idx)],
+        }
+
+    def triples(self, idx):
+        """第 idx 条记录中的 (em1_id, em2_id, label_id)"""
+        for rid in self.relation_range(idx):
+            yield self.em1[rid], self.em2[rid], self.label[rid]
+
+
+def load_kg(jsonl_path, compile_if_stale=True):
+    """加载 JSONL 知识图谱对应的 .kgb 文件
+
+    .kgb 不存在或者落后于源文件时重新编译（compile_if_stale=False 时抛出 FileNotFoundError）。
+    """
+    candidates = [compiled_path(jsonl_path), fallback_path(jsonl_path)]
+    for kgb_path in candidates:
+        if os.path.exists(kgb_path):
+            try:
+                kg = KnowledgeGraphFile(kgb_path)
+                if kg.is_fresh(jsonl_path):
+                    return kg
+            except (ValueError, struct.error):
+                pass
+
+    if not compile_if_stale:
+        raise FileNotFoundError(f"{candidates[0]} 不存在或已过期")
+
+    try:
+        kgb_path = compile_kg(jsonl_path, candidates[0])
+    except PermissionError:
+        kgb_path = compile_kg(jsonl_path, candidates[1])
+    return KnowledgeGraphFile(kgb_path)
+
+
+if __name__ == "__main__":
+    # python -m modules.kg_format data/ccus_project/iteration_v11/knowledge_graph.json ...
+    for path in sys.argv[1:]:
+        print(f"{path} -> {compile_kg(path)}")
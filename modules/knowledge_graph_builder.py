@@ -1,9 +1,11 @@
 import os
 import json
 import time
+import hashlib
 from modules.prepare.preprocess import process_text
 from modules.prepare.utils import refine_knowledge_graph
-from modules.prepare.process import uie_execute
+from modules.prepare.process import uie_execute_to_file, checkpoint_path
+from modules.prepare.ingest import Manifest, sentence_id, list_text_files, append_items
 try:
     from modules.prepare.filter import auto_filter
 except ImportError:
@@ -11,6 +13,7 @@ except ImportError:
     from modules.prepare.simple_filter import auto_filter
 
 from modules.model_trainer import ModelTrainer
+from modules.kg_format import load_kg
 
 from modules.prepare import cprint as ct
 
@@ -34,6 +37,7 @@ class KnowledgeGraphBuilder:
         self.version = 0    # 会随着迭代次数的增加而增加
         self.kg_paths = [] # 一个数组，代表不同迭代版本的知识图谱
         self.gpu = args.gpu
+        self.uie_workers = getattr(args, "uie_workers", None)  # UIE 抽取的进程数，默认 GPU 上 1 个、CPU 上按核数
 
         os.makedirs(self.data_dir, exist_ok=True)
 
@@ -83,19 +87,21 @@ class KnowledgeGraphBuilder:
 
         total_rel = 0  # 图谱中的所有三元组的数量（之前的）
         extend_rel = 0 # 图谱中扩展的三元组的数量
-        with open(pre_kg, 'r') as f_pre, open(cur_kg, 'r') as f_cur:
-            pre_lines = [json.loads(line) for line in f_pre.readlines()]
-            cur_lines = [json.loads(line) for line in f_cur.readlines()]
-
-            assert len(pre_lines) == len(cur_lines)
-
-            for pre_line, cur_line in zip(pre_lines, cur_lines):
-                pre_rels = pre_line['relationMentions']
-                cur_rels = cur_line['relationMentions']
-
-                total_rel += len(pre_rels)
-                extend_rel += len(cur_rels) - len(pre_rels)
-                assert len(pre_rels) <= len(cur_rels)
+        # 只需要每条记录的关系数量，直接读二进制格式里的偏移数组，不用解析 JSON
+        pre_lines = load_kg(pre_kg)
+        cur_lines = load_kg(cur_kg)
+
+        # 按 id 对应记录，增量导入之后两个版本的记录数可能不同，只比较两边都有的记录
+        for idx in range(len(pre_lines)):
+            cur_idx = cur_lines.index_of(pre_lines.rec_ids[idx])
+            if cur_idx < 0:
+                continue
+            pre_rels = pre_lines.relation_count(idx)
+            cur_rels = cur_lines.relation_count(cur_idx)
+
+            total_rel += pre_rels
+            extend_rel += cur_rels - pre_rels
+            assert pre_rels <= cur_rels
 
         return extend_rel / total_rel
 
@@ -105,18 +111,16 @@ class KnowledgeGraphBuilder:
         input: self.text_path
         output: self.refined_kg_path
         """
-        # 1. 清洗文本，切分句子为指定长度
+        # 1. 清洗文本，切分句子为指定长度（生成器，边读边清洗，直接喂给 UIE）
         texts = process_text(self.text_path, 480)
 
         # 3. 喂给 UIE 并得到 relations，注意这里要保存句子的 id（从 0 开始算
-        #    注意：这里如果发现已经存在了 self.base_kg_path，就跳过 UIE
+        #    注意：这里如果发现已经存在了 self.base_kg_path（并且没有未完成的断点），就跳过 UIE
         #    如果想要重新使用 UIE 抽取，删掉这个文件就行
+        #    抽取结果边抽边写，中断后重新运行会从 base.json.ckpt 记录的断点继续
 
-        if not os.path.exists(self.base_kg_path):
-            all_items = uie_execute(texts)
-            with open(self.base_kg_path, 'w') as f:
-                for item in all_items:
-                    f.writelines(json.dumps(item, ensure_ascii=False) + "\n")
+        if not os.path.exists(self.base_kg_path) or os.path.exists(checkpoint_path(self.base_kg_path)):
+            uie_execute_to_file(texts, self.base_kg_path, workers=self.uie_workers)
         else:
             print(f"Base KG already exists in {self.base_kg_path}, skip UIE.")
 
@@ -134,6 +138,72 @@ class KnowledgeGraphBuilder:
         # 5. 人工筛选并保存，因为需要加断点，所以需要一边做一边保存
         refine_knowledge_graph(self.filtered_kg_path, self.refined_kg_path, fast_mode=True)
 
+    def ingest(self, paths):
+        """增量导入新的文本文件（或目录下的 .txt 文件）
+
+        只对没有导入过的句子运行 UIE 和 auto_filter，结果追加到 base.json、base_filtered.json、base_refined.json，
+        以及下一次迭代的输入（第一次迭代前是 base_truncated.json，之后是最新版本的知识图谱）。
+        新句子的 id 是句子内容的哈希（见 modules/prepare/ingest.py），已有记录的 id 不变。
+        """
+        manifest = Manifest(self.data_dir)
+        if manifest.rollback():
+            print(ct.yellow("Last ingest was interrupted, rolled back the partial merge."))
+        known_ids = manifest.load_ids(self.base_kg_path)
+
+        # 1. 找出新的或者改动过的文件，切分句子，去掉已经抽取过的句子
+        new_lines = {}
+        changed_files = {}
+        for path in list_text_files(paths):
+            state = manifest.file_state(path)
+            if state is None:
+                print(f"Skip unchanged file {path}")
+                continue
+            changed_files[os.path.abspath(path)] = state
+            for line in process_text(path, 480):
+                line = line.strip()
+                rec_id = sentence_id(line) if line else None
+                if line and rec_id not in known_ids and rec_id not in new_lines:
+                    new_lines[rec_id] = line
+        print(ct.green("New sentences:"), ct.yellow(len(new_lines)))
+
+        if new_lines:
+            # 2. 只对新句子运行 UIE，暂存文件按这批句子的内容命名，中断后重新导入会从断点继续
+            ingest_dir = os.path.join(self.data_dir, "ingest")
+            os.makedirs(ingest_dir, exist_ok=True)
+            batch_sha1 = hashlib.sha1("\n".join(new_lines.values()).encode("utf-8")).hexdigest()[:16]
+            staging_path = os.path.join(ingest_dir, f"{batch_sha1}.json")
+            if not os.path.exists(staging_path) or os.path.exists(checkpoint_path(staging_path)):
+                uie_execute_to_file(new_lines.values(), staging_path, workers=self.uie_workers)
+
+            with open(staging_path, 'r', encoding='utf-8') as f:
+                items = [json.loads(line) for line in f]
+            for item, rec_id in zip(items, new_lines):
+                item["id"] = rec_id
+            raw_lines = [json.dumps(item, ensure_ascii=False) for item in items]
+
+            # 3. 只过滤新句子
+            filtered_items = auto_filter(items, self.model_name_or_path)
+
+            # 4. 合并到现有的知识图谱和迭代状态
+            # refine_knowledge_graph 在 fast_mode 下原样保存，筛选后的结果和过滤后的一样
+            filtered_targets = [self.filtered_kg_path, self.refined_kg_path]
+            iteration_input = self.kg_paths[-1] if self.version > 0 else os.path.join(self.data_dir, "base_truncated.json")
+            if os.path.exists(iteration_input):
+                filtered_targets.append(iteration_input)
+            manifest.begin_merge([self.base_kg_path, manifest.ids_path] + filtered_targets)
+
+            with open(self.base_kg_path, 'a', encoding='utf-8') as f:
+                f.writelines(line + "\n" for line in raw_lines)
+            for path in filtered_targets:
+                append_items(path, filtered_items)
+            manifest.add_ids(list(new_lines))
+            print(ct.green("Merged into:"), ct.yellow(", ".join([self.base_kg_path] + filtered_targets)))
+
+        manifest.files.update(changed_files)
+        manifest.pending = None
+        manifest.save()
+        self.save()
+
     def save(self, save_path=None):
         if save_path is None:
             timestr = time.strftime("%Y%m%d-%H%M%S")
@@ -5,6 +5,7 @@ import subprocess
 from modules.prepare.filter import auto_filter
 from modules.prepare.utils import refine_knowledge_graph
 from modules.prepare import cprint as ct
+from modules.kg_format import load_kg
 
 
 class ModelTrainer:
@@ -164,12 +165,12 @@ class ModelTrainer:
 
         # 去除origin_lines里面跟pred_lines重复的relationMentions项
         # eg. origin_lines = [{"id": 0,"sentText":"xxxxxx", "relationMentions": [{"em1Text": "美国", "em2Text": "中国", "label": "国籍}]}]
-        with open(self.data_path, 'r') as f:
-            origin_lines = [json.loads(l) for l in f.readlines()]
+        # 只会按 id 取到少数几条记录，用二进制格式按需解码
+        origin_lines = load_kg(self.data_path)
 
         diff_lines = []
         for pred_line in pred_lines:
-            origin_line = origin_lines[pred_line["id"]]# 通过id找到对应的origin_line
+            origin_line = origin_lines[origin_lines.index_of(pred_line["id"])]# 通过id找到对应的origin_line
             assert origin_line["id"] == pred_line["id"]
 
             diff_line = pred_line.copy()
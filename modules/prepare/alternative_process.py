@@ -1,144 +1,278 @@
 import re
 import json
+import time
+import multiprocessing
+from bisect import bisect_right
 from typing import List, Dict, Any
 from data.schema import ccus_schema
 
+# 实体类型 -> 匹配模式
+ENTITY_PATTERNS = {
+    "技术": [
+        r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:技术|工艺|方法|装置|设备)",
+        r"(?:CO2|二氧化碳)(?:捕集|封存|利用|运输|转化)",
+        r"(?:CCUS|CCS|CCU|DAC|BECCS)"
+    ],
+    "项目": [
+        r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:项目|工程|示范|基地|园区)",
+        r"(?:示范|试点|商业化|产业化)(?:项目|工程|基地)"
+    ],
+    "机构": [
+        r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:公司|企业|集团|研究院|大学|中心|实验室)",
+        r"(?:中石油|中石化|中海油|华能|大唐|国电|华电|中核|中广核)"
+    ],
+    "地理": [
+        r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:省|市|县|区|盆地|油田|气田|矿区)",
+        r"(?:胜利|大庆|塔里木|鄂尔多斯|渤海湾|松辽|四川)(?:盆地|油田|气田)?"
+    ],
+    "政策": [
+        r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:政策|法规|标准|规范|办法|条例|通知|意见)",
+        r"(?:碳达峰|碳中和|双碳|减排|低碳)(?:政策|目标|战略|规划)?"
+    ],
+    "经济": [
+        r"\d+(?:\.\d+)?(?:亿|万|千)?(?:元|美元|欧元)",
+        r"(?:投资|成本|收益|利润|价格|费用).*?\d+",
+        r"\d+(?:\.\d+)?(?:元/吨|美元/吨)"
+    ],
+    "设备": [
+        r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:设备|装置|机组|系统|管道|储罐|压缩机|泵)",
+        r"(?:捕集|分离|净化|压缩|运输|封存|监测)(?:设备|装置|系统)"
+    ],
+    "指标": [
+        r"\d+(?:\.\d+)?(?:%|％|万吨|吨|立方米|兆瓦|千瓦)",
+        r"(?:效率|容量|规模|产能|处理能力).*?\d+",
+        r"(?:捕集|封存|利用|减排)(?:率|量|效率).*?\d+"
+    ]
+}
+
+# 关系抽取模式
+RELATION_PATTERNS = [
+    # 技术应用关系
+    (r"([^，。；！？\s]+)(?:采用|应用|使用)([^，。；！？\s]+(?:技术|工艺|方法))", "技术应用"),
+    # 项目投资关系
+    (r"([^，。；！？\s]+)(?:投资|出资|资助)([^，。；！？\s]+(?:项目|工程))", "投资关系"),
+    # 地理位置关系
+    (r"([^，。；！？\s]+(?:项目|工程|基地))(?:位于|建在|坐落在)([^，。；！？\s]+(?:省|市|县|区))", "位于"),
+    # 机构合作关系
+    (r"([^，。；！？\s]+(?:公司|企业|机构))(?:与|和)([^，。；！？\s]+(?:公司|企业|机构))(?:合作|联合)", "合作关系"),
+    # 技术指标关系
+    (r"([^，。；！？\s]+(?:技术|工艺))(?:的)?([^，。；！？\s]*(?:效率|容量|能力))(?:达到|为|是)([^，。；！？\s]*\d+[^，。；！？\s]*)", "技术指标"),
+    # 设备组成关系
+    (r"([^，。；！？\s]+(?:系统|装置))(?:包括|含有|由)([^，。；！？\s]+(?:设备|装置|部件))", "组成关系"),
+]
+
+# 以词字符开头的实体模式只能匹配在一段连续的词字符里，关系模式只能匹配在两个标点/空白之间
+WORD_CLASS = r"[a-zA-Z0-9\u4e00-\u9fa5]"
+WORDS = re.compile(WORD_CLASS + "+", re.IGNORECASE)
+CLAUSES = re.compile(r"[^，。；！？\s]+", re.IGNORECASE)
+
+# 模式里必须出现的字面量分组，如 (?:技术|工艺|方法)；后面跟 ? 或 * 的是可选的
+REQUIRED_LITERALS = re.compile(r"\(\?:([^()\[\]\\.?*+]+)\)(?![?*])")
+
+# 每个实体类型最多用到前 3 个实体（见 schema 配对），每个实体最多配 5 个关系
+MAX_ENTITIES = 3
+MAX_RELATIONS = 5
+
+
+class Rule:
+    """预编译的模式
+
+    triggers 是模式里必须出现的关键词（每组至少出现一个），scope 是模式的匹配不会跨越的片段划分。
+    只在同时包含所有组关键词的片段里运行模式，结果和在整句上 finditer 完全一致，
+    但跳过了没有关键词的片段里贪婪前缀的大量回溯。
+    """
+
+    def __init__(self, pattern, scope=None):
+        self.regex = re.compile(pattern, re.IGNORECASE)
+        self.triggers = [re.compile(group, re.IGNORECASE) for group in REQUIRED_LITERALS.findall(pattern)]
+        self.scope = scope
+
+    def finditer(self, text, segments):
+        if self.scope is None:
+            if all(trigger.search(text) for trigger in self.triggers):
+                yield from self.regex.finditer(text)
+            return
+
+        positions = []
+        for trigger in self.triggers:
+            found = [m.start() for m in trigger.finditer(text)]
+            if not found:
+                return
+            positions.append(found)
+
+        starts, ends = segments[self.scope]
+        hit = None
+        for found in positions:
+            found = {bisect_right(starts, position) - 1 for position in found}
+            hit = found if hit is None else hit & found
+            if not hit:
+                return
+        for i in sorted(hit):
+            yield from self.regex.finditer(text, starts[i], ends[i])
+
+
+def compile_entity_rule(pattern):
+    # 除了开头的词字符类，剩下的只有字面量分组时，整个匹配都在一段连续的词字符里
+    rest = pattern[len(WORD_CLASS) + 1:] if pattern.startswith(WORD_CLASS + "+") else None
+    scope = WORDS if rest is not None and REQUIRED_LITERALS.fullmatch(rest) else None
+    return Rule(pattern, scope)
+
+
+ENTITY_RULES = [(entity_type, [compile_entity_rule(p) for p in patterns]) for entity_type, patterns in ENTITY_PATTERNS.items()]
+RELATION_RULES = [(Rule(pattern, CLAUSES), relation_type) for pattern, relation_type in RELATION_PATTERNS]
+SCHEMA_RELATIONS = [(entity_type, relation_list[:MAX_RELATIONS]) for entity_type, relation_list in ccus_schema.schema.items()]
+
+
+class Segments(dict):
+    """scope -> (片段起点列表, 片段终点列表)，第一次用到某种划分时才切分"""
+
+    def __init__(self, text):
+        super().__init__()
+        self.text = text
+
+    def __missing__(self, scope):
+        spans = [m.span() for m in scope.finditer(self.text)]
+        self[scope] = ([s for s, _ in spans], [e for _, e in spans])
+        return self[scope]
+
+
 def rule_based_relation_extraction(text: str) -> List[Dict]:
     """
     基于规则的关系抽取，替代PaddleNLP UIE
     针对CCUS领域的实体和关系抽取
     """
     all_relations = []
+    segments = Segments(text)
 
-    # 获取schema中的实体类型和关系类型
-    entity_types = list(ccus_schema.schema.keys())
-
-    # 基本的实体识别模式
-    entity_patterns = {
-        "技术": [
-            r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:技术|工艺|方法|装置|设备)",
-            r"(?:CO2|二氧化碳)(?:捕集|封存|利用|运输|转化)",
-            r"(?:CCUS|CCS|CCU|DAC|BECCS)"
-        ],
-        "项目": [
-            r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:项目|工程|示范|基地|园区)",
-            r"(?:示范|试点|商业化|产业化)(?:项目|工程|基地)"
-        ],
-        "机构": [
-            r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:公司|企业|集团|研究院|大学|中心|实验室)",
-            r"(?:中石油|中石化|中海油|华能|大唐|国电|华电|中核|中广核)"
-        ],
-        "地理": [
-            r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:省|市|县|区|盆地|油田|气田|矿区)",
-            r"(?:胜利|大庆|塔里木|鄂尔多斯|渤海湾|松辽|四川)(?:盆地|油田|气田)?"
-        ],
-        "政策": [
-            r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:政策|法规|标准|规范|办法|条例|通知|意见)",
-            r"(?:碳达峰|碳中和|双碳|减排|低碳)(?:政策|目标|战略|规划)?"
-        ],
-        "经济": [
-            r"\d+(?:\.\d+)?(?:亿|万|千)?(?:元|美元|欧元)",
-            r"(?:投资|成本|收益|利润|价格|费用).*?\d+",
-            r"\d+(?:\.\d+)?(?:元/吨|美元/吨)"
-        ],
-        "设备": [
-            r"[a-zA-Z0-9\u4e00-\u9fa5]+(?:设备|装置|机组|系统|管道|储罐|压缩机|泵)",
-            r"(?:捕集|分离|净化|压缩|运输|封存|监测)(?:设备|装置|系统)"
-        ],
-        "指标": [
-            r"\d+(?:\.\d+)?(?:%|％|万吨|吨|立方米|兆瓦|千瓦)",
-            r"(?:效率|容量|规模|产能|处理能力).*?\d+",
-            r"(?:捕集|封存|利用|减排)(?:率|量|效率).*?\d+"
-        ]
-    }
-
-    # 关系抽取模式
-    relation_patterns = [
-        # 技术应用关系
-        (r"([^，。；！？\s]+)(?:采用|应用|使用)([^，。；！？\s]+(?:技术|工艺|方法))", "技术应用"),
-        # 项目投资关系
-        (r"([^，。；！？\s]+)(?:投资|出资|资助)([^，。；！？\s]+(?:项目|工程))", "投资关系"),
-        # 地理位置关系
-        (r"([^，。；！？\s]+(?:项目|工程|基地))(?:位于|建在|坐落在)([^，。；！？\s]+(?:省|市|县|区))", "位于"),
-        # 机构合作关系
-        (r"([^，。；！？\s]+(?:公司|企业|机构))(?:与|和)([^，。；！？\s]+(?:公司|企业|机构))(?:合作|联合)", "合作关系"),
-        # 技术指标关系
-        (r"([^，。；！？\s]+(?:技术|工艺))(?:的)?([^，。；！？\s]*(?:效率|容量|能力))(?:达到|为|是)([^，。；！？\s]*\d+[^，。；！？\s]*)", "技术指标"),
-        # 设备组成关系
-        (r"([^，。；！？\s]+(?:系统|装置))(?:包括|含有|由)([^，。；！？\s]+(?:设备|装置|部件))", "组成关系"),
-    ]
+    # 提取实体，每种类型收集到 MAX_ENTITIES 个不同的实体就够了
+    entities = {}
+    for entity_type, rules in ENTITY_RULES:
+        found = entities[entity_type] = []
+        seen = set()
+        for rule in rules:
+            for match in rule.finditer(text, segments):
+                entity_text = match.group().strip()
+                if len(entity_text) > 1 and entity_text not in seen:
+                    seen.add(entity_text)
+                    found.append(entity_text)
+                    if len(found) == MAX_ENTITIES:
+                        break
+            if len(found) == MAX_ENTITIES:
+                break
+
+    # 提取关系
+    for rule, relation_type in RELATION_RULES:
+        for match in rule.finditer(text, segments):
+            entity1 = match.group(1).strip()
+            entity2 = match.group(2).strip()
+
+            if len(entity1) > 1 and len(entity2) > 1:
+                all_relations.append({
+                    "em1Text": entity1,
+                    "em2Text": entity2,
+                    "label": relation_type
+                })
+
+    # 基于schema生成一些基本关系：每个类型的前几个实体和第一个其他类型的实体配对（取第一个作为示例）
+    for entity_type, relation_list in SCHEMA_RELATIONS:
+        type_entities = entities.get(entity_type)
+        if not type_entities:
+            continue
+        target_entity = next((found[0] for target_type, found in entities.items() if target_type != entity_type and found), None)
+        if target_entity is None:
+            continue
+        all_relations.extend(
+            {"em1Text": entity, "em2Text": target_entity, "label": relation_name}
+            for entity in type_entities
+            for relation_name in relation_list
+        )
+
+    return all_relations
+
+
+def batch_relation_extraction(texts: List[str], workers: int = 1, chunksize: int = 64) -> List[List[Dict]]:
+    """对一组文本做关系抽取，返回和 texts 对齐的结果；workers > 1 时用进程池处理整个语料"""
+    if workers <= 1:
+        return [rule_based_relation_extraction(text) for text in texts]
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(rule_based_relation_extraction, texts, chunksize)
+
+
+def naive_relation_extraction(text: str) -> List[Dict]:
+    """原来的实现：每个模式在整句上各跑一遍，只用于基准测试和校验结果"""
+    all_relations = []
 
-    # 提取实体
     entities = {}
-    for entity_type, patterns in entity_patterns.items():
+    for entity_type, patterns in ENTITY_PATTERNS.items():
         entities[entity_type] = []
         for pattern in patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
+            for match in re.finditer(pattern, text, re.IGNORECASE):
                 entity_text = match.group().strip()
                 if len(entity_text) > 1 and entity_text not in entities[entity_type]:
                     entities[entity_type].append(entity_text)
 
-    # 提取关系
-    for pattern, relation_type in relation_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
+    for pattern, relation_type in RELATION_PATTERNS:
+        for match in re.finditer(pattern, text, re.IGNORECASE):
             if len(match.groups()) >= 2:
                 entity1 = match.group(1).strip()
                 entity2 = match.group(2).strip()
-
                 if len(entity1) > 1 and len(entity2) > 1:
-                    relation = {
-                        "em1Text": entity1,
-                        "em2Text": entity2,
-                        "label": relation_type
-                    }
-                    all_relations.append(relation)
-
-    # 基于schema生成一些基本关系
+                    all_relations.append({"em1Text": entity1, "em2Text": entity2, "label": relation_type})
+
     for entity_type, relation_list in ccus_schema.schema.items():
         type_entities = entities.get(entity_type, [])
-        for entity in type_entities[:3]:  # 限制每种类型最多3个实体，避免过多
-            for relation_name in relation_list[:5]:  # 限制每个实体最多5个关系
-                # 寻找可能的关系对象
+        for entity in type_entities[:3]:
+            for relation_name in relation_list[:5]:
                 for target_type, target_entities in entities.items():
                     if target_type != entity_type and target_entities:
-                        target_entity = target_entities[0]  # 取第一个作为示例
-                        relation = {
-                            "em1Text": entity,
-                            "em2Text": target_entity,
-                            "label": relation_name
-                        }
-                        all_relations.append(relation)
-                        break  # 每个关系只添加一个示例
+                        all_relations.append({"em1Text": entity, "em2Text": target_entities[0], "label": relation_name})
+                        break
 
     return all_relations
 
+
+def benchmark(path="data/cleaned_ccus_data.txt", workers=None):
+    """原实现、预编译规则引擎和多进程模式的吞吐量（行/秒），并校验结果一致"""
+    with open(path, 'r', encoding='utf-8') as f:
+        texts = [line.strip() for line in f if line.strip()]
+    workers = workers or multiprocessing.cpu_count()
+
+    start = time.perf_counter()
+    expected = [naive_relation_extraction(text) for text in texts]
+    naive_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = batch_relation_extraction(texts)
+    compiled_time = time.perf_counter() - start
+    assert result == expected
+
+    start = time.perf_counter()
+    result = batch_relation_extraction(texts, workers=workers)
+    parallel_time = time.perf_counter() - start
+    assert result == expected
+
+    n = len(texts)
+    print(f"{n} 行, 平均 {sum(map(len, texts)) / n:.0f} 字")
+    print(f"原实现:     {n / naive_time:.0f} 行/秒")
+    print(f"规则引擎:   {n / compiled_time:.0f} 行/秒 ({naive_time / compiled_time:.1f}x)")
+    print(f"{workers} 个进程: {n / parallel_time:.0f} 行/秒 ({naive_time / parallel_time:.1f}x)")
+
+
 def alternative_uie_execute(texts: List[str]) -> List[Dict]:
     """
     替代UIE执行函数
     """
-    sent_id = 0
-    all_items = []
-
-    for line in texts:
-        line = line.strip()
-        if not line:
-            continue
+    lines = [line.strip() for line in texts]
+    lines = [line for line in lines if line]
 
-        all_relations = rule_based_relation_extraction(line)
-
-        item = {
+    all_items = []
+    for sent_id, (line, all_relations) in enumerate(zip(lines, batch_relation_extraction(lines))):
+        all_items.append({
             "id": sent_id,
             "sentText": line,
             "relationMentions": all_relations
-        }
-
-        sent_id += 1
-        if sent_id % 10 == 0:
-            print(f"Processed {sent_id} lines")
-
-        all_items.append(item)
+        })
+    print(f"Processed {len(all_items)} lines")
 
     return all_items
 
@@ -147,4 +281,15 @@ def uie_execute(texts: List[str]) -> List[Dict]:
     """
     保持与原始process.py模块的接口兼容性
     """
-    return alternative_uie_execute(texts)
\ No newline at end of file
+    return alternative_uie_execute(texts)
+
+
+if __name__ == "__main__":
+    # 在项目根目录下运行: python -m modules.prepare.alternative_process [--workers N]
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default="data/cleaned_ccus_data.txt")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    benchmark(args.input, args.workers)
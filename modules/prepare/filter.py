@@ -1,4 +1,7 @@
 import re
+import time
+from functools import lru_cache
+from multiprocessing import Pool
 import jieba
 
 def simple_tokenize(text):
@@ -7,17 +10,107 @@ def simple_tokenize(text):
     tokens = list(jieba.cut(text))
     return tokens
 
-def auto_filter(items, model_name_or_path=None):
+
+@lru_cache(maxsize=65536)
+def tokenize_entity(text):
+    """实体的分词结果，同一个实体在成千上万条关系里反复出现，只切一次"""
+    return tuple(simple_tokenize(text))
+
+
+class TokenIndex:
+    """一个句子的分词结果，以及 token -> 出现位置（升序）的索引"""
+
+    def __init__(self, text) -> None:
+        self.tokens = simple_tokenize(text)
+        self.positions = {}
+        for i, token in enumerate(self.tokens):
+            self.positions.setdefault(token, []).append(i)
+
+    def find(self, tokens):
+        """tokens 在句子里第一次出现的 (start, end)，找不到时返回 None
+
+        只在首个 token 出现的位置上比较，不用在整个句子上滑动窗口。
+        """
+        n = len(tokens)
+        tokens = list(tokens)
+        for i in self.positions.get(tokens[0], ()):
+            if self.tokens[i:i + n] == tokens:
+                return i, i + n - 1
+        return None
+
+
+def filter_relations(example):
+    """过滤一条记录里的关系，返回保留下来的关系（带实体的 token 位置）"""
+    sent_text = example["sentText"]
+    index = None
+
+    relations = []
+    for relation in example["relationMentions"]:
+        sub_text = relation["em1Text"]
+        obj_text = relation["em2Text"]
+
+        sub_tokens = tokenize_entity(sub_text)
+        obj_tokens = tokenize_entity(obj_text)
+
+        if len(sub_tokens) == 0 or len(obj_tokens) == 0:
+            continue
+
+        if len(sub_tokens) > 15 or len(obj_tokens) > 15:
+            continue
+
+        # 简单检查实体是否在句子中
+        if sub_text not in sent_text or obj_text not in sent_text:
+            continue
+
+        # 句子只在有关系通过上面的检查时才分词
+        if index is None:
+            index = TokenIndex(sent_text)
+
+        # 1. 判断 subject 是否在句子中；token 序列对不上时实体仍然在句子里（上面检查过），简化处理为 0
+        sub_start, sub_end = index.find(sub_tokens) or (0, 0)
+
+        # 2. 判断 object 是否在句子中
+        obj_start, obj_end = index.find(obj_tokens) or (0, 0)
+
+        relations.append({
+            "em1Text": relation["em1Text"],
+            "em2Text": relation["em2Text"],
+            "label": relation["label"],
+            "em1Start": sub_start,
+            "em1End": sub_end,
+            "em2Start": obj_start,
+            "em2End": obj_end
+        })
+
+    return relations
+
+
+def auto_filter(items, model_name_or_path=None, workers=1, chunksize=64):
     """用于自动过滤到一些错误的三元组，简化版本不依赖transformers
 
     Args:
         items (数组): 所有的实例，每个实例是一个字典，包含了句子、实体、关系
         model_name_or_path (字符串): 预训练模型的名字或者路径（忽略，保持接口兼容）
+        workers (整数): 大于 1 时用进程池并行过滤
 
     Returns:
         过滤后的 items
     """
+    if workers > 1:
+        # 在主进程里加载好词典，fork 出来的子进程直接共享
+        jieba.initialize()
+        with Pool(workers) as pool:
+            for example, relations in zip(items, pool.imap(filter_relations, items, chunksize)):
+                example["relationMentions"] = relations
+    else:
+        for example in items:
+            example["relationMentions"] = filter_relations(example)
+
+    return items
 
+
+def naive_auto_filter(items):
+    """原来的实现：句子和每个实体都重新分词，滑动窗口找位置，只用于基准测试和校验结果"""
     for example in items:
         sent_text = example["sentText"]
         sent_tokens = simple_tokenize(sent_text)
@@ -26,64 +119,74 @@ def auto_filter(items, model_name_or_path=None):
         for relation in example["relationMentions"]:
             sub_text = relation["em1Text"]
             obj_text = relation["em2Text"]
-
             sub_tokens = simple_tokenize(sub_text)
             obj_tokens = simple_tokenize(obj_text)
-
             if len(sub_tokens) == 0 or len(obj_tokens) == 0:
                 continue
-
             if len(sub_tokens) > 15 or len(obj_tokens) > 15:
                 continue
-
-            # 简单检查实体是否在句子中
             if sub_text not in sent_text or obj_text not in sent_text:
                 continue
 
-            # 1. 判断 subject 是否在句子中
-            sub_start = -1
-            sub_end = -1
-            for i in range(len(sent_tokens) - len(sub_tokens) + 1):
-                if sent_tokens[i:i+len(sub_tokens)] == sub_tokens:
-                    sub_start = i
-                    sub_end = i + len(sub_tokens) - 1
-                    break
-
-            # 如果找不到，尝试字符串匹配
-            if sub_start == -1:
-                if sub_text in sent_text:
-                    sub_start = 0  # 简化处理
-                    sub_end = 0
-                else:
-                    continue
-
-            # 2. 判断 object 是否在句子中
-            obj_start = -1
-            obj_end = -1
-            for i in range(len(sent_tokens) - len(obj_tokens) + 1):
-                if sent_tokens[i:i+len(obj_tokens)] == obj_tokens:
-                    obj_start = i
-                    obj_end = i + len(obj_tokens) - 1
-                    break
-
-            # 如果找不到，尝试字符串匹配
-            if obj_start == -1:
-                if obj_text in sent_text:
-                    obj_start = 0  # 简化处理
-                    obj_end = 0
-                else:
-                    continue
+            spans = []
+            for tokens in (sub_tokens, obj_tokens):
+                start, end = 0, 0
+                for i in range(len(sent_tokens) - len(tokens) + 1):
+                    if sent_tokens[i:i+len(tokens)] == tokens:
+                        start, end = i, i + len(tokens) - 1
+                        break
+                spans.append((start, end))
 
             relations.append({
                 "em1Text": relation["em1Text"],
                 "em2Text": relation["em2Text"],
                 "label": relation["label"],
-                "em1Start": sub_start,
-                "em1End": sub_end,
-                "em2Start": obj_start,
-                "em2End": obj_end
+                "em1Start": spans[0][0],
+                "em1End": spans[0][1],
+                "em2Start": spans[1][0],
+                "em2End": spans[1][1]
             })
 
         example["relationMentions"] = relations
 
-    return items
\ No newline at end of file
+    return items
+
+
+def benchmark(path="data/ccus_project/iteration_v11/knowledge_graph.json", repeat=1, workers=4):
+    """原实现、分词一次的实现和多进程模式在同一份数据上的耗时，并校验结果一致
+
+    默认用迭代产出的知识图谱（relation_align 里过滤的就是这种每句几十个关系的数据）。
+    """
+    import copy
+    import json
+
+    with open(path, 'r', encoding='utf-8') as f:
+        items = [json.loads(line) for line in f if line.strip()] * repeat
+    jieba.initialize()
+
+    start = time.perf_counter()
+    expected = naive_auto_filter(copy.deepcopy(items))
+    naive_time = time.perf_counter() - start
+
+    tokenize_entity.cache_clear()
+    start = time.perf_counter()
+    result = auto_filter(copy.deepcopy(items))
+    single_time = time.perf_counter() - start
+    assert result == expected
+
+    tokenize_entity.cache_clear()
+    start = time.perf_counter()
+    result = auto_filter(copy.deepcopy(items), workers=workers)
+    parallel_time = time.perf_counter() - start
+    assert result == expected
+
+    relations = sum(len(item["relationMentions"]) for item in items)
+    print(f"{len(items)} 条记录, {relations} 个关系")
+    print(f"原实现:     {naive_time:.2f}s")
+    print(f"分词一次:   {single_time:.2f}s ({naive_time / single_time:.1f}x)")
+    print(f"{workers} 个进程: {parallel_time:.2f}s ({naive_time / parallel_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    # 在项目根目录下运行: python -m modules.prepare.filter
+    benchmark()
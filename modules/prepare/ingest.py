@@ -0,0 +1,124 @@
+"""
+增量导入新语料
+
+句子（process_text 打包后的一行）的 id 由内容的 sha1 得到，同一句话不管出现在哪个文件、第几行，id 都一样。
+清单记录已经导入过的文件和已经抽取过的句子 id，新一批文档只对没见过的句子做 UIE 和过滤，再追加到现有的知识图谱里。
+
+    data/<project>/manifest.json      {"files": {路径: {"size", "mtime_ns", "sha1"}}, "pending": 追加前各文件的大小}
+    data/<project>/sentence_ids.bin   已经抽取过的句子 id（int64 数组，只追加）
+
+追加之前先把各目标文件的大小写进 manifest 的 pending，中途失败时下一次导入会先截断回去再重新合并。
+"""
+import os
+import json
+import hashlib
+from array import array
+
+
+def sentence_id(text):
+    """句子内容的 sha1 取前 8 字节，右移一位保证是非负的 int64（.kgb 的 rec_ids 列）"""
+    return int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'big') >> 1
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def list_text_files(paths):
+    """展开目录，返回其中所有 .txt 文件（按路径排序）"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.endswith('.txt'))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+class Manifest:
+
+    def __init__(self, data_dir) -> None:
+        self.path = os.path.join(data_dir, "manifest.json")
+        self.ids_path = os.path.join(data_dir, "sentence_ids.bin")
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        self.files = state.get("files", {})
+        self.pending = state.get("pending")
+        self.ids = None
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": self.files, "pending": self.pending}, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def load_ids(self, base_kg_path):
+        """已经抽取过的句子 id；第一次使用时由现有的 base.json 生成"""
+        if self.ids is not None:
+            return self.ids
+
+        if not os.path.exists(self.ids_path):
+            ids = array('q')
+            if os.path.exists(base_kg_path):
+                with open(base_kg_path, 'r', encoding='utf-8') as f:
+                    ids.extend(sentence_id(json.loads(line)["sentText"]) for line in f if line.strip())
+            with open(self.ids_path, 'wb') as f:
+                ids.tofile(f)
+
+        ids = array('q')
+        with open(self.ids_path, 'rb') as f:
+            ids.frombytes(f.read())
+        self.ids = set(ids)
+        return self.ids
+
+    def add_ids(self, new_ids):
+        with open(self.ids_path, 'ab') as f:
+            array('q', new_ids).tofile(f)
+        self.ids.update(new_ids)
+
+    def file_state(self, path):
+        """文件没变时返回 None，否则返回新的 {"size", "mtime_ns", "sha1"}；大小和修改时间都没变时不重新计算 sha1"""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        old = self.files.get(key)
+        if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+            return None
+        state = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": file_sha1(path)}
+        if old and old["sha1"] == state["sha1"]:
+            # 只是修改时间变了，记下新的时间，下次不用再算 sha1
+            self.files[key] = state
+            return None
+        return state
+
+    def begin_merge(self, targets):
+        """记录各目标文件追加之前的大小"""
+        self.pending = {path: os.path.getsize(path) if os.path.exists(path) else 0 for path in targets}
+        self.save()
+
+    def rollback(self):
+        """上一次合并没有完成：把目标文件截断回合并之前的大小"""
+        if not self.pending:
+            return False
+        for path, size in self.pending.items():
+            if os.path.exists(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+        self.pending = None
+        self.ids = None
+        self.save()
+        return True
+
+
+def append_items(path, items):
+    with open(path, 'a', encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
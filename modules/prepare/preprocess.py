@@ -1,34 +1,99 @@
 import re
+from multiprocessing import Pool
 from zhconv import convert
 
+from .utils import bounded_imap
+
+# 保留中文、英文、数字、字母、标点符号
+CLEAN_PATTERN = re.compile('[^\u4e00-\u9fa5a-zA-Z0-9\s，。？！、‘’；《》【】（）：\-/“”\n\t]')
+SPLIT_PATTERN = re.compile('([。？！])')
+# 块的末尾切在最后一个空白字符或句末标点之后：zhconv 的词典里没有跨过这些字符的词条
+# （包含句号的几个词条都以句号开头或结尾），两侧的转换互不影响
+CUT_POINT = re.compile(r'.*[\s。？！；]', re.S)
+
+CHUNK_SIZE = 1 << 20  # 每块读取的字符数
+
+
 # 打开并删除文本中的特殊字符
-def clean_to_sentence(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f_in:
-        dirty_text = f_in.read()
+def clean_chunk(dirty_text):
     # 保留中文、英文、数字、字母、标点符号，替换换行符为分号，将繁体转换为简体
-    pattern = re.compile('[^\u4e00-\u9fa5a-zA-Z0-9\s，。？！、‘’；《》【】（）：\-/“”\n\t]')
-    clean_text = pattern.sub('', dirty_text)
+    clean_text = CLEAN_PATTERN.sub('', dirty_text)
     # clean_text = clean_text.replace('\n', '；')
-    clean_text = convert(clean_text, 'zh-cn')
-    split_pattern = re.compile('([。？！])')
-    clean_sentences = split_pattern.split(clean_text)
-    return clean_sentences
+    return convert(clean_text, 'zh-cn')
 
-# 将文本按照句子分割
-def add_sentences(sentences, max_line_length=480):
+
+def read_chunks(file_path, chunk_size=CHUNK_SIZE, max_carry=None):
+    """按块读取文本，每块在最后一个空白字符或句末标点之后切开，剩下的部分并到下一块
+
+    只在新读入的块里找切分点。连续 max_carry（默认 4 块）个字符里都没有切分点时强制切开，
+    这时可能切断一个繁简转换的词组，但内存占用有上限。
+    """
+    max_carry = max_carry or 4 * chunk_size
+    carry = ''
+    with open(file_path, 'r', encoding='utf-8') as f_in:
+        while True:
+            block = f_in.read(chunk_size)
+            if not block:
+                break
+            match = CUT_POINT.match(block)
+            if match:
+                yield carry + block[:match.end()]
+                carry = block[match.end():]
+            elif len(carry) + len(block) > max_carry:
+                yield carry + block
+                carry = ''
+            else:
+                carry += block
+    if carry:
+        yield carry
+
+
+def iter_sentences(file_path, chunk_size=CHUNK_SIZE, workers=1):
+    """逐块清洗、转换并切分句子，结果和 clean_to_sentence 一致（句末标点单独作为一项）
+
+    每块最后一个句末标点之后的残句留到下一块，拼上之后再切分。workers > 1 时各块在进程池里清洗和转换。
+    """
+    chunks = read_chunks(file_path, chunk_size)
+    if workers > 1:
+        with Pool(workers) as pool:
+            yield from split_sentences(bounded_imap(pool, clean_chunk, chunks, 2 * workers))
+    else:
+        yield from split_sentences(map(clean_chunk, chunks))
+
+
+def split_sentences(clean_chunks):
+    carry = ''
+    for clean_text in clean_chunks:
+        # carry 里没有句末标点，只需要切分新的一块，再把 carry 接到第一段前面
+        sentences = SPLIT_PATTERN.split(clean_text)
+        sentences[0] = carry + sentences[0]
+        carry = sentences.pop()
+        yield from sentences
+    yield carry
+
+
+def clean_to_sentence(file_path):
+    return list(iter_sentences(file_path))
+
+
+def pack_lines(sentences, max_line_length=480):
     current_line = ''
-    output = []
     for sentence in sentences:
         if len(current_line) + len(sentence) + 1 > max_line_length:
-            output.append(current_line.strip())
+            yield current_line.strip()
             current_line = ''
         current_line += sentence + ' '
     if current_line:
-        output.append(current_line.strip())
-    return output
+        yield current_line.strip()
+
+
+# 将文本按照句子分割
+def add_sentences(sentences, max_line_length=480):
+    return list(pack_lines(sentences, max_line_length))
+
 
 # 将文本按照句子分割
-def process_text(input_file, max_line_length):
-    sentences = clean_to_sentence(input_file)
-    formatted_output = add_sentences(sentences, max_line_length)
-    return formatted_output
\ No newline at end of file
+def process_text(input_file, max_line_length, workers=1, chunk_size=CHUNK_SIZE):
+    """返回按 max_line_length 打包好的行的生成器，整个语料不会同时放在内存里"""
+    sentences = iter_sentences(input_file, chunk_size, workers)
+    return pack_lines(sentences, max_line_length)
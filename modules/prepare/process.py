@@ -1,69 +1,326 @@
-import os
-from data.schema import ccus_schema
-
-# 使用基于规则的替代方案，而不是PaddleNLP UIE
-try:
-    # 尝试导入PaddleNLP（如果可用）
-    from paddle import inference as paddle_infer
-    from paddlenlp import Taskflow
-    PADDLE_AVAILABLE = True
-
-    # 定义一个函数，用于关系抽取
-    def paddle_relation_ie(content):
-        relation_ie = Taskflow("information_extraction", schema=ccus_schema.schema, batch_size=2)
-        return relation_ie(content)
-
-    # 关系抽取并修改json文件
-    def rel_json(content):
-        all_relations = [] # 定义一个空列表，用于存储每个chapter的关系信息
-        res_relation = paddle_relation_ie(content)  # 传入文本进行关系识别
-        for rel in res_relation:
-            for sub_type, sub_rel in rel.items():
-                for sub in sub_rel:
-                    if sub.get("relations") is None:
-                        continue
-                    for rel_type, rel_obj in sub["relations"].items():
-                        for obj in rel_obj:
-                            if not sub['text'] or not obj['text']:
-                                continue
-                            rel_triple = {"em1Text": sub['text'],"em2Text": obj['text'],"label": rel_type}
-                            all_relations.append(rel_triple)
-        return all_relations
-
-except ImportError:
-    PADDLE_AVAILABLE = False
-    print("PaddleNLP not available, using rule-based alternative")
-
-    # 导入替代方案
-    from .alternative_process import rule_based_relation_extraction
-
-    def rel_json(content):
-        return rule_based_relation_extraction(content)
-
-
-# 执行函数
-def uie_execute(texts):
-    if not PADDLE_AVAILABLE:
-        print("Using rule-based relation extraction as PaddleNLP fallback")
-
-    sent_id = 0
-    all_items = []
-    for line in texts:
-        line = line.strip()
-        if not line:
-            continue
-
-        all_relations = rel_json(line)
-
-        item = {}
-        item["id"] = sent_id
-        item["sentText"] = line
-        item["relationMentions"] = all_relations
-
-        sent_id += 1
-        if sent_id % 10 == 0 and sent_id != 0:
-            print("Done {} lines".format(sent_id))
-
-        all_items.append(item)
-
-    return all_items
+import os
+import sys
+import json
+import time
+import hashlib
+import multiprocessing
+from itertools import chain, islice
+from data.schema import ccus_schema
+
+# 使用基于规则的替代方案，而不是PaddleNLP UIE
+try:
+    # 尝试导入PaddleNLP（如果可用）
+    import paddle
+    from paddle import inference as paddle_infer
+    from paddlenlp import Taskflow
+    PADDLE_AVAILABLE = True
+
+except ImportError:
+    PADDLE_AVAILABLE = False
+    print("PaddleNLP not available, using rule-based alternative")
+
+# 导入替代方案
+from .alternative_process import batch_relation_extraction
+from .utils import bounded_imap
+
+UIE_DEPLOY_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../Uie-finetune/deploy/python'))
+
+CHUNK_SIZE = 512  # 每个分块的行数，也是断点的粒度
+BATCH_SIZE = 16   # 每次送进模型的行数
+
+
+def default_backend():
+    return os.environ.get("UIE_BACKEND") or ("taskflow" if PADDLE_AVAILABLE else "rule")
+
+
+def use_gpu(backend):
+    if backend == "rule" or not PADDLE_AVAILABLE:
+        return False
+    return paddle.device.is_compiled_with_cuda() and paddle.device.cuda.device_count() > 0
+
+
+def default_workers(backend):
+    """GPU 上只用一个进程，CPU 上按核数开进程（模型每个进程一份，最多 4 个）"""
+    if os.environ.get("UIE_WORKERS"):
+        return int(os.environ["UIE_WORKERS"])
+    if use_gpu(backend):
+        return 1
+    return min(4, os.cpu_count() or 1)
+
+
+def parse_relations(result):
+    """把 UIE 对一句话的输出转换成 [{"em1Text", "em2Text", "label"}, ...]"""
+    all_relations = []
+    for sub_type, sub_rel in result.items():
+        for sub in sub_rel:
+            if sub.get("relations") is None:
+                continue
+            for rel_type, rel_obj in sub["relations"].items():
+                for obj in rel_obj:
+                    if not sub['text'] or not obj['text']:
+                        continue
+                    rel_triple = {"em1Text": sub['text'], "em2Text": obj['text'], "label": rel_type}
+                    all_relations.append(rel_triple)
+    return all_relations
+
+
+def length_buckets(texts, batch_size):
+    """按长度排序后切成批次，同一批次的句子长度相近，padding 最少；返回下标列表的列表"""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+class RelationExtractor:
+    """关系抽取引擎：模型只加载一次，之后按长度分桶的批次抽取
+
+    backend:
+        taskflow: PaddleNLP Taskflow("information_extraction")
+        onnx: modules/Uie-finetune/deploy/python 里的 UIEPredictor（ONNX Runtime），模型路径读取环境变量 UIE_ONNX_MODEL
+        rule: 基于规则的抽取（没有安装 PaddleNLP 时的默认值）
+    """
+
+    def __init__(self, backend=None, batch_size=BATCH_SIZE, num_threads=None):
+        self.backend = backend or default_backend()
+        self.batch_size = batch_size
+
+        if self.backend == "taskflow":
+            kwargs = {"num_threads": num_threads} if num_threads else {}
+            self.model = Taskflow("information_extraction", schema=ccus_schema.schema, batch_size=batch_size, **kwargs)
+        elif self.backend == "onnx":
+            if UIE_DEPLOY_DIR not in sys.path:
+                sys.path.append(UIE_DEPLOY_DIR)
+            from argparse import Namespace
+            from uie_predictor import UIEPredictor
+
+            self.model = UIEPredictor(Namespace(
+                model_path_prefix=os.environ["UIE_ONNX_MODEL"],
+                schema=ccus_schema.schema,
+                position_prob=0.5,
+                max_seq_len=512,
+                batch_size=batch_size,
+                multilingual=False,
+                device="gpu" if use_gpu(self.backend) else "cpu",
+                use_fp16=False,
+                device_id=0,
+            ))
+        elif self.backend == "rule":
+            self.model = None
+        else:
+            raise ValueError(f"Unknown UIE backend: {self.backend}")
+
+    def run_batch(self, texts):
+        if self.model is None:
+            return batch_relation_extraction(texts)
+        if self.backend == "onnx":
+            results = self.model.predict(texts)
+        else:
+            results = self.model(texts)
+        return [parse_relations(result) for result in results]
+
+    def __call__(self, texts):
+        """返回和 texts 对齐的关系列表"""
+        relations = [None] * len(texts)
+        for bucket in length_buckets(texts, self.batch_size):
+            for i, result in zip(bucket, self.run_batch([texts[i] for i in bucket])):
+                relations[i] = result
+        return relations
+
+
+# 每个进程一个抽取器，第一次使用时加载
+extractor = None
+extractor_options = {}
+
+
+def get_extractor(**options):
+    """返回本进程的抽取器，参数变化时重新加载"""
+    global extractor, extractor_options
+    if options and options != extractor_options:
+        extractor, extractor_options = None, options
+    if extractor is None:
+        extractor = RelationExtractor(**extractor_options)
+    return extractor
+
+
+def init_worker(options, load_lock):
+    # 各进程依次加载模型，避免同时读盘、同时占用内存峰值（ONNX 后端加载时还会写同一个 model.onnx）
+    with load_lock:
+        get_extractor(**options)
+
+
+def extract_chunk(chunk):
+    start, lines = chunk
+    return [
+        {"id": start + i, "sentText": line, "relationMentions": relations}
+        for i, (line, relations) in enumerate(zip(lines, get_extractor()(lines)))
+    ]
+
+
+# 兼容原来的逐句接口
+def paddle_relation_ie(content):
+    return get_extractor().model(content)
+
+
+# 关系抽取并修改json文件
+def rel_json(content):
+    return get_extractor()([content])[0]
+
+
+def clean_lines(texts):
+    """去掉首尾空白和空行；texts 可以是文件对象或生成器，按需读取"""
+    lines = (line.strip() for line in texts)
+    return (line for line in lines if line)
+
+
+def chunked(lines, chunk_size=CHUNK_SIZE):
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def number_chunks(chunks, start):
+    for chunk in chunks:
+        yield start, chunk
+        start += len(chunk)
+
+
+def iter_items(chunks, start=0, workers=None, backend=None, batch_size=BATCH_SIZE):
+    """按原来的顺序逐块 yield 该块的 item 列表，第一块第一行的 id 为 start
+
+    workers > 1 时分块分给进程池，每个进程只加载一次模型；CPU 上每个进程分到 cpu_count / workers 个线程。
+    """
+    backend = backend or default_backend()
+    workers = workers or default_workers(backend)
+    chunks = number_chunks(chunks, start)
+
+    if workers <= 1:
+        get_extractor(backend=backend, batch_size=batch_size, num_threads=None)
+        for chunk in chunks:
+            yield extract_chunk(chunk)
+        return
+
+    num_threads = None if use_gpu(backend) else max(1, (os.cpu_count() or 1) // workers)
+    options = {"backend": backend, "batch_size": batch_size, "num_threads": num_threads}
+    # Paddle 在 fork 出来的子进程里不可靠，用 spawn 启动
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=init_worker, initargs=(options, context.Lock())) as pool:
+        # 结果按提交顺序返回，断点之前的行都已写出；只预读几个分块，输入不会一次性读进内存
+        yield from bounded_imap(pool, extract_chunk, chunks, 2 * workers)
+
+
+# 执行函数
+def uie_execute(texts, workers=1, backend=None, batch_size=BATCH_SIZE):
+    if not PADDLE_AVAILABLE:
+        print("Using rule-based relation extraction as PaddleNLP fallback")
+
+    all_items = []
+    for items in iter_items(chunked(clean_lines(texts)), workers=workers, backend=backend, batch_size=batch_size):
+        all_items.extend(items)
+        print("Done {} lines".format(len(all_items)))
+    return all_items
+
+
+def checkpoint_path(out_path):
+    return out_path + ".ckpt"
+
+
+def chunk_digest(previous, lines):
+    """断点之前所有行的摘要，逐块链式计算"""
+    sha1 = hashlib.sha1(previous.encode('utf-8'))
+    for line in lines:
+        sha1.update(line.encode('utf-8'))
+        sha1.update(b'\n')
+    return sha1.hexdigest()
+
+
+def load_checkpoints(out_path, chunk_size):
+    """断点日志第一行是分块大小，之后每写完一块追加一行 {"done", "size", "digest"}
+
+    返回输出文件里确实写完了的那些断点；没有断点或分块大小变了时返回空列表。
+    """
+    checkpoints = []
+    try:
+        with open(checkpoint_path(out_path), 'r', encoding='utf-8') as f:
+            if json.loads(f.readline()).get("chunk_size") != chunk_size:
+                return []
+            for line in f:
+                try:
+                    checkpoints.append(json.loads(line))
+                except ValueError:
+                    # 中断时写了一半的最后一行
+                    break
+        out_size = os.path.getsize(out_path)
+    except (OSError, ValueError):
+        return []
+    return [checkpoint for checkpoint in checkpoints if checkpoint["size"] <= out_size]
+
+
+def uie_execute_to_file(texts, out_path, workers=None, backend=None, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE):
+    """抽取结果逐块追加到 out_path（JSONL），每块写完记录断点，中断后再次调用会从断点继续
+
+    texts 可以是生成器（如 preprocess.process_text 的返回值），整个语料不会同时放在内存里。
+    断点日志为 out_path + ".ckpt"，全部完成后删除。继续之前会重新读一遍断点之前的行核对摘要，
+    从第一个对不上的分块开始重新抽取。
+    """
+    if not PADDLE_AVAILABLE:
+        print("Using rule-based relation extraction as PaddleNLP fallback")
+
+    chunks = chunked(clean_lines(texts), chunk_size)
+    done, size, digest = 0, 0, ''
+    verified = []
+    for checkpoint in load_checkpoints(out_path, chunk_size):
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        chunk_sha1 = chunk_digest(digest, chunk)
+        if chunk_sha1 != checkpoint["digest"]:
+            chunks = chain([chunk], chunks)
+            break
+        done, size, digest = checkpoint["done"], checkpoint["size"], chunk_sha1
+        verified.append(checkpoint)
+    if done:
+        print(f"Resume UIE from line {done}")
+
+    resumed = done
+    start_time = time.time()
+    with open(out_path, 'r+b' if size else 'wb') as f, open(checkpoint_path(out_path), 'w', encoding='utf-8') as ckpt:
+        # 丢掉断点之后写了一半的内容
+        f.truncate(size)
+        f.seek(size)
+        ckpt.write(json.dumps({"chunk_size": chunk_size}) + "\n")
+        ckpt.writelines(json.dumps(checkpoint) + "\n" for checkpoint in verified)
+
+        for items in iter_items(chunks, done, workers, backend, batch_size):
+            f.write(''.join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            done += len(items)
+            digest = chunk_digest(digest, [item["sentText"] for item in items])
+            ckpt.write(json.dumps({"done": done, "size": f.tell(), "digest": digest}) + "\n")
+            ckpt.flush()
+            os.fsync(ckpt.fileno())
+
+            speed = (done - resumed) / (time.time() - start_time)
+            print(f"Done {done} lines ({speed:.1f} lines/s)")
+
+    os.remove(checkpoint_path(out_path))
+    return out_path
+
+
+if __name__ == "__main__":
+    # 在项目根目录下运行: python -m modules.prepare.process data/cleaned_ccus_data.txt data/ccus_project/base.json
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="文本文件，每行一段")
+    parser.add_argument("output", help="输出的 JSONL 文件，中断后重新运行会从断点继续")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--backend", default=None, choices=["taskflow", "onnx", "rule"])
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--chunk_size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        uie_execute_to_file(f, args.output, args.workers, args.backend, args.batch_size, args.chunk_size)
@@ -0,0 +1,44 @@
+"""
+分块预处理和整篇处理的结果一致性
+
+在项目根目录下运行: python -m pytest modules/prepare/test_preprocess.py
+"""
+
+import os
+import tempfile
+import unittest
+
+from modules.prepare.preprocess import clean_to_sentence, iter_sentences, read_chunks
+
+
+class PreprocessTest(unittest.TestCase):
+    def write_text(self, text):
+        f = tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False)
+        with f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_chunks_without_whitespace(self):
+        # 没有空白和换行的中文语料，只能在句末标点之后切块；含有繁体词组和带句号的 zhconv 词条
+        text = '碳捕集與封存技術；執行長。陞級改造？沖著目標！二氧化碳驅油與埋存示範工程規模達到10萬噸' * 500
+        path = self.write_text(text)
+
+        chunks = list(read_chunks(path, chunk_size=1000))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(''.join(chunks), text)
+
+        expected = clean_to_sentence(path)
+        self.assertEqual(list(iter_sentences(path, chunk_size=1000)), expected)
+        self.assertEqual(list(iter_sentences(path, chunk_size=1000, workers=2)), expected)
+
+    def test_carry_is_bounded(self):
+        # 完全没有切分点时强制切开，每块不超过 max_carry 加一块
+        path = self.write_text('碳' * 10000)
+        chunks = list(read_chunks(path, chunk_size=1000, max_carry=3000))
+        self.assertEqual(''.join(chunks), '碳' * 10000)
+        self.assertLessEqual(max(map(len, chunks)), 4000)
+
+
+if __name__ == "__main__":
+    unittest.main()
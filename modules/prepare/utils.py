@@ -1,4 +1,5 @@
 import json
+from collections import deque
 
 def check_input(prompt, keys):
 
@@ -78,6 +79,21 @@ def refine_knowledge_graph(kg_path, refined_kg_path, fast_mode=True):
 
     return refined_kg_path
 
+
+def bounded_imap(pool, func, iterable, window):
+    """和 pool.imap 一样按顺序返回结果，但最多只有 window 个任务在途
+
+    pool.imap 会把整个输入一次性读完放进任务队列，输入是大文件的生成器时内存随语料增长。
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
 #
 # if __name__ == "__main__":
 #     kg_path = "res_base_v4.json"
@@ -0,0 +1,98 @@
+"""
+Aho-Corasick 多模式字符串匹配
+一次构建，之后对任意文本只需线性扫描一遍即可找出所有出现的模式串
+"""
+
+from collections import deque
+from typing import Iterable, List, Tuple
+
+
+class AhoCorasick:
+    def __init__(self, words: Iterable[str] = ()):
+        self.goto = [{}]        # 每个状态的转移表
+        self.fail = [0]         # 失配指针
+        self.ends = [-1]        # 以该状态结尾的模式串编号，没有则为 -1
+        self.output = [[]]      # 每个状态可以输出的模式串编号（build 时合并失配链）
+        self.words = []
+        self.built = False
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, word: str):
+        if not word:
+            return
+        state = 0
+        for ch in word:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.ends.append(-1)
+                self.output.append([])
+            state = nxt
+        if self.ends[state] == -1:
+            self.ends[state] = len(self.words)
+            self.words.append(word)
+            self.built = False
+
+    def build(self):
+        """BFS 计算失配指针，并把失配链上的输出合并到当前状态"""
+        self.output = [[word_id] if word_id != -1 else [] for word_id in self.ends]
+        queue = deque()
+        for state in self.goto[0].values():
+            self.fail[state] = 0
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+        self.built = True
+        return self
+
+    def iter(self, text: str):
+        """逐个产出 (start, end, word)，end 为开区间"""
+        if not self.built:
+            self.build()
+
+        goto, fail, output, words = self.goto, self.fail, self.output, self.words
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for word_id in output[state]:
+                word = words[word_id]
+                yield i + 1 - len(word), i + 1, word
+
+    def find(self, text: str, policy: str = "overlap") -> List[Tuple[int, int, str]]:
+        """查找 text 中的所有模式串
+
+        Args:
+            policy: "overlap" 返回所有（可能重叠的）匹配；
+                    "longest" 从左到右取最长匹配，结果互不重叠
+        """
+        matches = sorted(self.iter(text), key=lambda m: (m[0], -m[1]))
+        if policy == "overlap":
+            return matches
+        if policy != "longest":
+            raise ValueError(f"unknown match policy: {policy}")
+
+        selected = []
+        last_end = 0
+        for start, end, word in matches:
+            if start >= last_end:
+                selected.append((start, end, word))
+                last_end = end
+        return selected
@@ -6,209 +6,231 @@ CCUS知识图谱搜索模块
 
 import json
 import os
+import re
+import heapq
+import threading
 from pathlib import Path
 from typing import List, Dict, Any, Tuple
-from collections import defaultdict
+from collections import defaultdict, Counter, ChainMap
 import jieba
 
-class CCUSKnowledgeGraphSearcher:
-    def __init__(self):
-        self.kg_data = []
+from app.utils.aho_corasick import AhoCorasick
+from app.utils.kg_loader import load_kg
+from app.utils.ngram_index import NgramIndex
+from app.utils.query_cache import QueryCache
+
+
+# 实体质量过滤用到的常量和正则，模块加载时编译一次
+VALID_SINGLE_CHARS = frozenset({'中', '美', '欧', '亚', '东', '西', '南', '北', '新', '老', '大', '小', '高', '低', '上', '下', '内', '外', '前', '后'})
+
+MEANINGFUL_SHORT = frozenset({
+    # 地名
+    '北京', '上海', '广州', '深圳', '吉林', '内蒙', '山西', '陕西', '河北', '河南', '山东',
+    '江苏', '浙江', '福建', '广东', '海南', '四川', '云南', '贵州', '湖北', '湖南', '江西',
+    '安徽', '辽宁', '黑龙江', '天津', '重庆', '宁夏', '新疆', '西藏', '青海', '甘肃',
+    # 机构
+    '中科院', '清华', '北大', '中石油', '中石化', '中海油', '国电', '华能', '大唐',
+    # 技术术语
+    'CO2', 'CCS', 'CCUS', 'EOR', 'MEA', 'MDEA', 'PSA', 'TSA',
+    # 基础词汇
+    '技术', '项目', '公司', '企业', '政府', '政策', '标准', '设备', '环境', '能源',
+    '工业', '研究', '开发', '建设', '管理', '服务', '系统', '方法', '过程', '材料',
+    '产品', '市场', '投资', '合作', '发展', '应用', '科技', '创新', '数据', '信息',
+    '碳捕集', '封存', '利用', '减排', '节能', '清洁', '绿色', '低碳', '零碳',
+    '发电', '化工', '钢铁', '水泥', '石化', '煤化工', '电厂', '工厂', '装置',
+    '管道', '储罐', '压缩', '输送', '注入', '监测', '安全', '成本', '效益'
+})
+
+PUNCT_ONLY_RE = re.compile(r'^[^\w\u4e00-\u9fa5]+$')
+SPACE_ONLY_RE = re.compile(r'^\s+$')
+MEANINGLESS_SHORT_RES = [
+    re.compile(r'^[的了在与和及或]'),  # 介词、连词开头
+    re.compile(r'^[。，、；：！？\s]'),  # 标点开头
+    re.compile(r'^[0-9]+$'),  # 纯数字
+    re.compile(r'^\W+$'),  # 纯符号
+]
+PUNCT_TAIL_RE = re.compile(r'[。，、；：！？\s]+$')
+PUNCT_CHAR_RE = re.compile(r'[^\w\u4e00-\u9fa5]')
+FUNCTION_WORD_HEAD_RE = re.compile(r'^[而且但是或者因为所以如果然后当时这些那些一些每个各种不同相同类似]+')
+DIGIT_TAIL_RE = re.compile(r'[^\d]\d+$')
+FRAGMENT_HEAD_RE = re.compile(r'^[的了在与和及或以及][^\w\u4e00-\u9fa5]')
+
+QUERY_TRAILING_RE = re.compile(r'[\s。？！?!.，,；;：:]+$')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """归一化查询用作缓存键：去掉首尾空白和结尾标点，合并空白，英文转小写"""
+    query = WHITESPACE_RE.sub(' ', query.strip())
+    return QUERY_TRAILING_RE.sub('', query).lower()
+
+
+def is_valid_entity_name(entity: str) -> bool:
+    """检查实体是否有效（人工质量过滤）"""
+    if not entity or not entity.strip():
+        return False
+
+    entity = entity.strip()
+
+    # 过滤单个字符（除了一些有意义的单字实体）
+    if len(entity) == 1:
+        return entity in VALID_SINGLE_CHARS
+
+    # 过滤纯标点符号
+    if PUNCT_ONLY_RE.match(entity):
+        return False
+
+    # 过滤纯空白字符
+    if SPACE_ONLY_RE.match(entity):
+        return False
+
+    # 过滤明显的片段（以常见字开头但很短的无意义组合）
+    if len(entity) <= 2:
+        for pattern in MEANINGLESS_SHORT_RES:
+            if pattern.match(entity):
+                return False
+
+    # 保留有意义的短实体
+    if len(entity) <= 3:
+        return entity in MEANINGFUL_SHORT
+
+    # 长度大于3的实体，进行更严格的检查
+    # 过滤以无意义字符结尾的实体
+    if PUNCT_TAIL_RE.search(entity):
+        return False
+
+    # 过滤包含过多标点的实体
+    punct_count = len(PUNCT_CHAR_RE.findall(entity))
+    if punct_count > len(entity) * 0.3:  # 标点超过30%
+        return False
+
+    # 过滤以常见虚词开头的实体
+    if FUNCTION_WORD_HEAD_RE.match(entity):
+        return False
+
+    # 过滤以数字结尾的奇怪组合
+    if DIGIT_TAIL_RE.search(entity) and len(entity) < 8:  # 非数字+数字结尾且较短
+        return False
+
+    # 过滤包含换行符的实体
+    if '\n' in entity:
+        return False
+
+    # 过滤明显的文本片段错误
+    if FRAGMENT_HEAD_RE.match(entity):
+        return False
+
+    return True
+
+
+class KGIndex:
+    """一份加载好的知识图谱及其全部索引
+
+    建好之后不再修改；重新加载时构建一个新的 KGIndex 整体替换，
+    请求线程在一次检索开始时取一次引用，整个检索过程看到的都是同一代数据。
+    """
+
+    def __init__(self, kg_data=None, kg_path=None, kg_mtime=None):
+        self.kg_data = kg_data if kg_data is not None else []
+        self.kg_path = kg_path
+        self.kg_mtime = kg_mtime  # 图谱文件的修改时间，也用作这一代数据的标识
+        self.loaded = kg_data is not None
         self.entity_index = defaultdict(list)  # 实体到记录的索引
         self.relation_index = defaultdict(list)  # 关系到记录的索引
-        self.loaded = False
-        self.load_knowledge_graph()
-
-    def load_knowledge_graph(self):
-        """加载CCUS知识图谱数据 - 完全修正最终版本"""
-        kg_paths = [
-            "../data/ccus_project/iteration_v11/knowledge_graph_ultimate_clean.json",
-            "/root/KnowledgeGraph-based-on-Raw-text-A27-main/KnowledgeGraph-based-on-Raw-text-A27-main/data/ccus_project/iteration_v11/knowledge_graph_ultimate_clean.json",
-            "../../data/ccus_project/iteration_v11/knowledge_graph_ultimate_clean.json"
-        ]
-
-        for kg_path in kg_paths:
-            if os.path.exists(kg_path):
-                try:
-                    with open(kg_path, 'r', encoding='utf-8') as f:
-                        for line_num, line in enumerate(f):
-                            if line.strip():
-                                data = json.loads(line)
-                                self.kg_data.append(data)
-
-                    print(f"✅ 加载知识图谱: {len(self.kg_data)} 条记录")
-                    self._build_indexes()
-                    self.loaded = True
-                    return
-
-                except Exception as e:
-                    print(f"加载知识图谱失败: {e}")
-
-        print("⚠️ 未找到CCUS知识图谱数据")
+        self.entity_names = []  # 驻留的实体名，下标即实体 id
+        self.entity_ids = {}  # 实体名到实体 id
+        self.entity_valid = bytearray()  # 按实体 id 对齐的有效性位图
+        self.entity_matcher = AhoCorasick()  # 有效实体名的多模式匹配自动机
+        self.entity_ngrams = NgramIndex([])  # 有效实体名的 n-gram 倒排索引，用于关键词兜底检索
+        if self.loaded:
+            self._build_indexes()
 
     def _build_indexes(self):
         """构建实体和关系索引"""
         print("构建知识图谱索引...")
 
-        for idx, record in enumerate(self.kg_data):
-            # 索引句子中的所有实体
-            relations = record.get('relationMentions', [])
-
-            entities = set()
-            for rel in relations:
-                em1 = rel.get('em1Text', '')
-                em2 = rel.get('em2Text', '')
-                label = rel.get('label', '')
+        entity_index = defaultdict(list)
+        relation_index = defaultdict(list)
 
-                if em1:
-                    entities.add(em1)
-                    self.entity_index[em1].append(idx)
+        # 直接遍历 id 数组，每个字符串只解码一次
+        kg = self.kg_data
+        strings = [kg.string(sid) for sid in range(kg.num_strings)]
 
-                if em2:
-                    entities.add(em2)
-                    self.entity_index[em2].append(idx)
-
-                if label:
-                    self.relation_index[label].append(idx)
-
-        print(f"索引完成: {len(self.entity_index)} 个实体, {len(self.relation_index)} 种关系")
-
-    def extract_entities(self, text: str) -> List[str]:
-        """从文本中提取可能的实体"""
+        for idx in range(len(kg)):
+            # 索引句子中的所有实体
+            for em1, em2, label in kg.triples(idx):
+                if em1 >= 0 and strings[em1]:
+                    entity_index[strings[em1]].append(idx)
+
+                if em2 >= 0 and strings[em2]:
+                    entity_index[strings[em2]].append(idx)
+
+                if label >= 0 and strings[label]:
+                    relation_index[strings[label]].append(idx)
+
+        # 每个实体只做一次质量过滤：结果存进位图，无效实体直接从索引中删掉
+        entity_names = list(entity_index)
+        entity_valid = bytearray((len(entity_names) + 7) // 8)
+        for idx, entity in enumerate(entity_names):
+            if is_valid_entity_name(entity):
+                entity_valid[idx >> 3] |= 1 << (idx & 7)
+            else:
+                del entity_index[entity]
+
+        self.entity_index = entity_index
+        self.relation_index = relation_index
+        self.entity_names = entity_names
+        self.entity_ids = {entity: idx for idx, entity in enumerate(entity_names)}
+        self.entity_valid = entity_valid
+        # 用有效实体构建 Aho-Corasick 自动机
+        self.entity_matcher = AhoCorasick(entity for entity in entity_index if len(entity) > 1).build()
+        self.entity_ngrams = NgramIndex(entity_index)
+
+        print(f"索引完成: {len(entity_index)} 个实体, {len(relation_index)} 种关系")
+
+    def match_entities(self, text: str, policy: str = "overlap") -> List[Tuple[int, int, str]]:
         if not text:
             return []
+        return self.entity_matcher.find(text, policy)
 
-        # 使用jieba分词
-        words = jieba.lcut(text)
-
-        entities = []
-
-        # 检查分词结果中的实体
-        for word in words:
-            if len(word) > 1 and word in self.entity_index and self._is_valid_entity(word):
-                entities.append(word)
+    def extract_entities(self, text: str, policy: str = "overlap") -> List[str]:
+        if not text:
+            return []
 
-        # 检查完整文本是否匹配实体
-        if text in self.entity_index and self._is_valid_entity(text):
-            entities.append(text)
+        # 按首次出现的位置去重
+        entities = dict.fromkeys(entity for _, _, entity in self.match_entities(text, policy))
 
-        # 检查文本片段（限制长度避免过度匹配）
-        for i in range(len(text)):
-            for j in range(i+2, min(i+10, len(text)+1)):  # 限制最大长度为10
-                substring = text[i:j]
-                if substring in self.entity_index and self._is_valid_entity(substring):
-                    entities.append(substring)
+        # 检查完整文本是否匹配实体（单字实体不进自动机）
+        if text in self.entity_index:
+            entities[text] = None
 
-        return list(set(entities))
+        return list(entities)
 
-    def search_by_entities(self, entities: List[str]) -> List[Dict]:
-        """基于实体列表搜索相关知识"""
+    def search_by_entities(self, entities: List[str], top_k: int = 10) -> List[Dict]:
         if not entities or not self.loaded:
             return []
 
-        record_scores = defaultdict(int)
+        record_scores = Counter()
 
         # 计算每个记录的相关性得分
         for entity in entities:
             if entity in self.entity_index:
-                for record_idx in self.entity_index[entity]:
-                    record_scores[record_idx] += 1
-
-        # 按得分排序，返回top记录
-        sorted_records = sorted(record_scores.items(), key=lambda x: x[1], reverse=True)
-
-        results = []
-        for record_idx, score in sorted_records[:10]:  # 返回top 10
-            record = self.kg_data[record_idx].copy()
-            record['relevance_score'] = score
-            results.append(record)
-
-        return results
-
-    def _is_valid_entity(self, entity: str) -> bool:
-        """检查实体是否有效（人工质量过滤）"""
-        if not entity or not entity.strip():
-            return False
-
-        entity = entity.strip()
-
-        # 过滤单个字符（除了一些有意义的单字实体）
-        if len(entity) == 1:
-            valid_single_chars = {'中', '美', '欧', '亚', '东', '西', '南', '北', '新', '老', '大', '小', '高', '低', '上', '下', '内', '外', '前', '后'}
-            return entity in valid_single_chars
-
-        # 过滤纯标点符号
-        import re
-        if re.match(r'^[^\w\u4e00-\u9fa5]+$', entity):
-            return False
+                record_scores.update(self.entity_index[entity])
 
-        # 过滤纯空白字符
-        if re.match(r'^\s+$', entity):
-            return False
-
-        # 过滤明显的片段（以常见字开头但很短的无意义组合）
-        if len(entity) <= 2:
-            meaningless_patterns = [
-                r'^[的了在与和及或]',  # 介词、连词开头
-                r'^[。，、；：！？\s]',  # 标点开头
-                r'^[0-9]+$',  # 纯数字
-                r'^\W+$',  # 纯符号
-            ]
-            for pattern in meaningless_patterns:
-                if re.match(pattern, entity):
-                    return False
-
-        # 保留有意义的短实体
-        if len(entity) <= 3:
-            meaningful_short = {
-                # 地名
-                '北京', '上海', '广州', '深圳', '吉林', '内蒙', '山西', '陕西', '河北', '河南', '山东',
-                '江苏', '浙江', '福建', '广东', '海南', '四川', '云南', '贵州', '湖北', '湖南', '江西',
-                '安徽', '辽宁', '黑龙江', '天津', '重庆', '宁夏', '新疆', '西藏', '青海', '甘肃',
-                # 机构
-                '中科院', '清华', '北大', '中石油', '中石化', '中海油', '国电', '华能', '大唐',
-                # 技术术语
-                'CO2', 'CCS', 'CCUS', 'EOR', 'MEA', 'MDEA', 'PSA', 'TSA',
-                # 基础词汇
-                '技术', '项目', '公司', '企业', '政府', '政策', '标准', '设备', '环境', '能源',
-                '工业', '研究', '开发', '建设', '管理', '服务', '系统', '方法', '过程', '材料',
-                '产品', '市场', '投资', '合作', '发展', '应用', '科技', '创新', '数据', '信息',
-                '碳捕集', '封存', '利用', '减排', '节能', '清洁', '绿色', '低碳', '零碳',
-                '发电', '化工', '钢铁', '水泥', '石化', '煤化工', '电厂', '工厂', '装置',
-                '管道', '储罐', '压缩', '输送', '注入', '监测', '安全', '成本', '效益'
-            }
-            return entity in meaningful_short
-
-        # 长度大于3的实体，进行更严格的检查
-        # 过滤以无意义字符结尾的实体
-        if re.search(r'[。，、；：！？\s]+$', entity):
-            return False
-
-        # 过滤包含过多标点的实体
-        punct_count = len(re.findall(r'[^\w\u4e00-\u9fa5]', entity))
-        if punct_count > len(entity) * 0.3:  # 标点超过30%
-            return False
-
-        # 过滤以常见虚词开头的实体
-        if re.match(r'^[而且但是或者因为所以如果然后当时这些那些一些每个各种不同相同类似]+', entity):
-            return False
+        # 用堆取 top 10，不对所有记录做全排序（得分相同时保持原来的先后顺序）
+        top_records = heapq.nlargest(top_k, record_scores.items(), key=lambda x: x[1])
 
-        # 过滤以数字结尾的奇怪组合
-        if re.search(r'[^\d]\d+$', entity) and len(entity) < 8:  # 非数字+数字结尾且较短
-            return False
-
-        # 过滤包含换行符的实体
-        if '\n' in entity:
-            return False
+        # 返回记录的只读视图而不是拷贝：写入只会落在第一层的 dict 上
+        return [ChainMap({'relevance_score': score}, self.kg_data[record_idx])
+                for record_idx, score in top_records]
 
-        # 过滤明显的文本片段错误
-        if re.match(r'^[的了在与和及或以及][^\w\u4e00-\u9fa5]', entity):
-            return False
+    def is_valid_entity(self, entity: str) -> bool:
+        idx = self.entity_ids.get(entity)
+        if idx is None:
+            return is_valid_entity_name(entity)
+        return bool(self.entity_valid[idx >> 3] & (1 << (idx & 7)))
 
-        return True
-
-    def extract_subgraph(self, entities: List[str]) -> Dict:
-        """提取以给定实体为中心的子图"""
+    def extract_subgraph(self, entities: List[str], relevant_records: List[Dict] = None) -> Dict:
         if not entities or not self.loaded:
             return {"nodes": [], "edges": []}
 
@@ -216,7 +238,8 @@ class CCUSKnowledgeGraphSearcher:
         edges = []
 
         # 收集相关记录
-        relevant_records = self.search_by_entities(entities)
+        if relevant_records is None:
+            relevant_records = self.search_by_entities(entities)
 
         for record in relevant_records:
             relations = record.get('relationMentions', [])
@@ -228,7 +251,7 @@ class CCUSKnowledgeGraphSearcher:
 
                 # 应用实体质量过滤
                 if (em1 and em2 and label and
-                    self._is_valid_entity(em1) and self._is_valid_entity(em2)):
+                    self.is_valid_entity(em1) and self.is_valid_entity(em2)):
 
                     nodes.add(em1)
                     nodes.add(em2)
@@ -249,7 +272,6 @@ class CCUSKnowledgeGraphSearcher:
         }
 
     def search_knowledge(self, query: str) -> Tuple[List[Dict], Dict]:
-        """搜索知识图谱，返回相关知识和子图"""
         if not self.loaded:
             return [], {"nodes": [], "edges": []}
 
@@ -259,29 +281,160 @@ class CCUSKnowledgeGraphSearcher:
 
         if not entities:
             # 如果没有直接匹配的实体，尝试关键词搜索
-            entities = self._keyword_search(query)
+            entities = self.keyword_search(query)
 
         # 搜索相关知识
         knowledge = self.search_by_entities(entities)
 
-        # 提取子图
-        subgraph = self.extract_subgraph(entities)
+        # 基于同一批检索结果提取子图
+        subgraph = self.extract_subgraph(entities, knowledge)
 
         return knowledge, subgraph
 
-    def _keyword_search(self, query: str) -> List[str]:
-        """基于关键词搜索实体"""
-        keywords = jieba.lcut(query)
-        found_entities = []
+    def keyword_search(self, query: str, top_k: int = 5) -> List[str]:
+        keywords = {keyword for keyword in jieba.lcut(query) if len(keyword) > 1}
 
+        # 在实体中查找包含关键词的实体
+        candidates = set()
         for keyword in keywords:
-            if len(keyword) > 1:
-                # 在实体中查找包含关键词的实体
-                for entity in self.entity_index.keys():
-                    if keyword in entity and entity not in found_entities:
-                        found_entities.append(entity)
+            candidates.update(self.entity_ngrams.contains(keyword))
+
+        names = self.entity_ngrams.names
+        best = heapq.nlargest(top_k, candidates, key=lambda idx: (len(self.entity_index[names[idx]]), -idx))
+        return [names[idx] for idx in best]
 
-        return found_entities[:5]  # 返回前5个
+    def get_statistics(self) -> Dict:
+        if not self.loaded:
+            return {}
+
+        return {
+            "total_records": len(self.kg_data),
+            "total_entities": len(self.entity_index),
+            "total_relations": self.kg_data.num_relations,
+            "relation_types": len(self.relation_index),
+        }
+
+
+class CCUSKnowledgeGraphSearcher:
+    KG_PATHS = [
+        "../data/ccus_project/iteration_v11/knowledge_graph_ultimate_clean.json",
+        "/root/KnowledgeGraph-based-on-Raw-text-A27-main/KnowledgeGraph-based-on-Raw-text-A27-main/data/ccus_project/iteration_v11/knowledge_graph_ultimate_clean.json",
+        "../../data/ccus_project/iteration_v11/knowledge_graph_ultimate_clean.json"
+    ]
+
+    def __init__(self, cache_size: int = 1024, cache_ttl: float = 3600):
+        self.index = KGIndex()  # 当前这一代图谱和索引，重新加载时整体替换
+        self.reload_lock = threading.Lock()
+        # (图谱的 kg_mtime, 归一化查询) -> (knowledge, subgraph, prompt)；旧一代的条目不会再被命中
+        self.query_cache = QueryCache(cache_size, cache_ttl)
+        self.load_knowledge_graph()
+
+    # 兼容原来直接读取属性的调用方；需要同时读多个属性时先取一次 self.index
+    kg_data = property(lambda self: self.index.kg_data)
+    kg_path = property(lambda self: self.index.kg_path)
+    kg_mtime = property(lambda self: self.index.kg_mtime)
+    loaded = property(lambda self: self.index.loaded)
+    entity_index = property(lambda self: self.index.entity_index)
+    relation_index = property(lambda self: self.index.relation_index)
+
+    def load_knowledge_graph(self):
+        """加载CCUS知识图谱数据 - 完全修正最终版本"""
+        for kg_path in self.KG_PATHS:
+            if os.path.exists(kg_path):
+                try:
+                    kg_mtime = os.stat(kg_path).st_mtime_ns
+                    # 使用 mmap 的二进制格式，记录按需解码，不常驻内存
+                    kg_data = load_kg(kg_path)
+                    print(f"✅ 加载知识图谱: {len(kg_data)} 条记录")
+                    index = KGIndex(kg_data, kg_path, kg_mtime)
+                    # 新的图谱和索引全部建好之后一次性替换，正在进行的检索继续使用旧的那一份
+                    self.index = index
+                    # 图谱变了，之前缓存的查询结果全部作废（之后才写入的旧结果带着旧的 kg_mtime，也不会被命中）
+                    self.query_cache.clear()
+                    return
+
+                except Exception as e:
+                    print(f"加载知识图谱失败: {e}")
+
+        print("⚠️ 未找到CCUS知识图谱数据")
+
+    def refresh(self) -> bool:
+        """知识图谱文件被修改过时重新加载，返回是否发生了重新加载"""
+        index = self.index
+        if index.kg_path is None:
+            return False
+        try:
+            kg_mtime = os.stat(index.kg_path).st_mtime_ns
+        except OSError:
+            return False
+        if kg_mtime == index.kg_mtime:
+            return False
+
+        with self.reload_lock:
+            if kg_mtime == self.index.kg_mtime:
+                return False
+            print(f"🔄 知识图谱文件已更新，重新加载: {index.kg_path}")
+            self.load_knowledge_graph()
+            return True
+
+    def match_entities(self, text: str, policy: str = "overlap") -> List[Tuple[int, int, str]]:
+        """扫描一遍文本，返回所有命中的实体及其位置 (start, end, entity)
+
+        Args:
+            policy: "overlap" 返回所有可能重叠的匹配，"longest" 只保留从左到右的最长匹配
+        """
+        return self.index.match_entities(text, policy)
+
+    def extract_entities(self, text: str, policy: str = "overlap") -> List[str]:
+        """从文本中提取可能的实体"""
+        return self.index.extract_entities(text, policy)
+
+    def search_by_entities(self, entities: List[str], top_k: int = 10) -> List[Dict]:
+        """基于实体列表搜索相关知识"""
+        return self.index.search_by_entities(entities, top_k)
+
+    def is_valid_entity(self, entity: str) -> bool:
+        """查询建索引时计算好的实体有效性，不在图谱中的实体才现场计算"""
+        return self.index.is_valid_entity(entity)
+
+    def _is_valid_entity(self, entity: str) -> bool:
+        """检查实体是否有效（人工质量过滤）"""
+        return is_valid_entity_name(entity)
+
+    def extract_subgraph(self, entities: List[str], relevant_records: List[Dict] = None) -> Dict:
+        """提取以给定实体为中心的子图
+
+        Args:
+            relevant_records: 已经检索好的相关记录，传入时直接复用，不再重复打分
+        """
+        return self.index.extract_subgraph(entities, relevant_records)
+
+    def search_knowledge(self, query: str) -> Tuple[List[Dict], Dict]:
+        """搜索知识图谱，返回相关知识和子图"""
+        return self.index.search_knowledge(query)
+
+    def search_with_prompt(self, query: str) -> Tuple[List[Dict], Dict, str]:
+        """带缓存的检索，返回 (knowledge, subgraph, prompt_fragment)
+
+        结果会被多次请求共享，调用方不要原地修改返回的对象。
+        """
+        self.refresh()
+
+        # 整个检索只用这一代的图谱，缓存键带上它的 kg_mtime
+        index = self.index
+        key = (index.kg_mtime, normalize_query(query))
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            return cached
+
+        knowledge, subgraph = index.search_knowledge(query)
+        result = (knowledge, subgraph, self.format_knowledge_for_prompt(knowledge))
+        self.query_cache.put(key, result)
+        return result
+
+    def _keyword_search(self, query: str, top_k: int = 5) -> List[str]:
+        """基于关键词搜索实体，按实体出现的记录数排序"""
+        return self.index.keyword_search(query, top_k)
 
     def format_knowledge_for_prompt(self, knowledge: List[Dict]) -> str:
         """格式化知识用于LLM prompt"""
@@ -308,14 +461,7 @@ class CCUSKnowledgeGraphSearcher:
 
     def get_statistics(self) -> Dict:
         """获取知识图谱统计信息"""
-        if not self.loaded:
-            return {}
-
-        total_relations = sum(len(record.get('relationMentions', [])) for record in self.kg_data)
-
-        return {
-            "total_records": len(self.kg_data),
-            "total_entities": len(self.entity_index),
-            "total_relations": total_relations,
-            "relation_types": len(self.relation_index)
-        }
\ No newline at end of file
+        statistics = self.index.get_statistics()
+        if statistics:
+            statistics["query_cache"] = self.query_cache.stats()
+        return statistics
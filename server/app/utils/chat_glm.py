@@ -2,6 +2,7 @@ import os
 import sys
 import json
 import torch
+import threading
 from pathlib import Path
 from opencc import OpenCC
 from transformers import AutoTokenizer, AutoModel
@@ -10,19 +11,56 @@ from app.utils.query_wiki import WikiSearcher
 from app.utils.ner import Ner
 from app.utils.graph_utils import convert_graph_to_triples, search_node_item
 from app.utils.ccus_kg_search import CCUSKnowledgeGraphSearcher
+from app.utils.retrieval import RetrievalFanOut, wiki_pool
+from app.utils.model_loader import StartupTimeline, load_kwargs
+from app.utils.inference import InferenceClient
 
 # 全局变量
 model = None
 tokenizer = None
 init_history = None
-
-# 初始化各种工具
-ner = Ner()
-image_searcher = ImageSearcher()
-wiki_searcher = WikiSearcher()
-ccus_searcher = CCUSKnowledgeGraphSearcher()
+# 模型的加载进度，stream_predict 在模型就绪之前只返回知识图谱检索结果
+startup = StartupTimeline()
+
+# 检索用的各种工具，由 preload() 初始化。多进程部署时主进程在 fork 之前预加载，worker 共享这些内存页
+ner = None
+image_searcher = None
+wiki_searcher = None
+ccus_searcher = None
+preload_lock = threading.Lock()
 cc = OpenCC('t2s')
 
+# 多进程部署时模型在单独的推理进程里（见 server/serve.py），本进程只通过 IPC 请求生成
+inference_client = None
+
+NER_ETYPES = ["技术", "项目", "机构", "地理", "政策", "标准", "经济", "设备", "指标", "环境"]
+
+# 检索阶段的延迟预算和各个检索源的超时（秒），超时的源不参与本轮回答
+RETRIEVAL_BUDGET = 3.0
+RETRIEVAL_TIMEOUTS = {
+    "kg": 2.0,
+    "ner": 1.5,
+    "image": 0.5,
+    "wiki": 2.5,
+}
+# 维基百科每次 HTTP 请求的超时，要小于上面 wiki 的超时；最多查询前几个实体的维基百科
+WIKI_HTTP_TIMEOUT = 1.0
+WIKI_MAX_ENTITIES = 3
+
+# 对话前缀 KV 缓存的容量上限（MB），默认为 0（关闭）。
+# 开启后上下文按单向注意力编码，和原版的双向注意力结果不同，会改变模型的回答，确认效果之后再按需开启
+PREFIX_CACHE_MB = int(os.environ.get("PREFIX_CACHE_MB", 0))
+
+# 同时参与解码的最大会话数（连续批处理），设为 0 时每个请求单独调用 stream_generate
+GENERATION_BATCH_SIZE = int(os.environ.get("GENERATION_BATCH_SIZE", 8))
+
+# CPU 上权重量化的位数（4 或 8），设为 0 时不量化、以 fp32 运行（约 24GB 内存）
+CPU_QUANTIZATION_BIT = int(os.environ.get("CPU_QUANTIZATION_BIT", 4))
+# 预先量化好的模型目录，由 python models/chatglm-6b/quantization.py <模型> <输出目录> --bits 4 生成
+QUANTIZED_MODEL_PATH = f"./models/chatglm-6b-int{CPU_QUANTIZATION_BIT}"
+
+PRE_PROMPT = "你叫 ChatKG，是一个专业的CCUS（碳捕集利用与封存）领域知识图谱问答机器人。你可以基于CCUS领域知识图谱回答相关技术问题。"
+
 # 模型路径配置
 MODEL_PATHS = [
     "/root/KnowledgeGraph-based-on-Raw-text-A27-main/KnowledgeGraph-based-on-Raw-text-A27-main/models/chatglm-6b",
@@ -30,6 +68,36 @@ MODEL_PATHS = [
     "THUDM/chatglm-6b"
 ]
 
+def preload():
+    """初始化 NER、图像、维基百科和知识图谱检索器，重复调用只初始化一次"""
+    global ner, image_searcher, wiki_searcher, ccus_searcher
+    with preload_lock:
+        if ccus_searcher is not None:
+            return
+        ner = Ner()
+        image_searcher = ImageSearcher()
+        wiki_searcher = WikiSearcher(timeout=WIKI_HTTP_TIMEOUT)
+        ccus_searcher = CCUSKnowledgeGraphSearcher()
+
+
+def use_inference_server(address, authkey=None):
+    """生成请求改为发给 address 上的推理进程，address 为 None 时使用本进程里的模型"""
+    global inference_client
+    inference_client = InferenceClient(address, authkey) if address else None
+
+
+def kg_statistics():
+    preload()
+    return ccus_searcher.get_statistics()
+
+
+def ner_stats():
+    """实体识别的缓存命中率和平均批大小"""
+    if ner is None:
+        return None
+    return ner.stats()
+
+
 def predict(user_input, history=None):
     global model, tokenizer, init_history
     if not history:
@@ -37,27 +105,169 @@ def predict(user_input, history=None):
     return model.chat(tokenizer, user_input, history)
 
 
-def stream_predict(user_input, history=None):
+def load_cpu_model(model_path):
+    """CPU 上加载模型：优先使用预先量化好的权重，否则加载后再做 int8/int4 权重量化"""
+    if CPU_QUANTIZATION_BIT and os.path.exists(QUANTIZED_MODEL_PATH):
+        print(f"加载预量化模型: {QUANTIZED_MODEL_PATH}")
+        return AutoModel.from_pretrained(QUANTIZED_MODEL_PATH, **load_kwargs(QUANTIZED_MODEL_PATH, "cpu")).float()
+
+    cpu_model = AutoModel.from_pretrained(model_path, **load_kwargs(model_path, "cpu"))
+    if CPU_QUANTIZATION_BIT and hasattr(cpu_model, "quantize"):
+        print(f"量化模型权重为 int{CPU_QUANTIZATION_BIT}...")
+        cpu_model = cpu_model.quantize(CPU_QUANTIZATION_BIT)
+    # 量化后的权重保持 int8，其余的层归一化、词表等转成 fp32
+    return cpu_model.float()
+
+
+def enable_prefix_cache():
+    """开启 ChatGLM 的前缀 KV 缓存，并预先编码所有会话共享的系统提示
+
+    之后每一轮只需要 prefill 上一轮回答和新问题的 token，不再重复编码系统提示和整段历史。
+    从 Hugging Face 加载的原版模型没有这个功能，直接跳过。
+    """
+    if PREFIX_CACHE_MB <= 0 or not hasattr(model, "enable_prefix_cache"):
+        return
+    if model.enable_prefix_cache(PREFIX_CACHE_MB * 1024 * 1024) is not None:
+        model.cache_history(tokenizer, init_history)
+        print(f"✅ 已开启前缀KV缓存 (上限 {PREFIX_CACHE_MB}MB)")
+
+
+def enable_batching():
+    """并发的对话交给模型里的调度线程统一批量解码，新请求在两个解码步之间加入"""
+    if GENERATION_BATCH_SIZE <= 0 or not hasattr(model, "enable_continuous_batching"):
+        return
+    model.enable_continuous_batching(GENERATION_BATCH_SIZE)
+    print(f"✅ 已开启连续批处理 (最多 {GENERATION_BATCH_SIZE} 个会话同时解码)")
+
+
+def model_ready():
+    return startup.ready.is_set()
+
+
+def model_status():
+    """模型加载状态和各阶段耗时，给 /api/ready 使用"""
+    if inference_client is not None:
+        return inference_client.status()["model"]
+    return startup.to_dict()
+
+
+def kg_only_answer(kg_info, triples):
+    """模型还没加载好时，直接把检索到的知识图谱信息作为回答"""
+    lines = ["模型加载中，请稍后再试。以下是知识图谱中检索到的相关信息："]
+    if kg_info:
+        lines.append(kg_info.strip())
+    if triples:
+        lines.append("；".join(f"({t[0]} {t[1]} {t[2]})" for t in triples[:20]))
+    if len(lines) == 1:
+        return "模型加载中，请稍后再试"
+    return "\n".join(lines)
+
+
+def prefix_cache_stats():
+    if inference_client is not None:
+        return inference_client.status()["prefix_cache"]
+    if model is None or getattr(model, "prefix_cache", None) is None:
+        return None
+    return model.prefix_cache.stats()
+
+
+def generation_stats():
+    """调度器的吞吐（tokens/s）和排队深度"""
+    if inference_client is not None:
+        return inference_client.status()["generation"]
+    if model is None or getattr(model, "scheduler", None) is None:
+        return None
+    return model.scheduler.stats()
+
+
+def fetch_wiki(query):
+    """在检索线程里把维基百科页面完整取回来（summary 是懒加载的），并转成简体"""
+    page = wiki_searcher.search(query)
+    if page is None:
+        return None
+    return {
+        "title": cc.convert(page.title),
+        "summary": cc.convert(page.summary),
+    }
+
+
+def generate(query, history):
+    """用本进程里的模型流式生成 (response, history)"""
+    if getattr(model, "scheduler", None) is not None:
+        # 开启了连续批处理（GENERATION_BATCH_SIZE > 0）：所有会话共用调度器里按批拼接的 KV 缓存，静态缓存不适用
+        return model.stream_chat(tokenizer, query, history)
+    # 单独解码时 static_kv_cache 生效：KV 写入预分配的缓冲区，不再每个 token 拼接一次整个缓存
+    return model.stream_chat(tokenizer, query, history, static_kv_cache=True)
+
+
+def encode_event(event):
+    return json.dumps(event, ensure_ascii=False).encode('utf8') + b'\n'
+
+
+def stream_deltas(user_input, responses, history, graph, image, wiki, fallback="模型加载中，请稍后再试"):
+    """增量协议：静态上下文只在第一条消息里发送一次，之后每个 token 只发送新增的文本
+
+    - {"type": "context", "query", "graph", "image", "wiki"}
+    - {"type": "delta", "offset", "text"}：客户端把回答截断到 offset 再拼接 text
+    - {"type": "done", "response", "history"}
+    """
+    yield encode_event({"type": "context", "query": user_input, "graph": graph, "image": image, "wiki": wiki})
+
+    if responses is None:
+        responses = [(fallback, history)]
+
+    sent = ""
+    for response, history in responses:
+        # ChatGLM 的后处理偶尔会改写已经输出的字符，所以带上从哪里开始替换
+        if response.startswith(sent):
+            offset = len(sent)
+        else:
+            offset = len(os.path.commonprefix([sent, response]))
+        if offset == len(response) == len(sent):
+            continue
+        yield encode_event({"type": "delta", "offset": offset, "text": response[offset:]})
+        sent = response
+
+    yield encode_event({"type": "done", "response": sent, "history": history})
+
+
+def stream_predict(user_input, history=None, stream_mode="full"):
+    """检索并流式生成回答
+
+    Args:
+        stream_mode: "full" 每个 token 都返回完整的 history/graph/image/wiki（旧协议）；
+                     "delta" 使用 stream_deltas 的增量协议
+    """
     global model, tokenizer, init_history
+    preload()
     if not history:
-        history = init_history
+        # 模型加载完成之前（以及多进程部署的 Web worker 里）还没有系统提示的历史
+        history = init_history or []
 
     ref = ""
 
-    # 1. CCUS知识图谱检索
+    # 所有检索源并发执行：知识图谱、实体识别、图像搜索，以及用原始问题做的维基百科预取
+    fanout = RetrievalFanOut(RETRIEVAL_BUDGET)
     print(f"🔍 CCUS知识图谱检索: {user_input}")
-    knowledge, subgraph = ccus_searcher.search_knowledge(user_input)
+    fanout.submit("kg", ccus_searcher.search_with_prompt, user_input, timeout=RETRIEVAL_TIMEOUTS["kg"])
+    fanout.submit("ner", ner.get_entities, user_input, etypes=NER_ETYPES, timeout=RETRIEVAL_TIMEOUTS["ner"])
+    fanout.submit("image", image_searcher.search, user_input, timeout=RETRIEVAL_TIMEOUTS["image"])
+    fanout.submit(f"wiki:{user_input}", fetch_wiki, user_input, timeout=RETRIEVAL_TIMEOUTS["wiki"], executor=wiki_pool)
+
+    # 1. CCUS知识图谱检索
+    knowledge, subgraph, kg_info = fanout.result("kg", ([], {"nodes": [], "edges": []}, ""))
 
     if knowledge:
-        kg_info = ccus_searcher.format_knowledge_for_prompt(knowledge)
         if kg_info:
             ref += f"CCUS知识图谱信息：\n{kg_info}\n\n"
             print(f"找到CCUS知识: {len(knowledge)} 条相关记录")
 
     # 2. 实体识别（保留原有逻辑）
     # 确保graph对象始终包含nodes和links属性
+    # 子图来自查询缓存，后面会往里追加节点和连线，所以要复制列表
     if subgraph.get("nodes"):
-        graph = subgraph.copy()
+        links = list(subgraph["links"])
+        graph = {"nodes": list(subgraph["nodes"]), "links": links, "edges": links}
     else:
         graph = {"nodes": [], "links": [], "edges": []}
 
@@ -67,16 +277,19 @@ def stream_predict(user_input, history=None):
     else:
         graph["sents"] = []
 
-    entities = []
-
-    try:
-        entities = ner.get_entities(user_input, etypes=["技术", "项目", "机构", "地理", "政策", "标准", "经济", "设备", "指标", "环境"])
+    entities = fanout.result("ner")
+    if entities is not None:
         print("识别的实体: ", entities)
-    except:
-        # 如果实体识别失败，使用CCUS搜索器的实体提取
+    else:
+        # 如果实体识别失败或超时，使用CCUS搜索器的实体提取
         entities = ccus_searcher.extract_entities(user_input)
         print("CCUS实体提取: ", entities)
 
+    # 实体出来后立刻并发查询前几个实体的维基百科
+    wiki_entities = entities[:WIKI_MAX_ENTITIES]
+    for ent in wiki_entities:
+        fanout.submit(f"wiki:{ent}", fetch_wiki, ent, timeout=RETRIEVAL_TIMEOUTS["wiki"], executor=wiki_pool)
+
     # 3. 传统三元组检索（作为补充）
     triples = []
     for entity in entities:
@@ -94,30 +307,19 @@ def stream_predict(user_input, history=None):
         ref += f"补充三元组信息：{triples_str}\n\n"
 
     # 4. 图像搜索
-    image = None
-    try:
-        image = image_searcher.search(user_input)
-    except:
-        image = None
+    image = fanout.result("image")
 
-    # 5. 外部知识搜索（Wikipedia等）
+    # 5. 外部知识搜索（Wikipedia等），按实体顺序取第一个在预算内返回的结果
     wiki = None
-    try:
-        for ent in entities + [user_input]:
-            wiki = wiki_searcher.search(ent)
-            if wiki is not None:
-                break
-
-        # 将Wikipedia搜索到的繁体转为简体
-        if wiki:
-            ref += f"外部知识：{cc.convert(wiki.summary)}\n"
-            wiki = {
-                "title": cc.convert(wiki.title),
-                "summary": cc.convert(wiki.summary),
-            }
+    for ent in wiki_entities + [user_input]:
+        wiki = fanout.result(f"wiki:{ent}")
+        if wiki is not None:
+            ref += f"外部知识：{wiki['summary']}\n"
             print("找到Wikipedia信息:", wiki["title"])
-    except Exception as e:
-        print(f"Wikipedia搜索失败: {e}")
+            break
+
+    fanout.cancel_pending()
+    print(f"检索阶段耗时: {fanout.elapsed():.2f}s")
 
     if not wiki:
         wiki = {
@@ -125,20 +327,35 @@ def stream_predict(user_input, history=None):
             "summary": "基于CCUS领域知识图谱的专业问答",
         }
 
-    if model is not None:
+    if inference_client is not None or (model is not None and model_ready()):
         if ref:
             chat_input = f"\n===参考资料===：\n{ref}；\n\n根据上面资料，用简洁且准确的话回答下面问题：\n{user_input}"
         else:
             chat_input = user_input
 
         clean_history = []
-        for user_input, response in history:
-            if "===参考资料===" in user_input:
-                user_input = user_input.split("===参考资料===")[0]
-            clean_history.append((user_input, response))
+        for query, response in history:
+            if "===参考资料===" in query:
+                query = query.split("===参考资料===")[0]
+            clean_history.append((query, response))
 
         print("chat_input: ", chat_input)
-        for response, history in model.stream_chat(tokenizer, chat_input, clean_history):
+        if inference_client is not None:
+            # 推理进程不可达或模型还没加载好时返回 None，和本进程模型未就绪一样只返回检索结果
+            responses = inference_client.stream_chat(chat_input, clean_history)
+        else:
+            responses = generate(chat_input, clean_history)
+    else:
+        responses = None
+
+    fallback = kg_only_answer(kg_info if knowledge else "", triples)
+
+    if stream_mode == "delta":
+        yield from stream_deltas(user_input, responses, history, graph, image, wiki, fallback)
+        return
+
+    if responses is not None:
+        for response, history in responses:
             updates = {}
             for query, response in history:
                 updates["query"] = query
@@ -156,7 +373,7 @@ def stream_predict(user_input, history=None):
     else:
         updates = {
             "query": user_input,
-            "response": "模型加载中，请稍后再试"
+            "response": fallback
         }
 
         result = {
@@ -173,6 +390,8 @@ def start_model():
     global model, tokenizer, init_history
 
     print("🤖 正在加载ChatGLM-6B模型...")
+    startup.begin()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
 
     # 尝试各个可能的模型路径
     model_path = None
@@ -185,29 +404,29 @@ def start_model():
     if not model_path:
         print("❌ 未找到ChatGLM-6B模型，请先下载")
         print("运行: python download_chatglm.py")
+        startup.mark_failed("未找到ChatGLM-6B模型")
         return False
 
     try:
         from transformers import AutoTokenizer, AutoModel
         # 加载tokenizer
-        print("加载tokenizer...")
-        tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        with startup.stage("tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
 
         # 加载模型
-        print("加载模型权重...")
-        if torch.cuda.is_available():
-            model = AutoModel.from_pretrained(model_path, trust_remote_code=True).half().cuda()
-            print("✅ 模型已加载到GPU")
-        else:
-            model = AutoModel.from_pretrained(model_path, trust_remote_code=True)
-            print("⚠️ 模型加载到CPU (性能较慢)")
-
-        model.eval()
+        with startup.stage("weights"):
+            if device == "cuda":
+                kwargs = load_kwargs(model_path, device)
+                cuda_model = AutoModel.from_pretrained(model_path, **kwargs)
+                # 用了 device_map 时权重已经直接加载到显卡上
+                model = cuda_model if "device_map" in kwargs else cuda_model.half().cuda()
+                print("✅ 模型已加载到GPU")
+            else:
+                model = load_cpu_model(model_path)
+                print("⚠️ 模型加载到CPU (性能较慢)")
 
-        # 初始化对话历史
-        pre_prompt = "你叫 ChatKG，是一个专业的CCUS（碳捕集利用与封存）领域知识图谱问答机器人。你可以基于CCUS领域知识图谱回答相关技术问题。"
-        _, history = predict(pre_prompt, [])
-        init_history = history
+        warm_up()
+        startup.mark_ready(device)
 
         print("✅ ChatGLM-6B模型加载成功！")
         return True
@@ -221,30 +440,49 @@ def start_model():
             from transformers import AutoTokenizer, AutoModel
             print("从Hugging Face下载ChatGLM-6B...")
 
-            tokenizer = AutoTokenizer.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True)
-            if torch.cuda.is_available():
-                model = AutoModel.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True).half().cuda()
-            else:
-                model = AutoModel.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True)
-
-            model.eval()
+            with startup.stage("download"):
+                tokenizer = AutoTokenizer.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True)
+                if device == "cuda":
+                    model = AutoModel.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True).half().cuda()
+                else:
+                    model = AutoModel.from_pretrained("THUDM/chatglm-6b", trust_remote_code=True)
 
-            # 保存模型到本地
-            local_path = "./models/chatglm-6b"
-            os.makedirs(local_path, exist_ok=True)
-            tokenizer.save_pretrained(local_path)
-            model.save_pretrained(local_path)
+            # 保存模型到本地，保存为 safetensors 分片，下次启动可以直接 mmap 加载
+            with startup.stage("save"):
+                local_path = "./models/chatglm-6b"
+                os.makedirs(local_path, exist_ok=True)
+                tokenizer.save_pretrained(local_path)
+                model.save_pretrained(local_path, safe_serialization=True)
 
             print(f"✅ 模型下载并保存到: {local_path}")
 
-            # 初始化对话历史
-            pre_prompt = "你叫 ChatKG，是一个专业的CCUS（碳捕集利用与封存）领域知识图谱问答机器人。你可以基于CCUS领域知识图谱回答相关技术问题。"
-            _, history = predict(pre_prompt, [])
-            init_history = history
-
+            warm_up()
+            startup.mark_ready(device)
             return True
 
         except Exception as e2:
             print(f"❌ 自动下载也失败: {e2}")
             print("请手动下载ChatGLM-6B模型")
-            return False
\ No newline at end of file
+            model = None
+            startup.mark_failed(e2)
+            return False
+
+
+def warm_up():
+    """用系统提示跑一轮对话，得到所有会话共享的初始历史，并开启前缀缓存和连续批处理"""
+    global init_history
+
+    model.eval()
+    with startup.stage("warm_up"):
+        _, history = predict(PRE_PROMPT, [])
+        init_history = history
+    with startup.stage("caches"):
+        enable_prefix_cache()
+        enable_batching()
+
+
+def start_model_async():
+    """在后台线程里加载模型，HTTP 服务不用等模型加载完就可以响应知识图谱等接口"""
+    thread = threading.Thread(target=start_model, name="chatglm-loader", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,362 @@
+"""
+知识图谱的分层（LOD）视图
+
+前端不再一次性拿到整张图，而是：
+
+- /api/graph 返回一张粗粒度的总览：按社区配额挑出 k-core 最高、连接最多的核心节点，以及它们之间最重要的连线
+- /api/graph/node/<id>/neighbors 按连线重要性分页展开某个节点的邻居，用 cursor 翻页
+
+社区划分（加权标签传播）、k-core 分解、邻接表排序和总览都是离线预计算的，结果保存在知识图谱旁边的
+.lod.json 文件里，用源文件的 sha1 校验；服务启动时直接读取，过期或不存在时才现场构建并写回。
+"""
+import os
+import json
+import hashlib
+import tempfile
+from collections import defaultdict
+
+FORMAT_VERSION = 1
+SUFFIX = '.lod.json'
+
+OVERVIEW_NODES = 300      # 总览里的节点数
+OVERVIEW_LINKS = 1000     # 总览里的连线数
+OVERVIEW_CATEGORIES = 12  # 单独着色的最大社区数，其余归为"其他"
+NEIGHBOR_PAGE_SIZE = 30   # 默认每页展开的邻居数
+MAX_PAGE_SIZE = 200
+
+
+def lod_path(kg_path):
+    return os.path.splitext(kg_path)[0] + SUFFIX
+
+
+def fallback_lod_path(kg_path):
+    """知识图谱所在目录不可写时，预计算结果放到临时目录"""
+    digest = hashlib.sha1(os.path.abspath(kg_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"kg_{digest}{SUFFIX}")
+
+
+def core_numbers(neighbors):
+    """Batagelj-Zaversnik 算法，O(边数) 求每个节点的 k-core 编号"""
+    n = len(neighbors)
+    degree = [len(adj) for adj in neighbors]
+    max_degree = max(degree, default=0)
+
+    bins = [0] * (max_degree + 1)
+    for d in degree:
+        bins[d] += 1
+    start = 0
+    for d in range(max_degree + 1):
+        bins[d], start = start, start + bins[d]
+
+    position = [0] * n
+    order = [0] * n
+    for v in range(n):
+        position[v] = bins[degree[v]]
+        order[position[v]] = v
+        bins[degree[v]] += 1
+    for d in range(max_degree, 0, -1):
+        bins[d] = bins[d - 1]
+    bins[0] = 0
+
+    for i in range(n):
+        v = order[i]
+        for u in neighbors[v]:
+            if degree[u] > degree[v]:
+                du, pu = degree[u], position[u]
+                pw = bins[du]
+                w = order[pw]
+                if u != w:
+                    position[u], position[w] = pw, pu
+                    order[pu], order[pw] = w, u
+                bins[du] += 1
+                degree[u] -= 1
+    return degree
+
+
+def label_propagation(weighted_neighbors, order, max_iterations=10):
+    """加权标签传播社区划分，按给定顺序更新，结果是确定的"""
+    labels = list(range(len(weighted_neighbors)))
+    for _ in range(max_iterations):
+        changed = 0
+        for v in order:
+            if not weighted_neighbors[v]:
+                continue
+            scores = defaultdict(float)
+            for u, weight in weighted_neighbors[v]:
+                scores[labels[u]] += weight
+            best = max(scores.items(), key=lambda item: (item[1], -item[0]))[0]
+            if best != labels[v]:
+                labels[v] = best
+                changed += 1
+        if changed == 0:
+            break
+    return labels
+
+
+class GraphLOD:
+    """预计算好的图结构：节点、合并后的有向连线、按重要性排序的邻接表、社区和总览"""
+
+    def __init__(self, data):
+        self.source_sha1 = data['source_sha1']
+        self.names = data['names']
+        self.degree = data['degree']
+        self.core = data['core']
+        self.community = data['community']
+        self.categories = data['categories']
+        self.src = data['src']
+        self.dst = data['dst']
+        self.weight = data['weight']
+        self.labels = data['labels']
+        self.adj_offsets = data['adj_offsets']  # 第 v 个节点的邻接连线为 adj_edges[adj_offsets[v]:adj_offsets[v+1]]
+        self.adj_edges = data['adj_edges']
+        self.overview_nodes = data['overview_nodes']
+        self.overview_links = data['overview_links']
+        self.data = data
+        self.ids = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def build(cls, relation_data, source_sha1=None):
+        ids = {}
+        names = []
+        edge_ids = {}  # (em1 id, em2 id) -> 连线 id，同一对实体的多条关系合并为一条
+        src, dst, weight, labels = [], [], [], []
+
+        def node_id(name):
+            i = ids.get(name)
+            if i is None:
+                i = ids[name] = len(names)
+                names.append(name)
+            return i
+
+        for item in relation_data:
+            for relation in item.get('relationMentions', []):
+                em1 = relation.get('em1Text', '')
+                em2 = relation.get('em2Text', '')
+                if not em1 or not em2:
+                    continue
+                key = (node_id(em1), node_id(em2))
+                e = edge_ids.get(key)
+                if e is None:
+                    e = edge_ids[key] = len(src)
+                    src.append(key[0])
+                    dst.append(key[1])
+                    weight.append(0)
+                    labels.append([])
+                weight[e] += 1
+                label = relation.get('label', '')
+                if label not in labels[e]:
+                    labels[e].append(label)
+
+        n = len(names)
+        incident = [[] for _ in range(n)]
+        for e, (s, t) in enumerate(zip(src, dst)):
+            incident[s].append(e)
+            if t != s:
+                incident[t].append(e)
+
+        # 无向、去重、不含自环的邻居集合，用于 k-core 和社区划分
+        neighbor_weights = [defaultdict(int) for _ in range(n)]
+        for e, (s, t) in enumerate(zip(src, dst)):
+            if s != t:
+                neighbor_weights[s][t] += weight[e]
+                neighbor_weights[t][s] += weight[e]
+        degree = [len(w) for w in neighbor_weights]
+        core = core_numbers([list(w) for w in neighbor_weights])
+
+        # 核心程度：先比 k-core，再比连接数
+        rank = sorted(range(n), key=lambda v: (-core[v], -degree[v], v))
+        labels_of = label_propagation([list(w.items()) for w in neighbor_weights], rank)
+
+        members = defaultdict(list)
+        for v in rank:
+            members[labels_of[v]].append(v)
+        ordered = sorted(members.values(), key=lambda vs: (-len(vs), vs[0]))
+        community = [0] * n
+        for c, vs in enumerate(ordered):
+            for v in vs:
+                community[v] = c
+
+        # 每个社区用其中最核心的节点命名
+        categories = [{'name': names[vs[0]], 'size': len(vs)} for vs in ordered[:OVERVIEW_CATEGORIES]]
+        if len(ordered) > OVERVIEW_CATEGORIES:
+            categories.append({'name': '其他', 'size': sum(len(vs) for vs in ordered[OVERVIEW_CATEGORIES:])})
+
+        # 邻接表按连线权重、邻居的连接数排序，分页展开时先给出最重要的邻居
+        adj_offsets = [0]
+        adj_edges = []
+        for v in range(n):
+            edges = sorted(incident[v], key=lambda e: (-weight[e], -degree[src[e] if dst[e] == v else dst[e]], e))
+            adj_edges.extend(edges)
+            adj_offsets.append(len(adj_edges))
+
+        # 总览：每个社区按规模分配名额，名额内取最核心的节点，剩余名额按全局排名补齐
+        budget = min(OVERVIEW_NODES, n)
+        selected = []
+        chosen = set()
+        for vs in ordered:
+            quota = min(len(vs), round(budget * len(vs) / n), budget - len(selected))
+            if quota <= 0:
+                break
+            selected.extend(vs[:quota])
+        chosen.update(selected)
+        for v in rank:
+            if len(selected) >= budget:
+                break
+            if v not in chosen:
+                selected.append(v)
+                chosen.add(v)
+
+        overview_links = sorted(
+            (e for e in range(len(src)) if src[e] in chosen and dst[e] in chosen),
+            key=lambda e: (-weight[e], e),
+        )[:OVERVIEW_LINKS]
+
+        return cls({
+            'version': FORMAT_VERSION,
+            'source_sha1': source_sha1,
+            'names': names,
+            'degree': degree,
+            'core': core,
+            'community': community,
+            'categories': categories,
+            'src': src,
+            'dst': dst,
+            'weight': weight,
+            'labels': labels,
+            'adj_offsets': adj_offsets,
+            'adj_edges': adj_edges,
+            'overview_nodes': selected,
+            'overview_links': overview_links,
+        })
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_sha1):
+        """读取预计算结果，格式版本或源文件哈希对不上时返回 None"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != FORMAT_VERSION or data.get('source_sha1') != source_sha1:
+            return None
+        return cls(data)
+
+    def find_id(self, v):
+        """检查节点 id 是否存在，存在时返回 v，否则返回 None"""
+        return v if 0 <= v < len(self.names) else None
+
+    def find_name(self, name):
+        """实体名 -> 节点 id，找不到时返回 None；"0"、"02" 这样的实体名也按名字查找"""
+        return self.ids.get(name)
+
+    def node_item(self, v):
+        category = self.community[v]
+        return {
+            'id': v,
+            'name': self.names[v],
+            'category': min(category, len(self.categories) - 1),
+            'value': self.degree[v],
+            'degree': self.degree[v],
+            'core': self.core[v],
+        }
+
+    def link_item(self, e):
+        labels = self.labels[e]
+        label = labels[0] if len(labels) == 1 else f"{labels[0]}等{len(labels)}种关系"
+        return {
+            'id': e,
+            'source': self.src[e],
+            'target': self.dst[e],
+            'value': label,
+            'name': label,
+            'weight': self.weight[e],
+            'lineStyle': {
+                'color': '#bbb',
+                'width': min(3, 1 + self.weight[e] * 0.2)
+            }
+        }
+
+    def overview(self):
+        return {
+            'nodes': [self.node_item(v) for v in self.overview_nodes],
+            'links': [self.link_item(e) for e in self.overview_links],
+            'categories': [{'name': c['name'], 'size': c['size']} for c in self.categories],
+            'stats': {
+                'total_nodes': len(self.names),
+                'total_links': len(self.src),
+                'communities': max(self.community, default=-1) + 1,
+            },
+        }
+
+    def neighbors(self, v, cursor=None, limit=NEIGHBOR_PAGE_SIZE):
+        """按重要性分页返回 v 的邻居和连线
+
+        cursor 带上了图谱版本（源文件哈希前缀），图谱更新后旧的 cursor 会被拒绝（ValueError）。
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        offset = 0
+        if cursor:
+            version, _, offset = cursor.partition('.')
+            if version != self.cursor_version() or not offset.isdigit():
+                raise ValueError('cursor 已失效，请重新展开')
+            offset = int(offset)
+
+        start, end = self.adj_offsets[v], self.adj_offsets[v + 1]
+        edges = self.adj_edges[start + offset:min(start + offset + limit, end)]
+        nodes = []
+        for e in edges:
+            u = self.dst[e] if self.src[e] == v else self.src[e]
+            nodes.append(self.node_item(u))
+
+        next_offset = offset + len(edges)
+        return {
+            'node': self.node_item(v),
+            'nodes': nodes,
+            'links': [self.link_item(e) for e in edges],
+            'total': end - start,
+            'next_cursor': f"{self.cursor_version()}.{next_offset}" if start + next_offset < end else None,
+        }
+
+    def cursor_version(self):
+        return (self.source_sha1 or '')[:8]
+
+
+def load_graph_lod(kg):
+    """读取 kg（KnowledgeGraphFile）对应的预计算结果，不存在或过期时构建并写回"""
+    paths = [lod_path(kg.path), fallback_lod_path(kg.path)]
+    for path in paths:
+        lod = GraphLOD.load(path, kg.source_sha1)
+        if lod is not None:
+            return lod
+
+    print("🧮 预计算图谱社区、核心节点和总览...")
+    lod = GraphLOD.build(kg, kg.source_sha1)
+    for path in paths:
+        try:
+            lod.save(path)
+            break
+        except OSError:
+            continue
+    return lod
+
+
+if __name__ == "__main__":
+    # 离线预计算，在 server 目录下运行: python -m app.utils.graph_lod ../data/ccus_project/iteration_v11/knowledge_graph.json
+    import sys
+    import time
+    from app.utils.kg_loader import load_kg
+
+    for path in sys.argv[1:]:
+        start = time.time()
+        kg = load_kg(path)
+        lod = GraphLOD.build(kg, kg.source_sha1)
+        lod.save(lod_path(kg.path))
+        overview = lod.overview()
+        print(f"{path} -> {lod_path(kg.path)}: {overview['stats']}, "
+              f"总览 {len(overview['nodes'])} 个节点 / {len(overview['links'])} 条连线, {time.time() - start:.1f}s")
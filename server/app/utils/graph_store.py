@@ -0,0 +1,91 @@
+import os
+import json
+import gzip
+import threading
+from collections import namedtuple
+
+from app.utils.kg_loader import load_kg
+
+
+# 一次构建好的响应：原始 JSON、gzip 压缩后的 JSON、ETag，以及可选的查询索引
+GraphSnapshot = namedtuple('GraphSnapshot', ['body', 'gzip_body', 'etag', 'path', 'version', 'index'])
+
+
+class GraphStore:
+    """进程级的图谱缓存
+
+    启动时加载一次知识图谱并序列化好响应，之后每次请求只做一次 os.stat；
+    只有当文件的 mtime 变化且内容哈希也变化时才会重新解析和构建。
+    """
+
+    def __init__(self, paths, build_response, build_index=None):
+        """
+        Args:
+            paths: 候选的知识图谱文件路径，按顺序使用第一个存在的
+            build_response: 将关系数据（可迭代的记录 dict）转换为响应 dict 的函数；
+                指定了 build_index 时传入的是索引
+            build_index: 可选，从 KnowledgeGraphFile 构建查询索引，和响应一起缓存在快照里
+        """
+        self.paths = paths
+        self.build_response = build_response
+        self.build_index = build_index
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.stat_key = None    # (path, mtime_ns, size)
+        self.digest = None
+        self.version = 0        # 每次真正重建响应时加一，供其他缓存判断是否失效
+
+    def find_path(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get(self):
+        """返回当前的 GraphSnapshot，必要时重新加载；找不到文件时抛出 FileNotFoundError"""
+        path = self.find_path()
+        if path is None:
+            raise FileNotFoundError("CCUS knowledge graph data not found")
+
+        stat = os.stat(path)
+        stat_key = (path, stat.st_mtime_ns, stat.st_size)
+        snapshot = self.snapshot
+        if snapshot is not None and stat_key == self.stat_key:
+            return snapshot
+
+        with self.lock:
+            # 其他线程可能已经完成了重新加载
+            if self.snapshot is not None and stat_key == self.stat_key:
+                return self.snapshot
+            return self._reload(path, stat_key)
+
+    def _reload(self, path, stat_key):
+        # 编译好的 .kgb 里记录了源文件的 sha1，不需要再读一遍 JSONL
+        kg = load_kg(path)
+        digest = kg.source_sha1
+        if self.snapshot is not None and digest == self.digest and path == self.snapshot.path:
+            # 只是 touch 了文件，内容没变，沿用之前的响应
+            self.stat_key = stat_key
+            return self.snapshot
+
+        print(f"🔄 加载知识图谱: {path}")
+        index = None
+        if self.build_index is not None:
+            index = self.build_index(kg)
+            response = self.build_response(index)
+        else:
+            response = self.build_response(kg)
+
+        body = json.dumps(response, ensure_ascii=False).encode('utf8')
+        self.version += 1
+        self.snapshot = GraphSnapshot(
+            body=body,
+            gzip_body=gzip.compress(body, compresslevel=6),
+            etag=digest,
+            path=path,
+            version=self.version,
+            index=index,
+        )
+        self.digest = digest
+        self.stat_key = stat_key
+        return self.snapshot
@@ -1,9 +1,130 @@
+import os
 import json
-
-
-def search_node_item(user_input, lite_graph=None):
-    with open('data/data.json', 'r') as f:
-        data = json.load(f)
+import threading
+from array import array
+
+from app.utils.ngram_index import NgramIndex
+
+
+DEEP = 1  # 默认的扩展深度
+MATCH_CACHE_SIZE = 10000  # 子串匹配结果缓存的上限，防止任意用户输入让缓存无限增长
+
+DATA_PATHS = [
+    'data/data.json',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/data.json'),
+]
+
+
+class GraphIndex:
+    """data.json 的内存索引，只在第一次使用时构建一次
+
+    - name_to_id: 节点名到节点 id 的字典
+    - adj_ptr / adj_edges: CSR 形式的邻接表，节点 i 关联的边为 adj_edges[adj_ptr[i]:adj_ptr[i+1]]
+    - ngram_index: 节点名的字符 n-gram 倒排索引，用于子串查询
+    """
+
+    def __init__(self, data):
+        self.nodes = data['nodes']
+        self.sents = data['sents']
+        self.names = [node['name'] for node in self.nodes]
+        self.name_to_id = {name: idx for idx, name in enumerate(self.names)}
+        self.name_lengths = sorted({len(name) for name in self.names})
+
+        # 边：source / target 统一转成 int
+        self.edges = []
+        for edge in data['links']:
+            edge = dict(edge)
+            edge['source'] = int(edge['source'])
+            edge['target'] = int(edge['target'])
+            self.edges.append(edge)
+
+        # CSR 邻接表（出边和入边都算）
+        degree = [0] * (len(self.nodes) + 1)
+        for edge in self.edges:
+            degree[edge['source'] + 1] += 1
+            if edge['target'] != edge['source']:
+                degree[edge['target'] + 1] += 1
+        for i in range(len(self.nodes)):
+            degree[i + 1] += degree[i]
+        self.adj_ptr = array('l', degree)
+        self.adj_edges = array('l', [0] * degree[-1])
+        fill = list(degree[:-1])
+        for edge_id, edge in enumerate(self.edges):
+            for node_id in {edge['source'], edge['target']}:
+                self.adj_edges[fill[node_id]] = edge_id
+                fill[node_id] += 1
+
+        self.ngram_index = NgramIndex(self.names)
+
+        self._match_cache = {}
+
+    def incident_edges(self, node_id):
+        return self.adj_edges[self.adj_ptr[node_id]:self.adj_ptr[node_id + 1]]
+
+    def match(self, term):
+        """返回名字与 term 存在包含关系（任意方向）的节点 id 集合"""
+        if term in self._match_cache:
+            return self._match_cache[term]
+
+        matched = set()
+
+        # 1. 节点名是 term 的子串：只枚举出现过的名字长度
+        for length in self.name_lengths:
+            if length > len(term):
+                break
+            for i in range(len(term) - length + 1):
+                node_id = self.name_to_id.get(term[i:i + length])
+                if node_id is not None:
+                    matched.add(node_id)
+
+        # 2. term 是节点名的子串
+        matched.update(self.ngram_index.contains(term))
+
+        if len(self._match_cache) >= MATCH_CACHE_SIZE:
+            self._match_cache.clear()
+        self._match_cache[term] = matched
+        return matched
+
+    def search(self, term, deep=DEEP):
+        """从 term 出发扩展 deep 层，返回命中的边 id 列表（按边在 data.json 中的顺序）"""
+        edge_ids = set()
+        terms = [term]
+        for d in range(deep):
+            node_ids = set()
+            for t in terms:
+                node_ids |= self.match(t)
+            for node_id in node_ids:
+                edge_ids.update(self.incident_edges(node_id))
+
+            if not edge_ids:
+                break
+
+            terms = {self.names[n] for e in edge_ids for n in (self.edges[e]['source'], self.edges[e]['target'])}
+
+        return sorted(edge_ids)
+
+
+_graph_index = None
+_graph_index_lock = threading.Lock()
+
+
+def get_graph_index():
+    global _graph_index
+    if _graph_index is None:
+        with _graph_index_lock:
+            if _graph_index is None:
+                for path in DATA_PATHS:
+                    if os.path.exists(path):
+                        with open(path, 'r') as f:
+                            _graph_index = GraphIndex(json.load(f))
+                        break
+                else:
+                    raise FileNotFoundError('data/data.json not found')
+    return _graph_index
+
+
+def search_node_item(user_input, lite_graph=None, deep=DEEP):
+    index = get_graph_index()
 
     if lite_graph is None:
         lite_graph = {
@@ -11,63 +132,60 @@ def search_node_item(user_input, lite_graph=None):
             'links': [],
             'sents': []
         }
+    lite_graph.setdefault('sents', [])
 
     # 利用thefuzz库来选取最相近的节点
     # node_names = [node['name'] for node in data['nodes']]
     # user_input = process.extractOne(user_input, node_names)[0]
 
-    DEEP = 1
-
-    # search node
-    search_nodes = [user_input]
-    for d in range(DEEP):
-        for serch_node in search_nodes:
-            for edge in data['links']:
-                source = data['nodes'][int(edge['source'])]
-                target = data['nodes'][int(edge['target'])]
-                if source['name'] in serch_node or serch_node in source['name'] or target['name'] in serch_node or serch_node in target['name']:
-                # if source['name'] == serch_node or target['name'] == serch_node:
-                    sent = data['sents'][edge['sent']]
-                    if sent not in lite_graph['sents']:
-                        edge['sent'] = len(lite_graph['sents'])
-                        lite_graph['sents'].append(sent)
-                    else:
-                        edge['sent'] = lite_graph['sents'].index(sent)
-
-                    if source not in lite_graph['nodes']:
-                        source['id'] = len(lite_graph['nodes'])
-                        lite_graph['nodes'].append(source)
-                    else:
-                        source['id'] = lite_graph['nodes'].index(source)
-
-                    if target not in lite_graph['nodes']:
-                        target['id'] = len(lite_graph['nodes'])
-                        lite_graph['nodes'].append(target)
-                    else:
-                        target['id'] = lite_graph['nodes'].index(target)
-
-                    edge['source'] = source['id']
-                    edge['target'] = target['id']
-                    lite_graph['links'].append(edge)
-
-        if len(lite_graph['nodes']) == 0:
-            break
-
-        search_nodes = [node['name'] for node in lite_graph['nodes']]
+    # 已有节点、句子、连线的位置表，保证每次调用只需线性时间去重
+    node_pos = {node['name']: i for i, node in enumerate(lite_graph['nodes'])}
+    sent_pos = {sent: i for i, sent in enumerate(lite_graph['sents'])}
+    link_keys = {(link['source'], link['target'], link.get('name')) for link in lite_graph['links']}
+
+    def add_node(node_id):
+        node = index.nodes[node_id]
+        if node['name'] not in node_pos:
+            node = dict(node)
+            node['id'] = len(lite_graph['nodes'])
+            node_pos[node['name']] = node['id']
+            lite_graph['nodes'].append(node)
+        return node_pos[node['name']]
+
+    for edge_id in index.search(user_input, deep):
+        edge = dict(index.edges[edge_id])
+
+        sent = index.sents[edge['sent']]
+        if sent not in sent_pos:
+            sent_pos[sent] = len(lite_graph['sents'])
+            lite_graph['sents'].append(sent)
+        edge['sent'] = sent_pos[sent]
+
+        edge['source'] = add_node(edge['source'])
+        edge['target'] = add_node(edge['target'])
+
+        key = (edge['source'], edge['target'], edge.get('name'))
+        if key not in link_keys:
+            link_keys.add(key)
+            lite_graph['links'].append(edge)
 
     return lite_graph
 
 
 def convert_graph_to_triples(graph, entity=None):
+    def node_name(ref):
+        # 连线端点可能是节点下标（data.json）也可能直接是节点名（CCUS 子图）
+        return graph['nodes'][ref]['name'] if isinstance(ref, int) else ref
+
     triples = []
+    seen = set()
     for link in graph['links']:
-        source = graph['nodes'][link['source']]
-        target = graph['nodes'][link['target']]
+        triple = (node_name(link['source']), link["name"], node_name(link['target']))
 
-        if entity is not None:
-            if entity in source['name'] or entity in target['name']:
-                triples.append((source['name'], link["name"], target['name']))
-        else:
-            triples.append((source['name'], link["name"], target['name']))
+        if entity is not None and entity not in triple[0] and entity not in triple[2]:
+            continue
+        if triple not in seen:
+            seen.add(triple)
+            triples.append(triple)
 
-    return triples
\ No newline at end of file
+    return triples
@@ -0,0 +1,127 @@
+"""
+推理进程和 Web worker 之间的本地 IPC
+
+多进程部署（server/serve.py）时模型只在推理进程里加载一次，Web worker 通过 Unix socket 把生成请求发过去，
+每个请求一个连接：
+
+- {"op": "chat", "query", "history"}：先回复模型是否就绪，就绪时逐个 token 回复当前的 response，
+  最后回复 None；出错时回复 {"error": ...}
+- {"op": "status"}：回复模型加载状态、前缀缓存和生成调度器的统计
+
+推理进程里每个连接一个线程，并发的请求由模型的连续批处理调度器合并解码。
+"""
+import os
+import threading
+from multiprocessing.connection import Listener, Client
+
+
+class InferenceClient(object):
+
+    def __init__(self, address, authkey=None) -> None:
+        self.address = address
+        self.authkey = authkey
+
+    def connect(self):
+        return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+
+    def stream_chat(self, query, history):
+        """和 model.stream_chat 一样返回 (response, history) 的生成器；推理进程不可达或模型未就绪时返回 None"""
+        try:
+            conn = self.connect()
+            conn.send({"op": "chat", "query": query, "history": history})
+            ready = conn.recv()
+        except (OSError, EOFError) as e:
+            print(f"⚠️ 推理进程不可用: {e}")
+            return None
+
+        if not ready:
+            conn.close()
+            return None
+        return self.responses(conn, query, history)
+
+    def responses(self, conn, query, history):
+        try:
+            while True:
+                message = conn.recv()
+                if message is None:
+                    return
+                if isinstance(message, dict):
+                    raise RuntimeError(message["error"])
+                # 只传输回答文本，history 在本地拼出来，和 stream_chat 返回的一致
+                yield message, history + [(query, message)]
+        finally:
+            # 客户端断开时关闭连接，推理进程发送失败后会取消这个请求
+            conn.close()
+
+    def status(self):
+        try:
+            with self.connect() as conn:
+                conn.send({"op": "status"})
+                return conn.recv()
+        except (OSError, EOFError) as e:
+            return {
+                "model": {"ready": False, "state": "unreachable", "error": str(e)},
+                "prefix_cache": None,
+                "generation": None,
+            }
+
+
+def handle_connection(conn):
+    from app.utils import chat_glm
+
+    with conn:
+        try:
+            request = conn.recv()
+        except (OSError, EOFError):
+            return
+
+        if request.get("op") == "status":
+            conn.send({
+                "model": chat_glm.model_status(),
+                "prefix_cache": chat_glm.prefix_cache_stats(),
+                "generation": chat_glm.generation_stats(),
+            })
+            return
+
+        ready = chat_glm.model_ready()
+        conn.send(ready)
+        if not ready:
+            return
+
+        # Web worker 里没有系统提示的历史，空历史时用推理进程里预热得到的 init_history
+        responses = chat_glm.generate(request["query"], request["history"] or chat_glm.init_history)
+        try:
+            for response, _ in responses:
+                conn.send(response)
+            conn.send(None)
+        except (OSError, EOFError):
+            # Web worker 断开了，关闭生成器让调度器在下一步丢弃这个序列
+            pass
+        except Exception as e:
+            print(f"❌ 生成失败: {e}")
+            conn.send({"error": str(e)})
+        finally:
+            responses.close()
+
+
+def serve_inference(address, authkey=None):
+    """推理进程的主循环：后台加载模型，同时接受 Web worker 的连接"""
+    from app.utils import chat_glm
+
+    # 这个进程自己持有模型，不再把请求转发出去
+    chat_glm.use_inference_server(None)
+    chat_glm.start_model_async()
+
+    if os.path.exists(address):
+        os.unlink(address)
+
+    print(f"🧠 推理进程 {os.getpid()} 监听 {address}")
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # 认证失败等单个连接的问题不影响其他连接
+                print(f"⚠️ 推理连接失败: {e}")
+                continue
+            threading.Thread(target=handle_connection, args=(conn,), daemon=True).start()
@@ -0,0 +1,14 @@
+"""
+服务端访问知识图谱二进制格式的入口
+
+格式的编译和读取实现在仓库根目录的 modules/kg_format.py 中，流水线和服务端共用同一份代码。
+"""
+
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from modules.kg_format import KnowledgeGraphFile, compile_kg, load_kg  # noqa: E402
@@ -0,0 +1,148 @@
+"""
+ChatGLM 模型的后台加载
+
+- 服务先启动，模型在后台线程里加载；加载完成之前对话接口只返回知识图谱的检索结果
+- 权重优先从 safetensors 分片加载：分片通过 mmap 映射，逐个张量拷到目标设备上，
+  不需要先把整个 checkpoint 读进内存、随机初始化一遍模型再复制过去
+- 每个阶段（tokenizer、权重、预热……）的耗时记录在 StartupTimeline 里，由 /api/ready 返回
+"""
+import os
+import json
+import time
+import threading
+import importlib.util
+from contextlib import contextmanager
+
+import torch
+
+SAFETENSORS_INDEX = "model.safetensors.index.json"
+PYTORCH_INDEX = "pytorch_model.bin.index.json"
+
+
+class StartupTimeline(object):
+    """记录模型加载各个阶段的耗时，加载线程写入，请求线程读取"""
+
+    def __init__(self) -> None:
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.stages = []
+        self.state = "pending"  # pending -> loading -> ready / failed
+        self.error = None
+        self.device = None
+        self.ready = threading.Event()
+
+    def begin(self):
+        self.started = time.monotonic()
+        self.state = "loading"
+
+    @contextmanager
+    def stage(self, name):
+        print(f"⏳ {name}...")
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - start
+            self.stages.append({
+                "stage": name,
+                "start": round(start - self.created, 3),
+                "seconds": round(seconds, 3),
+            })
+            print(f"⏱️ {name}: {seconds:.2f}s")
+
+    def mark_ready(self, device):
+        self.finished = time.monotonic()
+        self.device = device
+        self.state = "ready"
+        self.ready.set()
+        print(f"✅ 模型就绪，距进程启动 {self.finished - self.created:.1f}s")
+
+    def mark_failed(self, error):
+        self.finished = time.monotonic()
+        self.state = "failed"
+        self.error = str(error)
+
+    def to_dict(self):
+        now = self.finished or time.monotonic()
+        return {
+            "ready": self.ready.is_set(),
+            "state": self.state,
+            "device": self.device,
+            "error": self.error,
+            "elapsed": round(now - self.started, 3) if self.started is not None else 0.0,
+            "stages": list(self.stages),
+        }
+
+
+def has_safetensors(model_path):
+    return os.path.isfile(os.path.join(model_path, SAFETENSORS_INDEX)) or \
+        os.path.isfile(os.path.join(model_path, "model.safetensors"))
+
+
+def load_kwargs(model_path, device):
+    """from_pretrained 的参数：fp16 直接加载，有 safetensors 分片时走 mmap，装了 accelerate 时跳过 CPU 上的中转"""
+    kwargs = {"trust_remote_code": True, "torch_dtype": torch.float16}
+    if os.path.isdir(model_path) and has_safetensors(model_path):
+        kwargs["use_safetensors"] = True
+    if importlib.util.find_spec("accelerate") is not None:
+        kwargs["low_cpu_mem_usage"] = True
+        if device == "cuda":
+            # 张量从 mmap 的分片直接拷到显卡上，不在内存里留一份完整的 fp16 权重
+            kwargs["device_map"] = {"": 0}
+    return kwargs
+
+
+def convert_to_safetensors(model_path, output_path=None):
+    """把 pytorch_model-*.bin 分片逐个转换为 safetensors 分片（只需要运行一次）
+
+    转换后 from_pretrained 会优先加载 safetensors，.bin 文件可以删掉节省磁盘。
+    """
+    from safetensors.torch import save_file
+
+    output_path = output_path or model_path
+    os.makedirs(output_path, exist_ok=True)
+
+    index_file = os.path.join(model_path, PYTORCH_INDEX)
+    if os.path.isfile(index_file):
+        with open(index_file, encoding="utf-8") as f:
+            index = json.load(f)
+        shards = sorted(set(index["weight_map"].values()))
+    else:
+        index = {"metadata": {}}
+        shards = ["pytorch_model.bin"]
+
+    weight_map = {}
+    total_size = 0
+    for i, shard in enumerate(shards, 1):
+        start = time.time()
+        state_dict = torch.load(os.path.join(model_path, shard), map_location="cpu")
+        target = f"model-{i:05d}-of-{len(shards):05d}.safetensors" if len(shards) > 1 else "model.safetensors"
+        # safetensors 不接受非连续或共享存储的张量
+        state_dict = {name: tensor.contiguous().clone() for name, tensor in state_dict.items()}
+        save_file(state_dict, os.path.join(output_path, target), metadata={"format": "pt"})
+
+        for name, tensor in state_dict.items():
+            weight_map[name] = target
+            total_size += tensor.numel() * tensor.element_size()
+        print(f"已转换 {shard} -> {target} ({len(state_dict)} 个张量, {time.time() - start:.1f}s)")
+        del state_dict
+
+    if len(shards) > 1:
+        metadata = dict(index.get("metadata", {}), total_size=total_size)
+        with open(os.path.join(output_path, SAFETENSORS_INDEX), "w", encoding="utf-8") as f:
+            json.dump({"metadata": metadata, "weight_map": weight_map}, f, indent=2, sort_keys=True)
+
+    print(f"✅ 转换完成: {output_path}")
+
+
+if __name__ == "__main__":
+    # 在 server 目录下运行: python -m app.utils.model_loader ./models/chatglm-6b
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path", help="包含 pytorch_model*.bin 的模型目录")
+    parser.add_argument("--output", default=None, help="safetensors 分片的输出目录，默认写回模型目录")
+    args = parser.parse_args()
+
+    convert_to_safetensors(args.model_path, args.output)
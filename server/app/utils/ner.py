@@ -1,17 +1,178 @@
-
 import os
-from paddlenlp import Taskflow
+import sys
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from app.utils.query_cache import QueryCache
+
+# 和 chat_glm.NER_ETYPES 一致，ONNX 后端的 UIE schema
+DEFAULT_ETYPES = ["技术", "项目", "机构", "地理", "政策", "标准", "经济", "设备", "指标", "环境"]
+
+UIE_DEPLOY_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../modules/Uie-finetune/deploy/python'))
+
+
+class OnnxNer:
+    """用 modules/Uie-finetune/deploy/python 里的 UIEPredictor（ONNX Runtime，CPU）做实体识别
+
+    输出转换成和 Taskflow 一样的 [(实体, 类型), ...]。需要先用 UIE 的 export_model.py 导出静态图模型。
+    """
+
+    def __init__(self, model_path_prefix, schema=None, batch_size=16, max_seq_len=512, position_prob=0.5):
+        if UIE_DEPLOY_DIR not in sys.path:
+            sys.path.append(UIE_DEPLOY_DIR)
+        from argparse import Namespace
+        from uie_predictor import UIEPredictor
+
+        args = Namespace(
+            model_path_prefix=model_path_prefix,
+            schema=schema or DEFAULT_ETYPES,
+            position_prob=position_prob,
+            max_seq_len=max_seq_len,
+            batch_size=batch_size,
+            multilingual=False,
+            device="cpu",
+            use_fp16=False,
+            device_id=0,
+        )
+        self.predictor = UIEPredictor(args)
+
+    def __call__(self, texts):
+        results = []
+        for output in self.predictor.predict(texts):
+            entities = []
+            for etype, spans in output.items():
+                for span in spans:
+                    entities.append((span["text"], etype))
+            results.append(entities)
+        return results
+
 
 class Ner:
-    def __init__(self):
+    def __init__(self, backend=None, cache_size=4096, max_batch_size=16, max_wait=0.005):
+        """
+        Args:
+            backend: "taskflow"（默认）或 "onnx"，默认读取环境变量 NER_BACKEND
+            cache_size: 按文本缓存识别结果的条目数
+            max_batch_size: 一次送进模型的最多文本数
+            max_wait: 收到第一个请求后最多再等多久（秒）凑一个批次
+        """
         # 使用绝对路径确保模型可以正确加载
         current_dir = os.path.dirname(os.path.abspath(__file__))
         server_dir = os.path.dirname(os.path.dirname(current_dir))
         model_path = os.path.join(server_dir, "weights", "model_41_100")
-        self.model = Taskflow("ner", task_path=model_path)
+
+        self.backend = backend or os.environ.get("NER_BACKEND", "taskflow")
+        if self.backend == "onnx":
+            prefix = os.environ.get("NER_ONNX_MODEL", os.path.join(model_path, "static", "inference"))
+            self.model = OnnxNer(prefix, batch_size=max_batch_size)
+        else:
+            from paddlenlp import Taskflow
+            self.model = Taskflow("ner", task_path=model_path, batch_size=max_batch_size)
+
+        self.cache = QueryCache(cache_size, ttl=None)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()  # (text, Future)
+        self.inflight = {}  # 已经提交、还没出结果的文本 -> Future，同一个文本只算一次
+        self.inflight_lock = threading.Lock()
+        self.worker = None
+        self.worker_pid = None
+        self.worker_lock = threading.Lock()
+        self.batches = 0
+        self.batched_texts = 0
 
     def predict(self, text):
-        return self.model(text)
+        return self.predict_many([text])[0]
+
+    def predict_many(self, texts):
+        """批量识别，返回和 texts 对齐的 [(实体, 类型), ...] 列表
+
+        缓存里没有的文本交给批处理线程，和其他线程同时提交的文本合并成一个批次送进模型。
+        """
+        results = [self.cache.get(text) for text in texts]
+        pending = {}
+        for text, result in zip(texts, results):
+            if result is None and text not in pending:
+                pending[text] = self.submit(text)
+
+        return [result if result is not None else pending[text].result()
+                for text, result in zip(texts, results)]
+
+    def submit(self, text):
+        self.ensure_worker()
+        with self.inflight_lock:
+            future = self.inflight.get(text)
+            if future is not None:
+                return future
+            future = Future()
+            # predict_many 查缓存之后这个文本可能刚算完：结果已经写进缓存、移出了 inflight
+            result = self.cache.peek(text)
+            if result is not None:
+                future.set_result(result)
+                return future
+            self.inflight[text] = future
+        self.requests.put((text, future))
+        return future
+
+    def ensure_worker(self):
+        # 多进程部署时 Ner 在主进程里创建、fork 之后才使用，批处理线程要在每个进程里各自启动
+        if self.worker_pid == os.getpid():
+            return
+        with self.worker_lock:
+            if self.worker_pid != os.getpid():
+                self.worker = threading.Thread(target=self.loop, name="ner-batcher", daemon=True)
+                self.worker.start()
+                self.worker_pid = os.getpid()
+
+    def loop(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            outputs = self.run_model(texts)
+            if len(outputs) != len(texts):
+                raise RuntimeError(f"NER 模型返回了 {len(outputs)} 条结果，输入为 {len(texts)} 条")
+        except Exception as e:
+            with self.inflight_lock:
+                for text, _ in batch:
+                    del self.inflight[text]
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        # 先写缓存再移出 inflight：同一个文本的并发请求总能在其中一处找到结果，不会再算一次
+        for text, result in zip(texts, outputs):
+            self.cache.put(text, result)
+        with self.inflight_lock:
+            for text, _ in batch:
+                del self.inflight[text]
+
+        self.batches += 1
+        self.batched_texts += len(texts)
+        for (_, future), result in zip(batch, outputs):
+            future.set_result(result)
+
+    def run_model(self, texts):
+        if self.backend == "onnx":
+            return self.model(texts)
+        # Taskflow 输入单个字符串时只返回这一条的结果
+        if len(texts) == 1:
+            return [self.model(texts[0])]
+        return self.model(texts)
 
     def get_entities(self, text, etypes=None):
         '''获取句子中指定类型的实体
@@ -25,9 +186,75 @@ class Ner:
         if etypes is None:
             etypes = [None]
 
+        # 模型对每个句子只运行一次，再按类型筛选
+        result = self.predict(text)
         entities = []
         for etype in etypes:
-            for ent, et in self.predict(text):
+            for ent, et in result:
                 if not etype or etype in et:
                     entities.append(ent)
-        return entities
\ No newline at end of file
+        return entities
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "cache": self.cache.stats(),
+            "batches": self.batches,
+            "avg_batch_size": self.batched_texts / self.batches if self.batches else 0.0,
+        }
+
+
+def benchmark(texts, etypes=DEFAULT_ETYPES, backend=None):
+    """逐类型调用模型（原来的 get_entities）、每句一次、并发微批处理和缓存命中的耗时对比"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    ner = Ner(backend=backend)
+
+    start = time.perf_counter()
+    for text in texts:
+        for _ in etypes:
+            ner.run_model([text])
+    per_type = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts:
+        ner.run_model([text])
+    once = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=ner.max_batch_size) as pool:
+        list(pool.map(lambda text: ner.get_entities(text, etypes), texts))
+    batched = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts:
+        ner.get_entities(text, etypes)
+    cached = time.perf_counter() - start
+
+    n = len(texts)
+    print(f"逐类型调用: {per_type / n * 1000:.1f}ms/句")
+    print(f"每句一次:   {once / n * 1000:.1f}ms/句")
+    print(f"并发微批:   {batched / n * 1000:.1f}ms/句")
+    print(f"缓存命中:   {cached / n * 1000:.3f}ms/句")
+    print(ner.stats())
+
+
+if __name__ == "__main__":
+    # 在 server 目录下运行: python -m app.utils.ner [--backend onnx]
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default=None, choices=["taskflow", "onnx"])
+    args = parser.parse_args()
+
+    questions = [
+        "CCUS技术在中国的发展现状如何？",
+        "鄂尔多斯的二氧化碳封存项目由哪家机构负责？",
+        "燃烧后捕集技术的能耗指标是多少？",
+        "碳交易政策对CCUS项目的经济性有什么影响？",
+        "胜利油田的CO2驱油项目采用了哪些设备？",
+        "国际能源署对碳捕集利用与封存的标准有哪些建议？",
+        "海上封存对海洋环境有什么风险？",
+        "化学吸收法和物理吸附法的区别是什么？",
+    ]
+    benchmark(questions * 4, backend=args.backend)
@@ -0,0 +1,28 @@
+"""
+字符 n-gram 倒排索引
+用于在大量名字中快速找出包含某个子串的名字，避免逐个做 `in` 判断
+"""
+
+from typing import Iterable, List
+
+
+class NgramIndex:
+    def __init__(self, names: Iterable[str]):
+        self.names = list(names)
+        self.postings = {}  # unigram / bigram -> 名字下标列表（升序）
+        for idx, name in enumerate(self.names):
+            grams = set(name)
+            grams.update(name[i:i + 2] for i in range(len(name) - 1))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(idx)
+
+    def contains(self, term: str) -> List[int]:
+        """返回包含 term 的名字下标（升序）"""
+        if not term:
+            return list(range(len(self.names)))
+
+        grams = [term] if len(term) == 1 else [term[i:i + 2] for i in range(len(term) - 1)]
+        candidates = min((self.postings.get(gram, []) for gram in grams), key=len)
+        if len(term) <= 2:
+            return list(candidates)
+        return [idx for idx in candidates if term in self.names[idx]]
@@ -0,0 +1,67 @@
+"""
+带容量上限和过期时间的 LRU 缓存
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    def __init__(self, max_size=1024, ttl=3600):
+        """
+        Args:
+            max_size: 最多缓存的条目数，超过后淘汰最久未使用的
+            ttl: 条目的存活秒数，None 表示永不过期
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.items = OrderedDict()  # key -> (expire_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and (item[0] is None or item[0] > time.monotonic()):
+                self.items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self.items[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """和 get 一样查找，但不计入命中率统计"""
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and (item[0] is None or item[0] > time.monotonic()):
+                return item[1]
+            return default
+
+    def put(self, key, value):
+        expire_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.items[key] = (expire_at, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,18 +1,108 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+
 import wikipediaapi
 
 from opencc import OpenCC
 
 cc = OpenCC('s2t')
 
+# 缓存里保存的页面，只保留回答需要的字段
+WikiPage = namedtuple('WikiPage', ['title', 'summary'])
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/wiki_cache.sqlite3')
+
+
+class WikiCache(object):
+    """维基百科查询结果的 SQLite 持久化缓存，不存在的页面也会缓存（负缓存）"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=30 * 24 * 3600, negative_ttl=24 * 3600) -> None:
+        """
+        Args:
+            ttl: 存在的页面的有效期（秒）
+            negative_ttl: 不存在的页面的有效期（秒），通常短一些，方便新建的词条被发现
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self.pid = None
+        self._conn = None
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS wiki ("
+            "query TEXT PRIMARY KEY, found INTEGER NOT NULL, title TEXT, summary TEXT, fetched_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        # SQLite 连接不能跨 fork 使用，多进程部署时每个 worker 进程各自打开一个连接
+        if self.pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.pid = os.getpid()
+        return self._conn
+
+    def get(self, query, ignore_ttl=False):
+        """返回 (是否命中, WikiPage 或 None)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT found, title, summary, fetched_at FROM wiki WHERE query = ?", (query,)
+            ).fetchone()
+
+        if row is None:
+            return False, None
+
+        found, title, summary, fetched_at = row
+        ttl = self.ttl if found else self.negative_ttl
+        if not ignore_ttl and time.time() - fetched_at > ttl:
+            return False, None
+
+        return True, WikiPage(title, summary) if found else None
+
+    def put(self, query, page):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO wiki (query, found, title, summary, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (query, page is not None, page.title if page else None, page.summary if page else None, time.time()),
+            )
+            self.conn.commit()
+
+
 class WikiSearcher(object):
 
-    def __init__(self) -> None:
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, offline=None, timeout=10.0) -> None:
+        """
+        Args:
+            cache_path: 缓存文件路径，为 None 时不使用缓存
+            offline: 离线模式只读缓存、从不访问网络，默认读取环境变量 WIKI_OFFLINE
+            timeout: 每次 HTTP 请求的超时（秒）
+        """
         self.wiki = wikipediaapi.Wikipedia(
             user_agent='CCUS-CT-KnowledgeGraph/1.0 (https://github.com/huh7i5/ccus-ct)',
-            language='zh'
+            language='zh',
+            timeout=timeout
         )
+        self.cache = WikiCache(cache_path) if cache_path else None
+        if offline is None:
+            offline = os.environ.get('WIKI_OFFLINE', '') not in ('', '0', 'false')
+        self.offline = offline
+
+    def search(self, query, refresh=False):
+        """返回 WikiPage，找不到时返回 None
 
-    def search(self, query):
+        Args:
+            refresh: 忽略缓存，强制重新请求
+        """
+        if self.cache is not None and not refresh:
+            hit, page = self.cache.get(query, ignore_ttl=self.offline)
+            if hit or self.offline:
+                return page
+
+        if self.offline:
+            return None
 
         result = None
 
@@ -23,9 +113,46 @@ class WikiSearcher(object):
                 page = self.wiki.page(cc.convert(query))
 
             if page.exists():
-                result = page
+                # summary 是懒加载的，在这里取出来一起缓存
+                result = WikiPage(page.title, page.summary)
 
         except Exception as e:
+            # 网络错误不写缓存，下次再试
             print(e)
+            return None
+
+        if self.cache is not None:
+            self.cache.put(query, result)
+
+        return result
+
+
+def warm_up(top_n=200, refresh=False):
+    """预先查询知识图谱中出现次数最多的 top_n 个实体，填充缓存"""
+    import heapq
+    from app.utils.ccus_kg_search import CCUSKnowledgeGraphSearcher
+
+    kg_searcher = CCUSKnowledgeGraphSearcher()
+    entities = heapq.nlargest(top_n, kg_searcher.entity_index, key=lambda e: len(kg_searcher.entity_index[e]))
+
+    searcher = WikiSearcher(offline=False)
+    found = 0
+    for i, entity in enumerate(entities, 1):
+        if searcher.search(entity, refresh=refresh) is not None:
+            found += 1
+        if i % 20 == 0:
+            print(f"已预热 {i}/{len(entities)} 个实体，命中 {found} 个")
+
+    print(f"✅ 预热完成: {len(entities)} 个实体，{found} 个有维基百科词条")
+
+
+if __name__ == "__main__":
+    # 在 server 目录下运行: python -m app.utils.query_wiki --top 200
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=200, help="预热知识图谱中出现次数最多的前 N 个实体")
+    parser.add_argument("--refresh", action="store_true", help="忽略已有缓存，重新请求")
+    args = parser.parse_args()
 
-        return result
\ No newline at end of file
+    warm_up(args.top, args.refresh)
@@ -0,0 +1,62 @@
+"""
+检索阶段的并发扇出
+各个检索源（知识图谱、NER、图片、维基百科）同时提交到线程池，
+每个源有自己的超时，同时整体受一个延迟预算约束，超时的源直接用默认值顶替。
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+retrieval_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='retrieval')
+# 维基百科要访问外网，单独用一个小线程池：外网慢的时候占满的只是这几个线程，
+# 知识图谱和 NER 任务不会排在这些请求后面
+wiki_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='wiki')
+
+
+class RetrievalFanOut:
+    def __init__(self, budget, executor=None):
+        """
+        Args:
+            budget: 整个检索阶段的延迟预算（秒），从创建时开始计算
+            executor: 使用的线程池，默认为进程内共享的 retrieval_pool
+        """
+        self.executor = executor or retrieval_pool
+        self.started = time.monotonic()
+        self.deadline = self.started + budget
+        self.tasks = {}  # name -> (future, 该源自己的截止时间)
+
+    def submit(self, name, fn, *args, timeout=None, executor=None, **kwargs):
+        """提交一个检索任务，同名任务只会提交一次
+
+        Args:
+            executor: 这个任务使用的线程池，默认为 self.executor
+        """
+        if name not in self.tasks:
+            source_deadline = self.deadline if timeout is None else min(self.deadline, time.monotonic() + timeout)
+            future = (executor or self.executor).submit(fn, *args, **kwargs)
+            self.tasks[name] = (future, source_deadline)
+        return self.tasks[name][0]
+
+    def result(self, name, default=None):
+        """等待任务完成并返回结果；超时、出错或未提交时返回 default"""
+        if name not in self.tasks:
+            return default
+
+        future, source_deadline = self.tasks[name]
+        try:
+            return future.result(timeout=max(0.0, source_deadline - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            print(f"⚠️ 检索源 {name} 超时，已跳过 ({self.elapsed():.2f}s)")
+        except Exception as e:
+            print(f"⚠️ 检索源 {name} 失败: {e}")
+        return default
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def cancel_pending(self):
+        """取消还没有开始执行的任务；已经在执行的任务会在后台跑完，但结果被丢弃"""
+        for future, _ in self.tasks.values():
+            future.cancel()
@@ -2,7 +2,7 @@ import os
 import json
 from flask import Response, request, Blueprint, jsonify
 
-from app.utils.chat_glm import stream_predict
+from app.utils.chat_glm import stream_predict, kg_statistics, ner_stats, prefix_cache_stats, generation_stats, model_status
 
 mod = Blueprint('chat', __name__, url_prefix='/api')
 
@@ -12,18 +12,38 @@ def chat_get():
     return "CCUS Knowledge Graph Chat API Ready!"
 
 
+@mod.route('/ready', methods=['GET'])
+def ready():
+    # 模型是否加载完成，以及 tokenizer、权重、预热等各阶段的耗时；未就绪时返回 503
+    status = model_status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+@mod.route('/stats', methods=['GET'])
+def stats():
+    # 知识图谱统计、查询缓存、实体识别缓存和前缀KV缓存的命中情况，以及生成调度器的吞吐和排队深度
+    statistics = kg_statistics()
+    statistics["ner"] = ner_stats()
+    statistics["prefix_cache"] = prefix_cache_stats()
+    statistics["generation"] = generation_stats()
+    return jsonify(statistics)
+
+
 @mod.route('/chat', methods=['POST'])
 def chat():
     try:
         request_data = json.loads(request.data)
         prompt = request_data['prompt']
         history = request_data.get('history', [])
+        # "delta" 只发送增量文本，"full" 为每个 token 返回完整结果的旧协议
+        stream_mode = request_data.get('stream', 'full')
 
         # 使用流式预测返回响应
         def generate():
-            for response_chunk in stream_predict(prompt, history):
+            for response_chunk in stream_predict(prompt, history, stream_mode):
                 yield response_chunk
 
-        return Response(generate(), mimetype='application/json')
+        mimetype = 'application/x-ndjson' if stream_mode == 'delta' else 'application/json'
+        return Response(generate(), mimetype=mimetype)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
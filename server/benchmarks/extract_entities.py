@@ -0,0 +1,92 @@
+"""
+对比查询实体抽取的两种实现
+
+    legacy: 原来的 jieba 分词 + 子串枚举，在未剪枝的实体索引上查找，每次命中都现场做质量过滤
+    aho-corasick: CCUSKnowledgeGraphSearcher.extract_entities
+
+searcher 的 entity_index 建索引时已经删掉了无效实体，这里按原来的方式从图谱重新构建一份完整的实体索引，
+legacy 测的才是原来的开销。
+
+在 server 目录下运行: python -m benchmarks.extract_entities
+"""
+
+import time
+
+import jieba
+
+from app.utils.ccus_kg_search import CCUSKnowledgeGraphSearcher
+
+CHAT_QUERIES = [
+    "CCUS是什么",
+    "二氧化碳封存技术有哪些",
+    "鄂尔多斯盆地的CO2地质封存项目进展如何",
+    "吉林油田CO2驱油与埋存示范工程的规模是多少",
+    "碳捕集技术在燃煤电厂中的应用",
+    "中石油在CCUS方面开展了哪些合作",
+    "二氧化碳捕集、利用与封存的成本是多少",
+    "胜利油田燃煤电厂烟气二氧化碳捕集项目位于哪里",
+    "CO2-EOR技术的原理",
+    "我国二氧化碳地质储存潜力评价的主要结论是什么",
+    "化学吸收法捕集二氧化碳的能耗",
+    "咸水层封存与枯竭油气藏封存有什么区别",
+]
+
+
+def build_legacy_index(searcher):
+    """原来的实体索引：图谱里出现过的所有实体（不做质量过滤）-> 记录下标"""
+    kg = searcher.kg_data
+    strings = [kg.string(sid) for sid in range(kg.num_strings)]
+    entity_index = {}
+    for idx in range(len(kg)):
+        for em1, em2, _ in kg.triples(idx):
+            for sid in (em1, em2):
+                if sid >= 0 and strings[sid]:
+                    entity_index.setdefault(strings[sid], []).append(idx)
+    return entity_index
+
+
+def make_legacy_extract_entities(searcher, entity_index):
+    is_valid = searcher._is_valid_entity
+
+    def legacy_extract_entities(text):
+        entities = []
+        for word in jieba.lcut(text):
+            if len(word) > 1 and word in entity_index and is_valid(word):
+                entities.append(word)
+        if text in entity_index and is_valid(text):
+            entities.append(text)
+        for i in range(len(text)):
+            for j in range(i+2, min(i+10, len(text)+1)):
+                substring = text[i:j]
+                if substring in entity_index and is_valid(substring):
+                    entities.append(substring)
+        return list(set(entities))
+
+    return legacy_extract_entities
+
+
+def benchmark(searcher, queries, rounds=20):
+    entity_index = build_legacy_index(searcher)
+    print(f"未剪枝的实体索引: {len(entity_index)} 个实体, 剪枝后: {len(searcher.entity_index)} 个")
+    legacy_extract_entities = make_legacy_extract_entities(searcher, entity_index)
+
+    jieba.lcut(queries[0])  # 预热 jieba 词典
+
+    # 原来的实现只枚举长度 2-9 的子串，找到的实体应当都在自动机的结果里
+    for query in queries:
+        assert set(legacy_extract_entities(query)) <= set(searcher.extract_entities(query)), query
+
+    for name, func in [("legacy", legacy_extract_entities), ("aho-corasick", searcher.extract_entities)]:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for query in queries:
+                func(query)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>14}: {elapsed / (rounds * len(queries)) * 1e6:.1f} us/query")
+
+
+if __name__ == "__main__":
+    kg_searcher = CCUSKnowledgeGraphSearcher()
+    for query in CHAT_QUERIES[:3]:
+        print(query, "->", kg_searcher.match_entities(query, "longest"))
+    benchmark(kg_searcher, CHAT_QUERIES)
@@ -4,19 +4,18 @@ from app import apps
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
 # 启用ChatGLM模型
-from app.utils.chat_glm import start_model
+from app.utils.chat_glm import preload, start_model_async
 
 
 if __name__ == '__main__':
     print("🚀 启动CCUS知识图谱+大模型服务器...")
 
-    # 启动ChatGLM模型
-    model_loaded = start_model()
+    # 知识图谱、NER等检索工具在开放端口之前加载好
+    preload()
 
-    if model_loaded:
-        print("✅ ChatGLM-6B模型加载成功，启动完整服务")
-    else:
-        print("⚠️ ChatGLM-6B模型加载失败，启动基础服务")
+    # 在后台加载ChatGLM模型，加载完成之前只提供知识图谱问答，进度见 /api/ready
+    start_model_async()
+    print("⏳ ChatGLM-6B模型在后台加载，知识图谱和图谱接口已可用")
 
     apps.secret_key = os.urandom(24)
     print("🌐 服务器启动在 http://0.0.0.0:8000")
@@ -0,0 +1,131 @@
+"""
+生产环境的多进程入口（开发调试仍然用单进程的 python main.py）
+
+    python serve.py --workers 4 --port 8000
+
+- 主进程导入 app，预加载知识图谱、检索器和 NER，然后 fork 出一个推理进程和 N 个 Web worker
+- Web worker 共享主进程 bind 好的监听 socket，预加载的只读数据在 fork 之后按写时复制共享，
+  知识图谱本身是 mmap 的 .kgb 文件，所有进程共享同一份页缓存
+- 模型只在推理进程里加载，Web worker 通过 Unix socket 请求生成（见 app/utils/inference.py），
+  图谱和检索接口随 worker 数扩展到多个核上，生成吞吐由推理进程里的连续批处理决定
+- 主进程只负责监控，子进程退出后重新拉起
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import traceback
+
+# 只有推理进程使用显卡：主进程和 Web worker 隐藏显卡，NER 在 CPU 上运行，
+# 主进程也就不会在 fork 之前初始化 CUDA（CUDA 上下文在 fork 出的子进程里不可用）
+CUDA_DEVICES = os.environ.get("CUDA_VISIBLE_DEVICES", "0")
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+from app import apps  # noqa: E402
+from app.utils import chat_glm  # noqa: E402
+from app.utils.graph_utils import get_graph_index  # noqa: E402
+
+
+def fork(target, *args):
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # 子进程不继承主进程的退出处理
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        target(*args)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def run_inference(listen_socket, address, authkey):
+    from app.utils.inference import serve_inference
+
+    listen_socket.close()
+    os.environ["CUDA_VISIBLE_DEVICES"] = CUDA_DEVICES
+    serve_inference(address, authkey)
+
+
+def run_worker(listen_socket, host, port):
+    from werkzeug.serving import make_server
+
+    # 所有 worker 在同一个 socket 上 accept，由内核分配连接
+    server = make_server(host, port, apps, threaded=True, fd=listen_socket.fileno())
+    print(f"👷 Web worker {os.getpid()} 已启动")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Web worker 进程数")
+    parser.add_argument("--socket", default=None, help="推理进程的 Unix socket 路径")
+    args = parser.parse_args()
+
+    address = args.socket or os.path.join(tempfile.gettempdir(), f"chatkg-inference-{args.port}.sock")
+    authkey = os.urandom(16)
+
+    print("🚀 启动CCUS知识图谱+大模型服务器（多进程）...")
+    start = time.time()
+    chat_glm.preload()
+    try:
+        get_graph_index()
+    except FileNotFoundError as e:
+        print(f"⚠️ 三元组图谱预加载失败: {e}")
+    chat_glm.use_inference_server(address, authkey)
+    # 预加载的对象移出 GC 的扫描范围，GC 不再改写它们的对象头，fork 之后少复制页面
+    gc.collect()
+    gc.freeze()
+    print(f"✅ 预加载完成: {time.time() - start:.1f}s")
+
+    apps.secret_key = os.urandom(24)
+    listen_socket = socket.create_server((args.host, args.port), backlog=1024)
+
+    roles = {}
+
+    def spawn(role):
+        if role == "inference":
+            pid = fork(run_inference, listen_socket, address, authkey)
+        else:
+            pid = fork(run_worker, listen_socket, args.host, args.port)
+        roles[pid] = role
+
+    def shutdown(signum, frame):
+        for pid in list(roles):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    spawn("inference")
+    for _ in range(args.workers):
+        spawn("worker")
+    print(f"🌐 服务器启动在 http://{args.host}:{args.port} ({args.workers} 个 Web worker)，模型加载进度见 /api/ready")
+
+    while True:
+        pid, status = os.wait()
+        role = roles.pop(pid, None)
+        if role is None:
+            continue
+        print(f"⚠️ {role} 进程 {pid} 退出 (status {status})，重新启动")
+        time.sleep(1)
+        spawn(role)
+
+
+if __name__ == '__main__':
+    main()
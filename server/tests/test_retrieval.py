@@ -0,0 +1,67 @@
+"""
+检索扇出的超时和线程池隔离
+
+在 server 目录下运行: python -m unittest tests.test_retrieval
+"""
+
+import time
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.retrieval import RetrievalFanOut
+
+
+class RetrievalFanOutTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.retrieval_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='test-retrieval')
+        self.wiki_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='test-wiki')
+
+    def tearDown(self):
+        self.release.set()
+        self.retrieval_pool.shutdown(wait=True)
+        self.wiki_pool.shutdown(wait=True)
+
+    def slow_wiki(self, query):
+        # 模拟外网很慢的维基百科：一直卡到测试结束
+        self.release.wait(10)
+        return {"title": query, "summary": query}
+
+    @staticmethod
+    def kg(query):
+        return [query]
+
+    def run_request(self, query, entities, budget=0.5):
+        fanout = RetrievalFanOut(budget, executor=self.retrieval_pool)
+        fanout.submit("kg", self.kg, query, timeout=0.3)
+        fanout.submit(f"wiki:{query}", self.slow_wiki, query, timeout=0.4, executor=self.wiki_pool)
+        for ent in entities:
+            fanout.submit(f"wiki:{ent}", self.slow_wiki, ent, timeout=0.4, executor=self.wiki_pool)
+
+        kg = fanout.result("kg")
+        wiki = [fanout.result(f"wiki:{ent}") for ent in entities + [query]]
+        fanout.cancel_pending()
+        return kg, wiki, fanout.elapsed()
+
+    def test_slow_source_respects_budget(self):
+        kg, wiki, elapsed = self.run_request("CCUS", ["二氧化碳", "封存"])
+        self.assertEqual(kg, ["CCUS"])
+        self.assertEqual(wiki, [None, None, None])
+        self.assertLess(elapsed, 0.6)
+
+    def test_slow_wiki_does_not_starve_kg(self):
+        # 前面的请求把维基百科的线程全部卡住，并且排队的维基百科任务比检索线程池的线程还多
+        for i in range(5):
+            self.run_request(f"问题{i}", [f"实体{i}-{j}" for j in range(3)])
+
+        # 之后请求的知识图谱检索仍然立刻返回，不会排在卡住的维基百科请求后面
+        start = time.monotonic()
+        fanout = RetrievalFanOut(0.5, executor=self.retrieval_pool)
+        fanout.submit("kg", self.kg, "CCUS", timeout=0.3)
+        self.assertEqual(fanout.result("kg"), ["CCUS"])
+        self.assertLess(time.monotonic() - start, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()